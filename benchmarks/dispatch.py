@@ -0,0 +1,59 @@
+"""
+Measures client-side overhead per call: attribute lookup, argument
+validation, request building and response parsing, with the network
+replaced by a canned response.
+
+    python benchmarks/dispatch.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import disqusapi  # NOQA
+
+BODY = b'{"code": 0, "response": {"id": "1"}}'
+
+
+class CannedResponse(object):
+    status = 200
+    will_close = False
+
+    def getheader(self, name, default=None):
+        if name == 'Content-Type':
+            return 'application/json; charset=utf-8'
+        return default
+
+
+class CannedPool(object):
+    maxsize = 1
+
+    def urlopen(self, host, method, path, body, headers, timeout=None):
+        return CannedResponse(), BODY
+
+
+def bench(name, func, seconds=1.0):
+    calls = 0
+    started = time.time()
+    deadline = started + seconds
+    while time.time() < deadline:
+        for _ in range(1000):
+            func()
+        calls += 1000
+    rate = calls / (time.time() - started)
+    print('%-28s %10.0f calls/s' % (name, rate))
+    return rate
+
+
+def main():
+    api = disqusapi.DisqusAPI('secret', 'public')
+    api.pool = CannedPool()
+    bench('api.threads.details()', lambda: api.threads.details(thread=1))
+    bench('api.posts.list()', lambda: api.posts.list(forum='disqus', limit=25))
+    threads = api.threads
+    bench('threads.details() (bound)', lambda: threads.details(thread=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+A local stand-in for disqus.com, for benchmarking without the network.
+
+    python benchmarks/server.py --port 8000 --latency 20 --page-size 100
+
+Every endpoint in ``interfaces.json`` answers: list endpoints with pages
+of generated objects and cursors, others with a single object. Latency,
+jitter, payload size, gzip and the number of pages are configurable;
+pass ``--cert`` (and ``--key``) to serve HTTPS.
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from disqusapi import get_interfaces  # NOQA
+from disqusapi.compat import urllib_parse  # NOQA
+from disqusapi.records import get_record_type  # NOQA
+
+try:
+    import http.server as http_server
+    import socketserver
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
+
+
+def make_user(n):
+    return {
+        'id': str(n),
+        'username': 'user%d' % n,
+        'name': 'User %d' % n,
+        'profileUrl': 'https://disqus.com/by/user%d/' % n,
+        'isAnonymous': False,
+        'joinedAt': '2014-01-01T00:00:00',
+        'avatar': {'permalink': 'https://disqus.com/api/users/avatars/user%d.jpg' % n},
+    }
+
+
+def make_forum(n):
+    return {
+        'id': 'forum%d' % n,
+        'name': 'Forum %d' % n,
+        'url': 'https://forum%d.example.com' % n,
+        'founder': str(n),
+        'createdAt': '2014-01-01T00:00:00',
+        'language': 'en',
+    }
+
+
+def make_thread(n, padding):
+    return {
+        'id': str(n),
+        'title': 'Thread %d' % n,
+        'link': 'https://example.com/%d/' % n,
+        'forum': 'forum',
+        'author': str(n % 100),
+        'message': 'x' * padding,
+        'createdAt': '2014-01-01T00:00:00',
+        'posts': n % 50,
+        'likes': n % 7,
+        'isClosed': False,
+        'identifiers': [str(n)],
+    }
+
+
+def make_post(n, padding):
+    return {
+        'id': str(n),
+        'message': 'x' * padding,
+        'raw_message': 'x' * padding,
+        'createdAt': '2014-01-01T00:00:00',
+        'author': make_user(n % 100),
+        'thread': str(n // 10),
+        'forum': 'forum',
+        'parent': None,
+        'likes': n % 7,
+        'dislikes': 0,
+        'points': n % 7,
+        'isApproved': True,
+        'isDeleted': False,
+        'isSpam': False,
+        'media': [],
+    }
+
+
+def make_object(endpoint, n, padding):
+    cls = get_record_type(endpoint)
+    name = cls.__name__ if cls is not None else None
+    if name == 'Post':
+        return make_post(n, padding)
+    if name == 'Thread':
+        return make_thread(n, padding)
+    if name == 'User':
+        return make_user(n)
+    if name == 'Forum':
+        return make_forum(n)
+    return {'id': str(n), 'value': 'x' * padding}
+
+
+class Config(object):
+    def __init__(self, latency=0.0, jitter=0.0, page_size=100, pages=10, padding=200,
+                 gzip=True):
+        # Seconds
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.pages = pages
+        # Bytes of text in each object's message
+        self.padding = padding
+        self.gzip = gzip
+
+
+class MockAPIHandler(http_server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; don't let Nagle's
+    # algorithm hold the body back until the client ACKs.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self.respond(path, urllib_parse.parse_qs(query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        self.respond(self.path.partition('?')[0], urllib_parse.parse_qs(body))
+
+    def respond(self, path, params):
+        config = self.server.config
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            # /api/<version>/<resource>/<method>.<format>
+            resource, method = path.split('/', 3)[3].rsplit('.', 1)[0].split('/')
+            get_interfaces()[resource][method]
+        except (ValueError, IndexError, KeyError):
+            return self.send_json(400, {'code': 1, 'response': 'Endpoint not valid'})
+        endpoint = '%s.%s' % (resource, method)
+        if method.startswith('list'):
+            data = self.list_response(endpoint, params, config)
+        else:
+            data = {'response': make_object(endpoint, 1, config.padding)}
+        data['code'] = 0
+        self.server.counters['requests'] += 1
+        self.send_json(200, data)
+
+    def list_response(self, endpoint, params, config):
+        cursor = int(params.get('cursor', ['0'])[0] or 0)
+        limit = int(params.get('limit', [config.page_size])[0])
+        start = cursor * limit
+        more = cursor + 1 < config.pages
+        return {
+            'cursor': {
+                'prev': str(cursor - 1) if cursor else None,
+                'hasPrev': cursor > 0,
+                'next': str(cursor + 1),
+                'hasNext': more,
+                'more': more,
+                'id': str(cursor + 1),
+            },
+            'response': [make_object(endpoint, n, config.padding)
+                         for n in range(start, start + limit)],
+        }
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        gzipped = self.server.config.gzip and \
+            'gzip' in (self.headers.get('Accept-Encoding') or '')
+        if gzipped:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as fp:
+                fp.write(body)
+            body = buf.getvalue()
+        self.server.counters['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    """
+    Serves ``MockAPIHandler`` from a background thread:
+
+    >>> server = MockServer(Config(latency=0.02)).start()
+    >>> server.host
+    '127.0.0.1:53412'
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # Lots of concurrent connections from the async benchmarks
+    request_queue_size = 1024
+
+    def __init__(self, config=None, port=0, cert=None, key=None):
+        http_server.HTTPServer.__init__(self, ('127.0.0.1', port), MockAPIHandler)
+        self.config = config or Config()
+        self.counters = {'requests': 0, 'bytes': 0}
+        self.tls = cert is not None
+        if self.tls:
+            import ssl
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.thread = None
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--padding', type=int, default=200)
+    parser.add_argument('--no-gzip', action='store_true')
+    parser.add_argument('--cert')
+    parser.add_argument('--key')
+    args = parser.parse_args()
+    config = Config(args.latency / 1000.0, args.jitter / 1000.0, args.page_size, args.pages,
+                    args.padding, not args.no_gzip)
+    server = MockServer(config, args.port, args.cert, args.key)
+    print('Serving on %s://%s' % ('https' if server.tls else 'http', server.host))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
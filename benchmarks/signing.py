@@ -0,0 +1,41 @@
+"""
+Measures request signing throughput: the ``disqusapi.utils`` functions
+against a ``Signer`` reused between calls, one at a time and in batches.
+
+    python benchmarks/signing.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from disqusapi import utils  # NOQA
+from dispatch import bench  # NOQA
+
+SECRET = 'b' * 64
+URL = 'https://disqus.com/api/3.0/threads/details.json?thread=%d&related=forum&api_key=%s' % (
+    1, 'c' * 64)
+PARAMS = [('thread', 1), ('related', 'forum'), ('api_key', 'c' * 64)]
+POST_URL = 'https://disqus.com/api/3.0/posts/create.json'
+POST_PARAMS = [('thread', 1), ('message', 'Hello world ' * 20), ('api_key', 'c' * 64)]
+
+
+def sign_functions(url, params):
+    norm = utils.get_normalized_request_string('GET', url, 'nonce', params)
+    return utils.get_mac_signature(SECRET, norm)
+
+
+def main():
+    signer = utils.Signer(SECRET, 'c' * 64)
+    bench('functions (GET)', lambda: sign_functions(URL, PARAMS))
+    bench('Signer.sign (GET)', lambda: signer.sign('GET', URL, PARAMS, nonce='nonce'))
+    bench('functions (POST)', lambda: sign_functions(POST_URL, POST_PARAMS))
+    bench('Signer.sign (POST)', lambda: signer.sign('POST', POST_URL, POST_PARAMS, nonce='nonce'))
+    bench('Signer.get_header (GET)', lambda: signer.get_header('GET', URL, PARAMS))
+    batch = [('GET', URL, PARAMS)] * 100
+    rate = bench('Signer.sign_many (x100)', lambda: signer.sign_many(batch), seconds=1.0)
+    print('%-28s %10.0f signatures/s' % ('', rate * len(batch)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+End-to-end benchmarks against a local mock of the API (``server.py``).
+
+    python benchmarks/suite.py --latency 5 --output results/0.5.0.json
+    python benchmarks/suite.py --compare results/0.5.0.json
+
+Each scenario drives the client through the network stack and reports
+throughput, latency percentiles (from a tracer, so per API call) and
+peak memory allocated. Results are written as JSON; with ``--compare``
+scenarios which got slower (or hungrier) than ``--threshold`` allows
+are reported and the exit status is 1.
+
+The server runs in the same process, so numbers are only comparable
+between runs on the same machine with the same options.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import disqusapi  # NOQA
+from disqusapi.compat import http_client as httplib  # NOQA
+from disqusapi.tracing import Tracer  # NOQA
+
+from server import Config, MockServer  # NOQA
+
+SCENARIOS = []
+
+
+def scenario(func):
+    SCENARIOS.append(func)
+    return func
+
+
+class LatencyRecorder(Tracer):
+    def __init__(self):
+        self.latencies = []
+
+    def finish(self, trace):
+        self.latencies.append(trace.duration)
+
+
+def get_connection_class(server):
+    if not server.tls:
+        return httplib.HTTPConnection
+    import ssl
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    class Connection(httplib.HTTPSConnection):
+        def __init__(self, host, timeout=None):
+            httplib.HTTPSConnection.__init__(self, host, timeout=timeout, context=context)
+    return Connection
+
+
+def get_api(server, tracer, **kwargs):
+    class Pool(disqusapi.ConnectionPool):
+        connection_class = get_connection_class(server)
+
+    disqusapi.HOST = server.host
+    return disqusapi.DisqusAPI('secret', 'public', pool=Pool(maxsize=kwargs.pop('maxsize', 10)),
+                               tracer=tracer, **kwargs)
+
+
+def get_async_api(server, tracer, concurrency):
+    from disqusapi import aio
+    host, port = server.server_address
+
+    class Connection(aio.AsyncConnection):
+        def __init__(self, _):
+            ssl = None
+            if server.tls:
+                import ssl as _ssl
+                ssl = _ssl.SSLContext(_ssl.PROTOCOL_TLS_CLIENT)
+                ssl.check_hostname = False
+                ssl.verify_mode = _ssl.CERT_NONE
+            super(Connection, self).__init__(host, port, ssl=ssl or False)
+
+    class Pool(aio.AsyncConnectionPool):
+        connection_class = Connection
+
+    return aio.AsyncDisqusAPI('secret', 'public', pool=Pool(maxsize=concurrency),
+                              concurrency=concurrency, tracer=tracer)
+
+
+@scenario
+def details(server, tracer, options):
+    api = get_api(server, tracer)
+    for n in range(options.calls):
+        api.threads.details(thread=n)
+    return options.calls
+
+
+@scenario
+def paginate(server, tracer, options):
+    api = get_api(server, tracer)
+    paginator = disqusapi.Paginator(api.forums.listPosts, forum='disqus')
+    return sum(1 for _ in paginator)
+
+
+@scenario
+def paginate_prefetch(server, tracer, options):
+    api = get_api(server, tracer)
+    paginator = disqusapi.Paginator(api.forums.listPosts, forum='disqus')
+    return sum(1 for _ in paginator(prefetch=True))
+
+
+@scenario
+def paginate_stream_records(server, tracer, options):
+    api = get_api(server, tracer, stream=True, records=True)
+    paginator = disqusapi.Paginator(api.forums.listPosts, forum='disqus')
+    return sum(1 for _ in paginator)
+
+
+@scenario
+def map_threads(server, tracer, options):
+    api = get_api(server, tracer, maxsize=options.concurrency)
+    params = [{'thread': n} for n in range(options.calls)]
+    api.map('threads.details', params, concurrency=options.concurrency)
+    return options.calls
+
+
+@scenario
+def async_gather(server, tracer, options):
+    if sys.version_info < (3, 6):
+        return None
+    import asyncio
+    api = get_async_api(server, tracer, options.concurrency)
+
+    async def gather():
+        await asyncio.gather(*[api.threads.details(thread=n) for n in range(options.calls)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(gather())
+    finally:
+        loop.close()
+    return options.calls
+
+
+def percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100.0))]
+
+
+def measure(func, server, options):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    tracer = LatencyRecorder()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    started = time.time()
+    items = func(server, tracer, options)
+    elapsed = time.time() - started
+    if items is None:
+        return None
+    result = {
+        'seconds': round(elapsed, 4),
+        'items': items,
+        'calls': len(tracer.latencies),
+        'calls_per_second': round(len(tracer.latencies) / elapsed, 1),
+        'items_per_second': round(items / elapsed, 1),
+    }
+    for p in (50, 95, 99):
+        result['p%d_ms' % p] = round(percentile(tracer.latencies, p) * 1000, 3)
+    if tracemalloc is not None:
+        result['peak_memory_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024.0, 1)
+        tracemalloc.stop()
+    return result
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Lower is better for these; higher for the rest
+LOWER_IS_BETTER = ('seconds', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_kb')
+COMPARED = ('calls_per_second', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_memory_kb')
+
+
+def compare(baseline, results, threshold):
+    """
+    Prints how each scenario changed since ``baseline`` and returns the
+    regressions larger than ``threshold`` (a fraction).
+    """
+    regressions = []
+    for name, result in sorted(results['scenarios'].items()):
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        for key in COMPARED:
+            if not before.get(key) or key not in result:
+                continue
+            change = (result[key] - before[key]) / float(before[key])
+            worse = change > threshold if key in LOWER_IS_BETTER else change < -threshold
+            print('%-26s %-18s %12s -> %-12s %+7.1f%%%s' % (
+                name, key, before[key], result[key], change * 100, '  REGRESSION' if worse else ''))
+            if worse:
+                regressions.append((name, key, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('scenarios', nargs='*', help='default: all')
+    parser.add_argument('--latency', type=float, default=2, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--padding', type=int, default=200)
+    parser.add_argument('--no-gzip', action='store_true')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--cert')
+    parser.add_argument('--key')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    options = parser.parse_args()
+
+    config = Config(options.latency / 1000.0, options.jitter / 1000.0, options.page_size,
+                    options.pages, options.padding, not options.no_gzip)
+    server = MockServer(config, cert=options.cert, key=options.key).start()
+    selected = [s for s in SCENARIOS if not options.scenarios or s.__name__ in options.scenarios]
+    results = {
+        'version': disqusapi.__version__,
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': dict((k, v) for k, v in vars(options).items()
+                       if k not in ('scenarios', 'output', 'compare', 'threshold')),
+        'scenarios': {},
+    }
+    try:
+        for func in selected:
+            result = measure(func, server, options)
+            if result is None:
+                continue
+            results['scenarios'][func.__name__] = result
+            print('%-26s %8.1f calls/s %10.1f items/s  p50 %7.2fms  p99 %7.2fms%s' % (
+                func.__name__, result['calls_per_second'], result['items_per_second'],
+                result['p50_ms'], result['p99_ms'],
+                '  peak %.0fKB' % result['peak_memory_kb'] if 'peak_memory_kb' in result else ''))
+    finally:
+        server.stop()
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+
+    if options.compare:
+        with open(options.compare) as fp:
+            baseline = json.load(fp)
+        if baseline.get('config') != results['config']:
+            print('warning: baseline was run with different options')
+        if compare(baseline, results, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
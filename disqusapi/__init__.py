@@ -6,33 +6,68 @@ disqus = DisqusAPI(api_secret=secret_key)
 disqus.get('trends.listThreads')
 
 """
-try:
-    __version__ = __import__('pkg_resources') \
-        .get_distribution('disqusapi').version
-except Exception:  # pragma: no cover
-    __version__ = 'unknown'
+__version__ = '0.4.2'
 
 import re
+import sys
 import zlib
 import os.path
 import warnings
 import socket
+import threading
+import time
 
 try:
     import simplejson as json
 except ImportError:
     import json
 
+from disqusapi.cache import (
+    CachedResponse, FileCache, MemoryCache, RevalidationCache, get_cache_key, get_headers,
+    is_related)
+from disqusapi.coalesce import Coalescer
+from disqusapi.hedging import Hedging
+from disqusapi.jsonlib import get_decoder
 from disqusapi.paginator import Paginator
+from disqusapi.records import get_converter
+from disqusapi.stream import ResponseStream, iter_chunks
+from disqusapi.pool import ConnectionPool
+from disqusapi.ratelimit import FileRateLimiter, RateLimiter
+from disqusapi.retry import RETRY_ERRORS, Retry, RetryBudget
+from disqusapi.tracing import Aggregator, Tracer, timer
+from disqusapi.transport import Transport, get_transport
 from disqusapi import compat
-from disqusapi.compat import http_client as httplib
+from disqusapi.compat import queue
+from disqusapi.endpoints import Endpoint, compile_interfaces
 from disqusapi.compat import urllib_parse as urllib
-from disqusapi.utils import build_interfaces_by_method
+from disqusapi.utils import Signer, build_interfaces_by_method, merge_params, spread_results
+
+__all__ = ['DisqusAPI', 'Paginator', 'ConnectionPool', 'MemoryCache', 'FileCache',
+           'RevalidationCache', 'RateLimiter', 'FileRateLimiter', 'Retry', 'RetryBudget', 'Hedging',
+           'DeadlineExceeded', 'Tracer', 'Aggregator', 'Transport']
+
+_interfaces = None
+
 
-__all__ = ['DisqusAPI', 'Paginator']
+def get_interfaces():
+    """
+    Returns the bundled interface definitions, loading them on first use.
+    """
+    global _interfaces
+    if _interfaces is None:
+        with open(os.path.join(os.path.dirname(__file__), 'interfaces.json')) as fp:
+            _interfaces = json.load(fp)
+    return _interfaces
 
-with open(os.path.join(os.path.dirname(__file__), 'interfaces.json')) as fp:
-    INTERFACES = json.load(fp)
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # Keeps ``disqusapi.INTERFACES`` working without loading it on import
+        if name == 'INTERFACES':
+            return get_interfaces()
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+else:
+    INTERFACES = get_interfaces()
 
 HOST = 'disqus.com'
 
@@ -68,6 +103,18 @@ class APIError(Exception):
 class InvalidAccessToken(APIError):
     pass
 
+
+class DeadlineExceeded(socket.timeout):
+    """
+    A call took longer than its ``deadline`` overall, counting retries,
+    hedges and time spent waiting on the rate limiter.
+    """
+    def __init__(self, endpoint, deadline):
+        super(DeadlineExceeded, self).__init__(
+            '%s did not complete within %ss' % (endpoint, deadline))
+        self.endpoint = endpoint
+        self.deadline = deadline
+
 ERROR_MAP = {
     18: InvalidAccessToken,
 }
@@ -98,15 +145,89 @@ class Result(object):
         return list.__contains__(self.response, key)
 
 
+class StreamingResult(Result):
+    """
+    A ``Result`` whose items are decoded as they are iterated over, and
+    so can only be iterated once. Indexing or ``len()`` reads the items
+    left into memory.
+    """
+    def __init__(self, stream, convert=None):
+        self.stream = stream
+        self.items = stream.items()
+        if convert is not None:
+            self.items = compat.imap(convert, self.items)
+        self.pending = []
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, 'done' if self.stream.finished else 'open')
+
+    def __iter__(self):
+        # ``pending`` may grow while we iterate over it
+        for r in self.pending:
+            yield r
+        for r in self.items:
+            yield r
+
+    @property
+    def cursor(self):
+        if 'cursor' not in self.stream.data and not self.stream.finished:
+            # The cursor came after the items; buffer them to get to it
+            self.pending.extend(self.items)
+        return self.stream.data.get('cursor') or {}
+
+    @property
+    def response(self):
+        self.pending.extend(self.items)
+        return self.pending
+
+
+class Request(object):
+    """
+    A fully built API call, ready to be sent over the wire.
+
+    ``headers`` may be shared with other requests; copy it before
+    making changes.
+    """
+    def __init__(self, method, endpoint, path, body, headers, format, params,
+                 interface=None, stream=False, records=False, fields=None, deadline=None):
+        self.method = method
+        self.endpoint = endpoint
+        self.path = path
+        self.body = body
+        self.headers = headers
+        self.format = format
+        self.params = params
+        self.interface = interface or {}
+        self.stream = stream
+        self.records = records
+        self.fields = fields
+        # Seconds the whole call may take, retries included
+        self.deadline = deadline
+        self.cache_key = None
+        # A ``disqusapi.tracing.Trace`` when the client has a tracer
+        self.trace = None
+
+    def __repr__(self):
+        return '<%s: %s %s>' % (self.__class__.__name__, self.method, self.endpoint)
+
+
 class Resource(object):
-    def __init__(self, api, interfaces=INTERFACES, node=None, tree=()):
+    interfaces_by_method = {}
+
+    def __init__(self, api, interfaces=None, node=None, tree=()):
+        if interfaces is None:
+            interfaces = get_interfaces()
         self.api = api
         self.node = node
         self.interfaces = interfaces
         if node:
             tree = tree + (node,)
         self.tree = tree
-        self.interfaces_by_method = {}
+        # The compiled ``Endpoint`` for this node, if it is one
+        endpoint = api.endpoints.get('.'.join(tree))
+        if endpoint is not None and endpoint.interface is not interfaces:
+            endpoint = None
+        self.endpoint = endpoint
 
     def update_interface(self, interface):
         raise NotImplemented
@@ -124,24 +245,43 @@ class Resource(object):
                 interface = self.interfaces_by_method[attr]
             except KeyError:
                 pass
-        return Resource(self.api, interface, attr, self.tree)
+        resource = self.api.resource_class(self.api, interface, attr, self.tree)
+        if not attr.startswith('__'):
+            # Later lookups of ``attr`` won't go through ``__getattr__``
+            self.__dict__[attr] = resource
+        return resource
 
     def __call__(self, endpoint=None, **kwargs):
         return self._request(endpoint, **kwargs)
 
     def _request(self, endpoint=None, **kwargs):
+        request = self._build_request(endpoint, kwargs)
+        if request.trace is None:
+            response, body = self.api._send(request)
+            return self._handle_response(request, response, body)
+        with request.trace:
+            response, body = self.api._send(request)
+            return self._handle_response(request, response, body)
+
+    def _build_request(self, endpoint, kwargs):
+        """
+        Validates the call against its interface and returns the
+        ``Request`` to send.
+        """
+        api = self.api
         if endpoint is not None:
             # Handle undefined interfaces
-            resource = self.interfaces.get(endpoint, {})
-            endpoint = endpoint.replace('.', '/')
+            interface = self.interfaces.get(endpoint, {})
+            compiled = api.endpoints.get(endpoint)
+            if compiled is None or compiled.interface is not interface:
+                compiled = Endpoint(endpoint, interface)
         else:
-            resource = self.interfaces
-            endpoint = '/'.join(self.tree)
-        for k in resource.get('required', []):
-            if k not in (x.split(':')[0] for x in compat.iterkeys(kwargs)):
-                raise ValueError('Missing required argument: %s' % k)
+            compiled = self.endpoint
+            if compiled is None:
+                compiled = self.endpoint = Endpoint('.'.join(self.tree), self.interfaces)
+        compiled.validate(kwargs)
 
-        method = kwargs.pop('method', resource.get('method'))
+        method = kwargs.pop('method', compiled.method)
 
         if not method:
             raise InterfaceNotDefined(
@@ -151,18 +291,29 @@ class Resource(object):
         if method not in ('GET', 'POST'):
             raise InvalidHTTPMethod(method)
 
-        api = self.api
-
         version = kwargs.pop('version', api.version)
         format = kwargs.pop('format', api.format)
-        formatter, formatter_error = api.formats[format]
+        stream = kwargs.pop('stream', api.stream)
+        records = kwargs.pop('records', api.records)
+        fields = kwargs.pop('fields', None)
+        if 'deadline' in kwargs:
+            deadline = kwargs.pop('deadline')
+        elif api.deadlines:
+            deadline = api.deadlines.get(compiled.name)
+        else:
+            deadline = None
 
-        path = '/api/%s/%s.%s' % (version, endpoint, format)
+        path = compiled.get_path(version, format)
 
-        if 'api_secret' not in kwargs and api.secret_key:
-            kwargs['api_secret'] = api.secret_key
-        if 'api_public' not in kwargs and api.public_key:
-            kwargs['api_key'] = api.public_key
+        if 'api_secret' not in kwargs and 'api_public' not in kwargs:
+            # The common case, credentials are encoded once per client
+            auth_params, auth_query = api._get_auth_params()
+        else:
+            if 'api_secret' not in kwargs and api.secret_key:
+                kwargs['api_secret'] = api.secret_key
+            if 'api_public' not in kwargs and api.public_key:
+                kwargs['api_key'] = api.public_key
+            auth_params, auth_query = (), ''
 
         # We need to ensure this is a list so that
         # multiple values for a key work
@@ -174,31 +325,38 @@ class Resource(object):
             else:
                 params.append((k, v))
 
-        headers = {
-            'User-Agent': 'disqus-python/%s' % __version__,
-            'Accept-Encoding': 'gzip',
-        }
+        query = urllib.urlencode(params)
+        if auth_query:
+            query = '%s&%s' % (query, auth_query) if query else auth_query
+            params.extend(auth_params)
 
+        headers = api.headers[method]
         if method == 'GET':
-            path = '%s?%s' % (path, urllib.urlencode(params))
+            path = '%s?%s' % (path, query)
             data = ''
         else:
-            data = urllib.urlencode(params)
-            headers['Content-Type'] = 'application/x-www-form-urlencoded'
-
-        conn = httplib.HTTPSConnection(HOST, timeout=api.timeout)
-        conn.request(method, path, data, headers)
-        response = conn.getresponse()
-
-        try:
-            body = response.read()
-        finally:
-            # Close connection
-            conn.close()
-
-        if response.getheader('Content-Encoding') == 'gzip':
-            # See: http://stackoverflow.com/a/2424549
-            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            data = query
+        if api.signer is not None:
+            headers = dict(headers, Authorization=api.signer.get_header(
+                method, 'https://%s%s' % (HOST, path), params))
+
+        request = Request(method, compiled.name, path, data, headers,
+                          format, params, compiled.interface, stream, records, fields, deadline)
+        if api.tracer is not None:
+            request.trace = api.tracer.start(request)
+        return request
+
+    def _handle_response(self, request, response, body):
+        """
+        Turns a raw ``(response, body)`` pair into a ``Result`` (for lists)
+        or the bare response object, raising ``APIError`` on failures.
+        """
+        formatter, formatter_error = self.api.formats[request.format]
+        gzipped = response.getheader('Content-Encoding') == 'gzip'
+        trace = request.trace
+        if trace is not None:
+            trace.status = response.status
+            trace.sizes['response'] = len(body)
 
         # Determine the encoding of the response and respect
         # the Content-Type header, but default back to utf-8
@@ -211,39 +369,175 @@ class Resource(object):
             except AttributeError:
                 encoding = DEFAULT_ENCODING
 
-        body = body.decode(encoding)
+        if response.status == 200 and (request.records or request.fields is not None):
+            convert = get_converter(request.endpoint, request.records, request.fields)
+        else:
+            convert = None
+
+        if request.stream and request.format == 'json' and response.status == 200:
+            stream = ResponseStream(iter_chunks(body, gzipped), encoding)
+            if stream.start():
+                return StreamingResult(stream, convert)
+            data = stream.data
+            return convert(data['response']) if convert else data['response']
+
+        if trace is not None:
+            started = timer()
+        if gzipped:
+            # See: http://stackoverflow.com/a/2424549
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            if trace is not None:
+                trace.add('decompress', timer() - started)
+                started = timer()
+
+        if request.format in self.api.bytes_formats and \
+                encoding.lower().replace('-', '') == 'utf8':
+            # Parsed as is, saving a copy of the body
+            if trace is not None:
+                trace.sizes['decoded'] = len(body)
+        else:
+            body = body.decode(encoding)
+            if trace is not None:
+                trace.add('decode', timer() - started)
+                trace.sizes['decoded'] = len(body)
+        if trace is not None:
+            started = timer()
 
         try:
             # Coerce response to Python
             data = formatter(body)
         except formatter_error:
+            if isinstance(body, bytes):
+                body = body.decode(encoding, 'replace')
             raise FormattingError(body)
+        if trace is not None:
+            trace.add('parse', timer() - started)
 
         if response.status != 200:
             raise ERROR_MAP.get(data['code'], APIError)(data['code'], data['response'])
 
-        if isinstance(data['response'], list):
-            return Result(data['response'], data.get('cursor'))
-        return data['response']
+        result = data['response']
+        if isinstance(result, list):
+            if convert is not None:
+                result = [convert(r) for r in result]
+            return Result(result, data.get('cursor'))
+        if convert is not None:
+            return convert(result)
+        return result
+
+
+_json_loads, _json_error, _json_bytes = get_decoder()
 
 
 class DisqusAPI(Resource):
+    # What ``with_options`` can change
+    derived_options = frozenset([
+        'secret_key', 'public_key', 'format', 'version', 'timeout', 'stream', 'records',
+        'deadlines', 'cache_ttl', 'tracer', 'retry', 'hedging', 'rate_limiter', 'cache',
+        'revalidate', 'signer'])
     formats = {
-        'json': (json.loads, ValueError),
+        'json': (_json_loads, _json_error),
     }
+    # Formats whose parser takes UTF-8 bytes as they are
+    bytes_formats = frozenset(['json']) if _json_bytes else frozenset()
+    resource_class = Resource
 
     def __init__(self, secret_key=None, public_key=None, format='json', version='3.0',
-                 timeout=None, interfaces=INTERFACES, **kwargs):
+                 timeout=None, interfaces=None, pool=None, cache=None,
+                 cache_ttl=None, stream=False, records=False, rate_limiter=None, retry=None,
+                 hedging=None, deadlines=None, tracer=None, transport=None, json_decoder=None,
+                 revalidate=None, coalesce=False, signer=None, **kwargs):
         self.secret_key = secret_key
         self.public_key = public_key
         if not public_key:
             warnings.warn('You should pass ``public_key`` in addition to your secret key.')
         self.format = format
         self.version = version
+        # Decode list responses lazily, see ``disqusapi.stream``
+        self.stream = stream
+        # Return ``disqusapi.records`` types instead of dicts
+        self.records = records
         self.timeout = timeout or socket.getdefaulttimeout()
+        if interfaces is None:
+            interfaces = get_interfaces()
         self.interfaces = interfaces
-        self.interfaces_by_method = build_interfaces_by_method(self.interfaces)
-        super(DisqusAPI, self).__init__(self)
+        self._interfaces_by_method = None
+        self.endpoints = compile_interfaces(interfaces)
+        self.headers = {
+            'GET': {
+                'User-Agent': 'disqus-python/%s' % __version__,
+                'Accept-Encoding': 'gzip',
+            },
+            'POST': {
+                'User-Agent': 'disqus-python/%s' % __version__,
+                'Accept-Encoding': 'gzip',
+                'Content-Type': 'application/x-www-form-urlencoded',
+            },
+        }
+        self._auth = None
+        # See ``disqusapi.transport``; ``pool`` is the older name for it
+        self.transport = self._get_transport(transport if transport is not None else pool)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.hedging = hedging
+        # Per-endpoint deadlines (seconds), e.g. ``{'threads.listPosts': 2}``
+        self.deadlines = deadlines
+        # See ``disqusapi.tracing``
+        self.tracer = tracer
+        # Used for GET endpoints whose interface has no ``cache_ttl``
+        self.cache_ttl = cache_ttl
+        # A ``RevalidationCache`` for conditional GETs
+        self.revalidate = revalidate
+        # Shares calls between identical concurrent GETs, see ``disqusapi.coalesce``
+        self.coalesce = self._get_coalescer(coalesce)
+        # Adds an ``Authorization: MAC`` header to every call, see ``disqusapi.utils.Signer``
+        if signer is True:
+            signer = Signer(secret_key, public_key)
+        self.signer = signer
+        if json_decoder is not None:
+            self._set_json_decoder(json_decoder)
+        super(DisqusAPI, self).__init__(self, interfaces)
+
+    def _set_json_decoder(self, decoder):
+        """
+        ``decoder`` is a name from ``disqusapi.jsonlib.DECODERS``, or a
+        ``(loads, error)`` tuple, optionally with a third item saying
+        whether ``loads`` takes bytes.
+        """
+        if isinstance(decoder, compat.string_types):
+            loads, error, accepts_bytes = get_decoder(decoder)
+        else:
+            loads, error = decoder[:2]
+            accepts_bytes = len(decoder) > 2 and decoder[2]
+        self.formats = dict(self.formats, json=(loads, error))
+        if accepts_bytes:
+            self.bytes_formats = self.bytes_formats | frozenset(['json'])
+        else:
+            self.bytes_formats = self.bytes_formats - frozenset(['json'])
+
+    @property
+    def interfaces_by_method(self):
+        # Only needed for ``api.<method>(<endpoint>)`` calls, so built lazily
+        if self._interfaces_by_method is None:
+            self._interfaces_by_method = build_interfaces_by_method(self.interfaces)
+        return self._interfaces_by_method
+
+    def _get_transport(self, transport):
+        return get_transport(transport)
+
+    def _get_coalescer(self, coalesce):
+        if coalesce is True:
+            return Coalescer()
+        return coalesce or None
+
+    @property
+    def pool(self):
+        return self.transport
+
+    @pool.setter
+    def pool(self, transport):
+        self.transport = transport
 
     @property
     def key(self):
@@ -288,6 +582,363 @@ class DisqusAPI(Resource):
             DeprecationWarning)
         self.timeout = timeout
 
+    def _get_auth_params(self):
+        """
+        Returns the credential params and their urlencoded form, worked
+        out again only when the keys change.
+        """
+        key = (self.secret_key, self.public_key)
+        auth = self._auth
+        if auth is None or auth[0] != key:
+            params = []
+            if self.secret_key:
+                params.append(('api_secret', self.secret_key))
+            if self.public_key:
+                params.append(('api_key', self.public_key))
+            auth = self._auth = (key, params, urllib.urlencode(params))
+        return auth[1], auth[2]
+
+    def _resolve(self, endpoint):
+        resource = self
+        for part in endpoint.split('.'):
+            resource = getattr(resource, part)
+        return resource
+
+    def map(self, endpoint, params_list, concurrency=None, merge=None, merge_size=100):
+        """
+        Calls ``endpoint`` once for each dict in ``params_list``, running up
+        to ``concurrency`` calls at once (the pool size by default), and
+        returns the results in order. A failed call has its exception in
+        place of its result rather than aborting the whole batch.
+
+        With ``merge``, calls which only differ by that parameter are sent
+        together, up to ``merge_size`` values at a time, and the objects
+        returned are matched back to each call by id:
+
+        >>> api.map('threads.list', [{'thread': t} for t in ids], merge='thread')
+        """
+        params_list = list(params_list)
+        calls = merge_params(params_list, merge, merge_size)
+        resource = self._resolve(endpoint)
+        outcomes = [None] * len(calls)
+        pending = queue.Queue()
+        for n, (params, _) in enumerate(calls):
+            pending.put((n, params))
+
+        def worker():
+            while True:
+                try:
+                    n, params = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    outcomes[n] = resource(**params)
+                except Exception as e:
+                    outcomes[n] = e
+
+        if concurrency is None:
+            concurrency = getattr(self.transport, 'maxsize', 10)
+        workers = [threading.Thread(target=worker)
+                   for _ in range(min(concurrency, len(calls)))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return spread_results(calls, outcomes, merge, len(params_list))
+
+    def _send(self, request):
+        """
+        Returns the ``(response, body)`` for ``request``, from the cache
+        or the network.
+        """
+        cached = self._cache_get(request)
+        if cached is not None:
+            if request.trace is not None:
+                request.trace.cached = True
+            return cached
+        if self.coalesce is None or request.method != 'GET':
+            return self._send_uncached(request)
+        if request.cache_key is None:
+            request.cache_key = get_cache_key(request)
+        call, leader = self.coalesce.join(request.cache_key)
+        if not leader:
+            # The same call is in flight already
+            started = timer()
+            expires = self._get_expires(request)
+        while not leader:
+            try:
+                result = call.wait(None if expires is None else max(0, expires - time.time()))
+            except DeadlineExceeded:
+                # The leader's own deadline, which doesn't apply here:
+                # one of the callers left sends the call again
+                call, leader = self.coalesce.join(request.cache_key)
+                continue
+            if result is None:
+                raise DeadlineExceeded(request.endpoint, request.deadline)
+            if request.trace is not None:
+                request.trace.add('coalesce', timer() - started)
+            return result
+        return self.coalesce.run(request.cache_key, call, lambda: self._send_uncached(request))
+
+    def _send_uncached(self, request):
+        stored = self._revalidate_prepare(request)
+        response, body = self._fetch(request)
+        response, body = self._revalidate_update(request, stored, response, body)
+        self._cache_update(request, response, body)
+        return response, body
+
+    def _fetch(self, request):
+        """
+        Sends ``request`` over the network, retrying as ``retry`` allows,
+        within the request's ``deadline``.
+        """
+        retry = self.retry
+        if retry is not None:
+            retry.on_request()
+        hedging = self._get_hedging(request)
+        expires = self._get_expires(request)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                wait = self.rate_limiter.reserve()
+                if wait > 0:
+                    if expires is not None and time.time() + wait >= expires:
+                        raise DeadlineExceeded(request.endpoint, request.deadline)
+                    time.sleep(wait)
+                    if request.trace is not None:
+                        request.trace.add('throttle', wait)
+            if request.trace is not None:
+                request.trace.attempts += 1
+            try:
+                response, body = self._urlopen(request, expires, hedging)
+            except DeadlineExceeded:
+                raise
+            except RETRY_ERRORS:
+                if retry is None or not retry.allow(request, attempt):
+                    raise
+            else:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.update_from_response(response)
+                if retry is None or response.status not in retry.statuses or \
+                        not retry.allow(request, attempt):
+                    return response, body
+            backoff = retry.get_backoff(attempt)
+            if expires is not None and time.time() + backoff >= expires:
+                raise DeadlineExceeded(request.endpoint, request.deadline)
+            time.sleep(backoff)
+            if request.trace is not None:
+                request.trace.add('backoff', backoff)
+            attempt += 1
+
+    def _get_hedging(self, request):
+        hedging = self.hedging
+        if hedging is None or not hedging.is_hedgeable(request):
+            return None
+        hedging.on_request()
+        return hedging
+
+    def _get_expires(self, request):
+        if request.deadline is None:
+            return None
+        return time.time() + request.deadline
+
+    def _get_timeout(self, request, expires):
+        """
+        The socket timeout for an attempt at ``request``: the client's
+        ``timeout``, shortened to what is left of the deadline.
+        """
+        if expires is None:
+            return self.timeout
+        remaining = expires - time.time()
+        if remaining <= 0:
+            raise DeadlineExceeded(request.endpoint, request.deadline)
+        if self.timeout is None:
+            return remaining
+        return min(self.timeout, remaining)
+
+    def _urlopen(self, request, expires, hedging):
+        if expires is None and hedging is None:
+            return self._transport_urlopen(request, self.timeout)
+        return self._race(request, expires, hedging)
+
+    def _transport_urlopen(self, request, timeout):
+        if request.trace is None:
+            return self.transport.urlopen(
+                HOST, request.method, request.path, request.body, request.headers,
+                timeout=timeout)
+        return self.transport.urlopen(
+            HOST, request.method, request.path, request.body, request.headers,
+            timeout=timeout, trace=request.trace)
+
+    def _race(self, request, expires, hedging):
+        """
+        Sends ``request`` from a background thread, so that waiting on it
+        can stop at the deadline, and with ``hedging`` sends a duplicate
+        if no answer came within the hedging delay. Calls given up on
+        finish in the background.
+        """
+        timeout = self._get_timeout(request, expires)
+        answers = queue.Queue()
+
+        def send(hedge):
+            started = time.time()
+            try:
+                answer = self._transport_urlopen(request, timeout)
+            except Exception as e:
+                answers.put((hedge, None, e))
+            else:
+                answers.put((hedge, answer, time.time() - started))
+
+        def start(hedge):
+            thread = threading.Thread(target=send, args=(hedge,))
+            thread.daemon = True
+            thread.start()
+
+        def get(wait):
+            if expires is not None:
+                remaining = expires - time.time()
+                if wait is None or remaining < wait:
+                    wait = max(remaining, 0)
+            try:
+                return answers.get(timeout=wait)
+            except queue.Empty:
+                if expires is not None and time.time() >= expires:
+                    raise DeadlineExceeded(request.endpoint, request.deadline)
+                return None
+
+        start(False)
+        in_flight = 1
+        hedged = False
+        answer = None
+        if hedging is not None:
+            answer = get(hedging.get_delay(request.endpoint))
+            if answer is None and hedging.allow():
+                start(True)
+                in_flight += 1
+                hedged = True
+        while True:
+            while answer is None:
+                answer = get(None)
+            in_flight -= 1
+            hedge, result, extra = answer
+            if result is None:
+                # Give the other call a chance before failing
+                if in_flight:
+                    answer = None
+                    continue
+                raise extra
+            if hedging is not None:
+                hedging.observe(request.endpoint, extra)
+                if hedged:
+                    hedging.record_winner(hedge)
+            return result
+
+    def _cache_get(self, request):
+        """
+        Returns a cached ``(response, body)`` pair for ``request``, or None.
+        """
+        if self.cache is None or request.method != 'GET':
+            return None
+        ttl = request.interface.get('cache_ttl', self.cache_ttl)
+        if not ttl:
+            return None
+        request.cache_key = get_cache_key(request)
+        cached = self.cache.get(request.endpoint, request.cache_key)
+        if cached is None:
+            return None
+        headers, body = cached
+        return CachedResponse(headers), body
+
+    def _revalidate_prepare(self, request):
+        """
+        Makes ``request`` conditional if a copy of its response is stored,
+        and returns that copy.
+        """
+        if self.revalidate is None or request.method != 'GET':
+            return None
+        if request.cache_key is None:
+            request.cache_key = get_cache_key(request)
+        stored = self.revalidate.get(request.endpoint, request.cache_key)
+        if stored is None:
+            return None
+        validators, headers, body = stored
+        request.headers = dict(request.headers, **validators)
+        return stored
+
+    def _revalidate_update(self, request, stored, response, body):
+        """
+        Returns the stored copy if the API answered ``304``, otherwise
+        stores the new response if it can be revalidated.
+        """
+        if self.revalidate is None or request.method != 'GET':
+            return response, body
+        if response.status == 304 and stored is not None:
+            self.revalidate._incr('not_modified')
+            validators, headers, body = stored
+            if request.trace is not None:
+                request.trace.cached = True
+            return CachedResponse(headers), body
+        if response.status != 200:
+            return response, body
+        if stored is not None:
+            self.revalidate._incr('modified')
+        validators = {}
+        etag = response.getheader('ETag')
+        if etag is not None:
+            validators['If-None-Match'] = etag
+        last_modified = response.getheader('Last-Modified')
+        if last_modified is not None:
+            validators['If-Modified-Since'] = last_modified
+        if validators:
+            self.revalidate.set(
+                request.endpoint, request.cache_key, (validators, get_headers(response), body))
+        elif stored is not None:
+            self.revalidate.delete(request.endpoint, request.cache_key)
+        return response, body
+
+    def _cache_update(self, request, response, body):
+        if self.cache is None or response.status != 200:
+            return
+        if request.method == 'POST':
+            self.cache.invalidate(lambda endpoint: is_related(endpoint, request.endpoint))
+        elif request.cache_key is not None:
+            # The key may have been made for ``revalidate`` only
+            ttl = request.interface.get('cache_ttl', self.cache_ttl)
+            if ttl:
+                self.cache.set(request.endpoint, request.cache_key,
+                               (get_headers(response), body), ttl)
+
+    def with_options(self, **options):
+        """
+        Returns a client differing from this one by ``options`` (any of
+        ``derived_options``), which shares its transport, caches and
+        compiled interfaces. Neither client is changed by the other.
+        """
+        for name in options:
+            if name not in self.derived_options:
+                raise TypeError('with_options() got an unexpected option %r' % name)
+        api = object.__new__(self.__class__)
+        for attr, value in compat.iteritems(self.__dict__):
+            # Resources cached by ``__getattr__`` are bound to this client
+            if not isinstance(value, Resource):
+                api.__dict__[attr] = value
+        api.api = api
+        if options.get('signer') is True or (
+                'signer' not in options and self.signer is not None and
+                ('secret_key' in options or 'public_key' in options)):
+            options['signer'] = Signer(options.get('secret_key', self.secret_key),
+                                       options.get('public_key', self.public_key))
+        api.__dict__.update(options)
+        return api
+
     def update_interface(self, new_interface):
-        self.interfaces.update(new_interface)
-        self.interfaces_by_method = build_interfaces_by_method(self.interfaces)
+        # Copied, as the interfaces may be shared with other clients
+        interfaces = dict(self.interfaces)
+        interfaces.update(new_interface)
+        self.interfaces = interfaces
+        self._interfaces_by_method = None
+        self.endpoints = compile_interfaces(self.interfaces)
+        # Drop resources cached by ``__getattr__``, they may be stale
+        for attr, value in list(self.__dict__.items()):
+            if isinstance(value, Resource) and value is not self:
+                del self.__dict__[attr]
@@ -0,0 +1,670 @@
+"""
+asyncio support (Python 3.6+).
+
+>>> api = AsyncDisqusAPI(secret_key, public_key, concurrency=200)
+>>> thread = await api.threads.details(thread=1)
+>>> threads = await asyncio.gather(*[
+...     api.threads.details(thread=t) for t in thread_ids])
+>>> async for post in AsyncPaginator(api.forums.listPosts, forum='disqus'):
+...     print(post)
+"""
+import asyncio
+import os
+import socket
+import time
+from collections import deque
+
+import disqusapi
+from disqusapi import DeadlineExceeded, DisqusAPI, Paginator, Resource
+from disqusapi.cache import get_cache_key
+from disqusapi.cassette import RecordingTransport, ReplayTransport
+from disqusapi.coalesce import Coalescer
+from disqusapi.compat import http_client as httplib
+from disqusapi.paginator import DEFAULT_LIMIT, PageSizer, set_page_limit
+from disqusapi.pool import PoolTimeout, is_stale
+from disqusapi.retry import RETRY_ERRORS
+from disqusapi.tracing import timer
+from disqusapi.transport import HTTP2Transport, HTTPXResponse, Transport
+from disqusapi.utils import merge_params, spread_results
+
+
+class AsyncResponse(object):
+    """
+    The parts of ``httplib.HTTPResponse`` the client relies on.
+    """
+    def __init__(self, status, reason, headers, will_close):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.will_close = will_close
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+
+class AsyncConnection(object):
+    """
+    A minimal HTTP/1.1 client connection on top of asyncio streams.
+    """
+    def __init__(self, host, port=443, ssl=True):
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl or None)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    def is_dropped(self):
+        """
+        Whether the other end closed the connection while it was idle.
+        """
+        if self.writer is None:
+            return False
+        return self.writer.transport.is_closing() or self.reader.at_eof() or \
+            self.reader.exception() is not None
+
+    async def request(self, method, path, body, headers, trace=None):
+        """
+        Sends a request and returns ``(response, body)`` with the body
+        fully read.
+        """
+        await self.send(method, path, body, headers, trace)
+        return await self._read_response(trace)
+
+    async def send(self, method, path, body, headers, trace=None):
+        """
+        Connects if needed and writes a request.
+        """
+        if trace is not None:
+            started = timer()
+        if self.writer is None:
+            await self.connect()
+            if trace is not None:
+                trace.add('connect', timer() - started)
+                started = timer()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % self.host]
+        for name, value in headers.items():
+            lines.append('%s: %s' % (name, value))
+        if body or method == 'POST':
+            lines.append('Content-Length: %d' % len(body))
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+        if trace is not None:
+            trace.add('send', timer() - started)
+
+    async def _read_response(self, trace=None):
+        reader = self.reader
+        waiting = trace is not None
+        if waiting:
+            started = timer()
+        while True:
+            line = await reader.readline()
+            if waiting:
+                # Time to first byte
+                trace.add('wait', timer() - started)
+                started = timer()
+                waiting = False
+            if not line:
+                raise httplib.BadStatusLine('Connection closed by remote end')
+            try:
+                version, status, reason = (line.decode('latin-1').rstrip('\r\n') + ' ') \
+                    .split(' ', 2)
+                status = int(status)
+            except ValueError:
+                raise httplib.BadStatusLine(line)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            # Skip informational responses (100 Continue and friends)
+            if status >= 200:
+                break
+
+        connection = headers.get('connection', '').lower()
+        will_close = connection == 'close' or (
+            version == 'HTTP/1.0' and connection != 'keep-alive')
+
+        if status < 200 or status in (204, 304):
+            # Never have a body, whatever the headers say (RFC 7230 3.3.3)
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if not size:
+                    # Trailers end with an empty line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            will_close = True
+        if trace is not None:
+            trace.add('read', timer() - started)
+
+        return AsyncResponse(status, reason.strip(), headers, will_close), body
+
+
+class AsyncConnectionPool(Transport):
+    """
+    The asyncio counterpart of ``disqusapi.pool.ConnectionPool``.
+    """
+    connection_class = AsyncConnection
+
+    def __init__(self, maxsize=10, idle_timeout=60, block_timeout=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.block_timeout = block_timeout
+        self.idle = {}
+        self.slots = {}
+        self.pid = os.getpid()
+        self.counters = {
+            'created': 0,
+            'reused': 0,
+            'evicted': 0,
+            'dropped': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'in_use': 0,
+        }
+
+    def _new_conn(self, host):
+        self.counters['created'] += 1
+        return self.connection_class(host)
+
+    async def _get_conn(self, host):
+        if self.pid != os.getpid():
+            # Inherited from the parent process, see ``ConnectionPool``
+            self.idle = {}
+            self.slots = {}
+            self.counters['in_use'] = 0
+            self.pid = os.getpid()
+        try:
+            slots = self.slots[host]
+        except KeyError:
+            # Created lazily so the semaphore binds to the running loop
+            slots = self.slots[host] = asyncio.Semaphore(self.maxsize)
+            self.idle[host] = deque()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.block_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout('No connection to %s available after %ss' % (
+                host, self.block_timeout))
+        self.counters['in_use'] += 1
+
+        idle = self.idle[host]
+        now = time.time()
+        while idle:
+            conn, last_used = idle.pop()
+            if self.idle_timeout is not None and now - last_used > self.idle_timeout:
+                conn.close()
+                self.counters['evicted'] += 1
+                continue
+            if conn.is_dropped():
+                conn.close()
+                self.counters['dropped'] += 1
+                continue
+            self.counters['reused'] += 1
+            return conn, True
+        return self._new_conn(host), False
+
+    def _put_conn(self, host, conn, keep=True):
+        if keep:
+            self.idle[host].append((conn, time.time()))
+        else:
+            conn.close()
+            self.counters['discarded'] += 1
+        self.counters['in_use'] -= 1
+        self.slots[host].release()
+
+    async def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        """
+        Sends a request over a pooled connection and returns
+        ``(response, body)``. ``timeout`` bounds the whole exchange.
+        """
+        if timeout is None:
+            return await self._urlopen(host, method, path, body, headers, trace)
+        return await asyncio.wait_for(
+            self._urlopen(host, method, path, body, headers, trace), timeout)
+
+    async def _urlopen(self, host, method, path, body, headers, trace=None):
+        conn, reused = await self._get_conn(host)
+        try:
+            while True:
+                sending = True
+                try:
+                    await conn.send(method, path, body, headers, trace)
+                    sending = False
+                    response, data = await conn._read_response(trace)
+                except Exception as e:
+                    conn.close()
+                    # As in ``ConnectionPool``: once written, only GETs are
+                    # sent again
+                    if not reused or not is_stale(e, sending) or \
+                            (method != 'GET' and not sending):
+                        raise
+                    self.counters['reconnects'] += 1
+                    conn, reused = self._new_conn(host), False
+                    continue
+                break
+        except BaseException:
+            # Includes cancellation by ``wait_for``; the socket may hold
+            # half a response so it can't go back into the pool.
+            self._put_conn(host, conn, keep=False)
+            raise
+        self._put_conn(host, conn, keep=not response.will_close)
+        return response, data
+
+    def clear(self):
+        """
+        Closes every idle connection.
+        """
+        for idle in self.idle.values():
+            while idle:
+                conn, _ = idle.pop()
+                conn.close()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['idle'] = sum(len(idle) for idle in self.idle.values())
+        return stats
+
+
+class AsyncHTTP2Transport(HTTP2Transport):
+    """
+    ``disqusapi.transport.HTTP2Transport`` on top of ``httpx.AsyncClient``;
+    concurrent calls share one connection.
+    """
+    def __init__(self, client=None):
+        import httpx
+        if client is None:
+            client = httpx.AsyncClient(http2=True)
+        super(AsyncHTTP2Transport, self).__init__(client)
+
+    async def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        if trace is not None:
+            started = timer()
+        with self._errors():
+            response = await self.client.send(
+                self._request(host, method, path, body, headers, timeout), stream=True)
+            try:
+                if trace is not None:
+                    trace.add('wait', timer() - started)
+                    started = timer()
+                data = b''.join([chunk async for chunk in response.aiter_raw()])
+                if trace is not None:
+                    trace.add('read', timer() - started)
+            finally:
+                await response.aclose()
+        self._count(response)
+        return HTTPXResponse(response), data
+
+    def clear(self):
+        # ``AsyncClient.aclose`` is a coroutine; closing is left to the
+        # owner of the client.
+        pass
+
+
+class AsyncRecordingTransport(RecordingTransport):
+    """
+    ``disqusapi.cassette.RecordingTransport`` for the asyncio client,
+    recording calls sent over an ``AsyncConnectionPool`` by default.
+    """
+    def __init__(self, path, transport=None):
+        if transport is None:
+            transport = AsyncConnectionPool()
+        super(AsyncRecordingTransport, self).__init__(path, transport)
+
+    async def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        started = timer()
+        if trace is None:
+            response, data = await self.transport.urlopen(
+                host, method, path, body, headers, timeout=timeout)
+        else:
+            response, data = await self.transport.urlopen(
+                host, method, path, body, headers, timeout=timeout, trace=trace)
+        self.record(method, path, body, response, data, timer() - started)
+        return response, data
+
+
+class AsyncReplayTransport(ReplayTransport):
+    async def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        response, data, delay = self.replay(method, path, body)
+        if delay:
+            await asyncio.sleep(delay)
+            if trace is not None:
+                trace.add('wait', delay)
+        return response, data
+
+
+class AsyncCoalescer(Coalescer):
+    """
+    A ``disqusapi.coalesce.Coalescer`` for coroutines: the shared call
+    runs as its own task, so cancelling one of its callers doesn't
+    cancel it for the others.
+    """
+    def join(self, key, factory):
+        """
+        Returns ``(task, leader)``, starting ``factory()`` as the task for
+        ``key`` unless one is in flight.
+        """
+        task = self.calls.get(key)
+        if task is not None and not task.done():
+            self.counters['coalesced'] += 1
+            return task, False
+        task = self.calls[key] = asyncio.ensure_future(factory())
+        self.counters['calls'] += 1
+        task.add_done_callback(lambda task: self._done(key, task))
+        return task, True
+
+    def _done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Retrieved, so it isn't logged if every caller went away
+            task.exception()
+
+
+class AsyncResource(Resource):
+    async def _request(self, endpoint=None, **kwargs):
+        request = self._build_request(endpoint, kwargs)
+        if request.trace is None:
+            response, body = await self.api._send(request)
+            return self._handle_response(request, response, body)
+        with request.trace:
+            response, body = await self.api._send(request)
+            return self._handle_response(request, response, body)
+
+
+class AsyncDisqusAPI(AsyncResource, DisqusAPI):
+    """
+    Same interface as ``DisqusAPI``, but every call returns a coroutine.
+
+    At most ``concurrency`` requests are in flight at once; by default
+    the connection pool is sized to match.
+    """
+    resource_class = AsyncResource
+
+    def __init__(self, *args, **kwargs):
+        self.concurrency = kwargs.pop('concurrency', 100)
+        if kwargs.get('pool') is None and kwargs.get('transport') is None:
+            kwargs['transport'] = AsyncConnectionPool(maxsize=self.concurrency)
+        self._semaphore = None
+        super(AsyncDisqusAPI, self).__init__(*args, **kwargs)
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _send(self, request):
+        cached = self._cache_get(request)
+        if cached is not None:
+            if request.trace is not None:
+                request.trace.cached = True
+            return cached
+        if self.coalesce is None or request.method != 'GET':
+            return await self._send_uncached(request)
+        if request.cache_key is None:
+            request.cache_key = get_cache_key(request)
+
+        def factory():
+            return self._send_uncached(request)
+
+        call, leader = self.coalesce.join(request.cache_key, factory)
+        if not leader:
+            started = timer()
+            expires = self._get_expires(request)
+        while not leader:
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.shield(call),
+                    None if expires is None else max(0, expires - time.time()))
+            except DeadlineExceeded:
+                # The leader's, see ``DisqusAPI._send``; caught first as it
+                # is an ``asyncio.TimeoutError`` too on Python 3.11+
+                call, leader = self.coalesce.join(request.cache_key, factory)
+                continue
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(request.endpoint, request.deadline)
+            if request.trace is not None:
+                request.trace.add('coalesce', timer() - started)
+            return result
+        return await asyncio.shield(call)
+
+    async def _send_uncached(self, request):
+        stored = self._revalidate_prepare(request)
+        response, body = await self._fetch(request)
+        response, body = self._revalidate_update(request, stored, response, body)
+        self._cache_update(request, response, body)
+        return response, body
+
+    def _get_coalescer(self, coalesce):
+        if coalesce is True:
+            return AsyncCoalescer()
+        return coalesce or None
+
+    async def _fetch(self, request):
+        retry = self.retry
+        if retry is not None:
+            retry.on_request()
+        hedging = self._get_hedging(request)
+        expires = self._get_expires(request)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                wait = self.rate_limiter.reserve()
+                if wait > 0:
+                    if expires is not None and time.time() + wait >= expires:
+                        raise DeadlineExceeded(request.endpoint, request.deadline)
+                    await asyncio.sleep(wait)
+                    if request.trace is not None:
+                        request.trace.add('throttle', wait)
+            if request.trace is not None:
+                request.trace.attempts += 1
+            try:
+                response, body = await self._urlopen(request, expires, hedging)
+            except DeadlineExceeded:
+                raise
+            except RETRY_ERRORS + (asyncio.TimeoutError,):
+                if retry is None or not retry.allow(request, attempt):
+                    raise
+            else:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.update_from_response(response)
+                if retry is None or response.status not in retry.statuses or \
+                        not retry.allow(request, attempt):
+                    return response, body
+            backoff = retry.get_backoff(attempt)
+            if expires is not None and time.time() + backoff >= expires:
+                raise DeadlineExceeded(request.endpoint, request.deadline)
+            await asyncio.sleep(backoff)
+            if request.trace is not None:
+                request.trace.add('backoff', backoff)
+            attempt += 1
+
+    def _get_transport(self, transport):
+        if transport == 'pool':
+            return AsyncConnectionPool(maxsize=self.concurrency)
+        if transport == 'http2':
+            return AsyncHTTP2Transport()
+        if transport == 'httplib':
+            raise ValueError('The httplib transport is synchronous')
+        return super(AsyncDisqusAPI, self)._get_transport(transport)
+
+    async def _transport_urlopen(self, request, timeout):
+        async with self.semaphore:
+            if request.trace is None:
+                return await self.transport.urlopen(
+                    disqusapi.HOST, request.method, request.path, request.body,
+                    request.headers, timeout=timeout)
+            return await self.transport.urlopen(
+                disqusapi.HOST, request.method, request.path, request.body,
+                request.headers, timeout=timeout, trace=request.trace)
+
+    async def _send_once(self, request, timeout):
+        started = time.time()
+        answer = await self._transport_urlopen(request, timeout)
+        return answer, time.time() - started
+
+    async def _urlopen(self, request, expires, hedging):
+        if expires is None and hedging is None:
+            return await self._transport_urlopen(request, self.timeout)
+        return await self._race(request, expires, hedging)
+
+    async def _race(self, request, expires, hedging):
+        """
+        See ``DisqusAPI._race``; calls given up on are cancelled.
+        """
+        timeout = self._get_timeout(request, expires)
+        tasks = {asyncio.ensure_future(self._send_once(request, timeout)): False}
+
+        async def wait(delay):
+            if expires is not None:
+                remaining = expires - time.time()
+                if delay is None or remaining < delay:
+                    delay = max(remaining, 0)
+            done, _ = await asyncio.wait(
+                list(tasks), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not done and expires is not None and time.time() >= expires:
+                raise DeadlineExceeded(request.endpoint, request.deadline)
+            return done
+
+        try:
+            hedged = False
+            done = ()
+            if hedging is not None:
+                done = await wait(hedging.get_delay(request.endpoint))
+                if not done and hedging.allow():
+                    tasks[asyncio.ensure_future(self._send_once(request, timeout))] = True
+                    hedged = True
+            while True:
+                while not done:
+                    done = await wait(None)
+                task = done.pop()
+                hedge = tasks.pop(task)
+                if task.exception() is not None:
+                    # Give the other call a chance before failing
+                    if tasks:
+                        continue
+                    raise task.exception()
+                result, latency = task.result()
+                if hedging is not None:
+                    hedging.observe(request.endpoint, latency)
+                    if hedged:
+                        hedging.record_winner(hedge)
+                return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def map(self, endpoint, params_list, merge=None, merge_size=100):
+        """
+        See ``DisqusAPI.map``; concurrency is bounded by the client's.
+        """
+        params_list = list(params_list)
+        calls = merge_params(params_list, merge, merge_size)
+        resource = self._resolve(endpoint)
+        outcomes = await asyncio.gather(
+            *[resource(**params) for params, _ in calls], return_exceptions=True)
+        return spread_results(calls, outcomes, merge, len(params_list))
+
+    def close(self):
+        self.transport.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class AsyncPaginator(Paginator):
+    """
+    ``Paginator`` for ``async for``, driven by an ``AsyncDisqusAPI``.
+
+    >>> async for result in AsyncPaginator(api.forums.listPosts, forum='disqus')(limit=500):
+    ...     print(result)
+
+    With ``prefetch`` the request for the next page is sent as soon as the
+    current page's cursor is known, unless ``limit`` results were already
+    fetched.
+    """
+
+    def __aiter__(self):
+        return self()
+
+    async def __call__(self, limit=None, prefetch=False, adaptive=False):
+        params = self.params.copy()
+        if adaptive is True:
+            adaptive = PageSizer(int(params.get('limit', DEFAULT_LIMIT)))
+        self.sizer = sizer = adaptive or None
+        num = fetched = 0
+
+        def remaining():
+            return limit - fetched
+
+        more = True
+        pending = None
+        try:
+            while more and (not limit or num < limit):
+                if pending is None:
+                    results, latency = await self._fetch_page(
+                        params, remaining if limit else None, sizer)
+                else:
+                    (results, latency), pending = await pending, None
+                if results.cursor:
+                    more = results.cursor['more']
+                    params['cursor'] = results.cursor['id']
+                else:
+                    more = False
+                fetched += len(results)
+                if more and prefetch and (not limit or fetched < limit):
+                    pending = asyncio.ensure_future(
+                        self._fetch_page(params.copy(), remaining if limit else None, sizer))
+                started = timer()
+                for result in results:
+                    if limit and num >= limit:
+                        break
+                    num += 1
+                    yield result
+                if sizer is not None:
+                    sizer.observe(latency, timer() - started)
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _fetch_page(self, params, remaining, sizer):
+        """
+        Returns the next page and how long it took to fetch, sized as in
+        ``Paginator._pages``.
+        """
+        while True:
+            set_page_limit(params, remaining, sizer)
+            started = timer()
+            try:
+                results = await self._fetch(params)
+            except (socket.timeout, asyncio.TimeoutError):
+                if sizer is None or not sizer.shrink():
+                    raise
+                continue
+            return results, timer() - started
@@ -0,0 +1,296 @@
+"""
+Response caches for idempotent (GET) endpoints.
+
+>>> api = DisqusAPI(secret_key, public_key, cache=MemoryCache(maxsize=5000))
+>>> api.threads.details(thread=1)  # network
+>>> api.threads.details(thread=1)  # cache
+>>> api.cache.stats()
+{'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1}
+
+How long a response is kept for is read from the ``cache_ttl`` of the
+endpoint's interface, falling back to the client's ``cache_ttl``.
+Successful POSTs invalidate the cached responses of related endpoints.
+
+A ``RevalidationCache`` keeps responses that came with an ``ETag`` or a
+``Last-Modified`` instead, and repeats are sent as conditional requests:
+the API answers ``304 Not Modified`` with no body when nothing changed,
+and the stored copy is used.
+
+>>> api = DisqusAPI(secret_key, public_key, revalidate=RevalidationCache(maxsize=5000))
+"""
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from disqusapi.compat import urllib_parse as urllib
+from disqusapi.utils import reset_after_fork
+
+
+class CachedResponse(object):
+    """
+    Replays the parts of a response the client needs to parse a body.
+    """
+    status = 200
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+def get_headers(response):
+    """
+    The headers of ``response`` a ``CachedResponse`` needs.
+    """
+    headers = {}
+    for name in ('Content-Type', 'Content-Encoding'):
+        value = response.getheader(name)
+        if value is not None:
+            headers[name] = value
+    return headers
+
+
+def get_cache_key(request):
+    """
+    Returns a key for ``request`` which doesn't depend on parameter
+    order and doesn't leak the API secret.
+    """
+    import hashlib
+    path = request.path.split('?', 1)[0]
+    params = urllib.urlencode(sorted(request.params))
+    digest = hashlib.sha1(('%s %s?%s' % (request.method, path, params)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def is_related(endpoint, changed):
+    """
+    Whether a POST to ``changed`` (e.g. ``posts.create``) may have
+    modified the results of ``endpoint`` (e.g. ``threads.listPosts``).
+    """
+    resource = changed.split('.', 1)[0]
+    if endpoint.split('.', 1)[0] == resource:
+        return True
+    return endpoint.endswith('.list' + resource[:1].upper() + resource[1:])
+
+
+class BaseCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def _incr(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def get(self, endpoint, key):
+        """
+        Returns the value stored for ``key``, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, endpoint, key, value, ttl):
+        raise NotImplementedError
+
+    def invalidate(self, match):
+        """
+        Drops every entry whose endpoint name satisfies ``match``.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        self.invalidate(lambda endpoint: True)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class MemoryCache(BaseCache):
+    """
+    An in-process LRU cache holding at most ``maxsize`` responses.
+    """
+    def __init__(self, maxsize=1000):
+        super(MemoryCache, self).__init__()
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, endpoint, key):
+        with self.lock:
+            try:
+                expires, value = self.entries.pop((endpoint, key))
+            except KeyError:
+                self.counters['misses'] += 1
+                return None
+            if expires < time.time():
+                self.counters['misses'] += 1
+                return None
+            # Re-insert to mark as most recently used
+            self.entries[(endpoint, key)] = (expires, value)
+            self.counters['hits'] += 1
+            return value
+
+    def set(self, endpoint, key, value, ttl):
+        with self.lock:
+            self.entries.pop((endpoint, key), None)
+            self.entries[(endpoint, key)] = (time.time() + ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, match):
+        with self.lock:
+            for entry in [e for e in self.entries if match(e[0])]:
+                del self.entries[entry]
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self.entries)
+        return stats
+
+
+def get_cache_dir():
+    """
+    The default ``FileCache`` directory: ``disqusapi`` in the user's
+    cache directory (``$XDG_CACHE_HOME``, or ``~/.cache``).
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'disqusapi')
+
+
+class FileCache(BaseCache):
+    """
+    Stores ``(headers, body)`` responses as JSON files under ``path``, so
+    they survive restarts and can be shared between processes of the same
+    user. ``path`` defaults to ``get_cache_dir()``, created readable by
+    its owner only.
+
+    Expired files are deleted when found, and every ``prune_interval``
+    writes ``prune`` deletes those closest to expiring beyond ``maxsize``.
+    """
+    # tempfile is imported where used to keep ``import disqusapi`` light.
+    prune_interval = 100
+
+    def __init__(self, path=None, maxsize=10000):
+        super(FileCache, self).__init__()
+        if path is None:
+            path = get_cache_dir()
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path, 0o700)
+            except OSError:
+                # Another process may have created it in the meantime
+                if not os.path.isdir(path):
+                    raise
+        self.path = path
+        self.maxsize = maxsize
+        self.writes = 0
+
+    def _filename(self, endpoint, key):
+        return os.path.join(self.path, '%s-%s' % (endpoint, key))
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def get(self, endpoint, key):
+        filename = self._filename(endpoint, key)
+        try:
+            with open(filename, 'rb') as fp:
+                entry = json.loads(fp.read().decode('utf-8'))
+            expires = entry['expires']
+            value = (entry['headers'], base64.b64decode(entry['body']))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self._incr('misses')
+            return None
+        if expires < time.time():
+            self._remove(filename)
+            self._incr('misses')
+            return None
+        self._incr('hits')
+        return value
+
+    def set(self, endpoint, key, value, ttl):
+        import tempfile
+        headers, body = value
+        expires = time.time() + ttl
+        data = json.dumps({
+            'expires': expires,
+            'headers': headers,
+            'body': base64.b64encode(body).decode('ascii'),
+        }).encode('utf-8')
+        # Write then rename so readers never see a partial file. The
+        # modification time is set to the expiry, for ``prune``.
+        fd, tmp = tempfile.mkstemp(prefix='.', dir=self.path)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.utime(tmp, (expires, expires))
+        os.rename(tmp, self._filename(endpoint, key))
+        with self.lock:
+            self.writes += 1
+            prune = self.writes % self.prune_interval == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """
+        Deletes expired files, then those closest to expiring until at
+        most ``maxsize`` are left.
+        """
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith('.'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                expires = os.path.getmtime(filename)
+            except OSError:
+                continue
+            if expires < now:
+                self._remove(filename)
+            else:
+                entries.append((expires, filename))
+        if len(entries) > self.maxsize:
+            entries.sort()
+            for expires, filename in entries[:len(entries) - self.maxsize]:
+                self._remove(filename)
+                self._incr('evictions')
+
+    def invalidate(self, match):
+        for filename in os.listdir(self.path):
+            endpoint, sep, _ = filename.rpartition('-')
+            if sep and match(endpoint):
+                self._remove(os.path.join(self.path, filename))
+
+
+class RevalidationCache(MemoryCache):
+    """
+    Holds the last response (and its validators) of up to ``maxsize``
+    GET calls, for as long as the API says they haven't changed.
+    """
+    def __init__(self, maxsize=1000):
+        super(RevalidationCache, self).__init__(maxsize)
+        self.counters['not_modified'] = 0
+        self.counters['modified'] = 0
+
+    def set(self, endpoint, key, value, ttl=float('inf')):
+        super(RevalidationCache, self).set(endpoint, key, value, ttl)
+
+    def delete(self, endpoint, key):
+        with self.lock:
+            self.entries.pop((endpoint, key), None)
@@ -0,0 +1,279 @@
+"""
+Recording calls to a file and replaying them without a network.
+
+>>> api = DisqusAPI(secret_key, public_key, transport=RecordingTransport('posts.cassette'))
+>>> ...
+>>> api.transport.close()
+>>> replay = ReplayTransport('posts.cassette', latency='sampled')
+>>> api = DisqusAPI('secret', 'public', transport=replay)
+
+A cassette is two files: ``path`` holds the exchanges one after the
+other (method, path and parameters, status, headers, and the body as it
+was received, gzipped or not) and ``path + '.idx'`` a hash table of where
+each one starts, written by ``close()``. Replaying maps both into
+memory, so finding a call costs a hash and a probe or two however big
+the cassette is, and processes replaying the same one share the pages.
+
+Calls are matched by method, path and parameters, in any order. The
+credentials are neither written nor matched on, so a cassette can be
+replayed with any keys. If a call was recorded more than once, the last
+recording is used.
+"""
+import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+
+from disqusapi.cache import CachedResponse
+from disqusapi.compat import parse_qsl, urllib_parse as urllib
+from disqusapi.tracing import timer
+from disqusapi.transport import Transport, get_transport
+
+CREDENTIALS = frozenset(['api_secret', 'api_key', 'access_token'])
+
+# The response headers kept
+HEADERS = ('Content-Type', 'Content-Encoding', 'ETag', 'Last-Modified',
+           'X-Ratelimit-Limit', 'X-Ratelimit-Remaining', 'X-Ratelimit-Reset')
+
+# Metadata length, body length, status, latency (seconds)
+RECORD = struct.Struct('>IIHd')
+# Magic, number of slots, number of records
+INDEX_HEADER = struct.Struct('>4sII')
+# Key, offset of the record + 1 (0 for an empty slot)
+SLOT = struct.Struct('>QQ')
+MAGIC = b'DQC1'
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def get_params(method, path, body):
+    """
+    Returns the path without its query string, and the parameters of a
+    call without the credentials.
+    """
+    path, _, query = path.partition('?')
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if body:
+        query = '%s&%s' % (query, body) if query else body
+    params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+              if k not in CREDENTIALS]
+    return path, params
+
+
+def get_key(method, path, params):
+    text = '%s %s?%s' % (method, path, urllib.urlencode(sorted(tuple(p) for p in params)))
+    return struct.unpack('>Q', hashlib.sha1(text.encode('utf-8')).digest()[:8])[0]
+
+
+def iter_records(data):
+    """
+    Yields ``(offset, meta, latency)`` for each complete record in
+    ``data``, stopping at a partly written one.
+    """
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        meta_len, body_len, status, latency = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        end = start + meta_len + body_len
+        if end > len(data):
+            break
+        yield offset, json.loads(data[start:start + meta_len].decode('utf-8')), latency
+        offset = end
+
+
+def write_index(path):
+    """
+    Builds the index of the cassette at ``path``.
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    keys = []
+    latencies = []
+    for offset, meta, latency in iter_records(data):
+        keys.append((get_key(meta['method'], meta['path'], meta['params']), offset))
+        latencies.append(latency)
+    # At most half full, so probes stay short
+    slots = 8
+    while slots < len(keys) * 2:
+        slots *= 2
+    mask = slots - 1
+    table = [None] * slots
+    for key, offset in keys:
+        i = key & mask
+        while table[i] is not None and table[i][0] != key:
+            i = (i + 1) & mask
+        table[i] = (key, offset + 1)
+    empty = SLOT.pack(0, 0)
+    chunks = [INDEX_HEADER.pack(MAGIC, slots, len(latencies))]
+    chunks.extend(SLOT.pack(*slot) if slot is not None else empty for slot in table)
+    chunks.append(struct.pack('>%dd' % len(latencies), *latencies))
+    tmp = '%s.idx.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as fp:
+        fp.write(b''.join(chunks))
+    os.rename(tmp, path + '.idx')
+
+
+class RecordingTransport(Transport):
+    """
+    Sends calls over ``transport`` (a name or a ``Transport``, see
+    ``disqusapi.transport``) and appends them to the cassette at ``path``.
+    Call ``close()`` when done to write the index.
+    """
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = get_transport(transport)
+        self.fp = open(path, 'ab')
+        self.lock = threading.Lock()
+        self.recorded = 0
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        started = timer()
+        if trace is None:
+            response, data = self.transport.urlopen(
+                host, method, path, body, headers, timeout=timeout)
+        else:
+            response, data = self.transport.urlopen(
+                host, method, path, body, headers, timeout=timeout, trace=trace)
+        self.record(method, path, body, response, data, timer() - started)
+        return response, data
+
+    def record(self, method, path, body, response, data, latency):
+        path, params = get_params(method, path, body)
+        headers = {}
+        for name in HEADERS:
+            value = response.getheader(name)
+            if value is not None:
+                headers[name] = value
+        meta = json.dumps({
+            'method': method,
+            'path': path,
+            'params': params,
+            'headers': headers,
+        }).encode('utf-8')
+        record = RECORD.pack(len(meta), len(data), response.status, latency) + meta + data
+        with self.lock:
+            self.fp.write(record)
+            self.recorded += 1
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+        write_index(self.path)
+
+    def clear(self):
+        self.transport.clear()
+
+    def stats(self):
+        return {'recorded': self.recorded}
+
+
+class ReplayResponse(CachedResponse):
+    will_close = False
+
+    def __init__(self, status, headers):
+        super(ReplayResponse, self).__init__(headers)
+        self.status = status
+
+
+class ReplayTransport(Transport):
+    """
+    Answers calls from the cassette at ``path``, raising ``CassetteMiss``
+    for calls it doesn't have.
+
+    ``latency`` is None to answer straight away, ``'recorded'`` to take
+    as long as the recorded call did, or ``'sampled'`` to take a time
+    drawn from all the recorded ones; either way divided by ``speed``.
+    """
+    def __init__(self, path, latency=None, speed=1.0, seed=None):
+        index_path = path + '.idx'
+        if not os.path.exists(index_path) or \
+                os.path.getmtime(index_path) < os.path.getmtime(path):
+            write_index(path)
+        self.data = self._map(path)
+        self.index = self._map(index_path)
+        magic, self.slots, count = INDEX_HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a cassette index' % index_path)
+        self.mask = self.slots - 1
+        if latency not in (None, 'recorded', 'sampled'):
+            raise ValueError('Unknown latency: %r' % latency)
+        self.latency = latency
+        self.speed = speed
+        if latency == 'sampled':
+            self.latencies = struct.unpack_from(
+                '>%dd' % count, self.index, INDEX_HEADER.size + self.slots * SLOT.size)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+        }
+
+    def _map(self, path):
+        with open(path, 'rb') as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                # Empty files can't be mapped
+                return b''
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _find(self, key):
+        index, mask = self.index, self.mask
+        i = key & mask
+        while True:
+            slot_key, offset = SLOT.unpack_from(index, INDEX_HEADER.size + i * SLOT.size)
+            if not offset:
+                return None
+            if slot_key == key:
+                return offset - 1
+            i = (i + 1) & mask
+
+    def _incr(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def replay(self, method, path, body):
+        """
+        Returns ``(response, body, delay)`` for a call.
+        """
+        path, params = get_params(method, path, body)
+        offset = self._find(get_key(method, path, params))
+        if offset is None:
+            self._incr('misses')
+            raise CassetteMiss('%s %s?%s' % (method, path, urllib.urlencode(params)))
+        self._incr('hits')
+        data = self.data
+        meta_len, body_len, status, latency = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size + meta_len
+        meta = json.loads(data[offset + RECORD.size:start].decode('utf-8'))
+        if self.latency is None:
+            delay = 0
+        elif self.latency == 'recorded':
+            delay = latency / self.speed
+        else:
+            with self.lock:
+                delay = self.random.choice(self.latencies) / self.speed
+        return ReplayResponse(status, meta['headers']), data[start:start + body_len], delay
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        response, data, delay = self.replay(method, path, body)
+        if delay:
+            time.sleep(delay)
+            if trace is not None:
+                trace.add('wait', delay)
+        return response, data
+
+    def close(self):
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,88 @@
+"""
+Sharing one call between identical concurrent requests.
+
+>>> api = DisqusAPI(secret_key, public_key, coalesce=True)
+>>> api.coalesce.stats()
+{'calls': 3, 'coalesced': 41, 'in_flight': 0}
+
+While a GET is in flight, the same call (same endpoint and parameters,
+whatever their order) made from other threads waits for it and gets its
+response, rather than sending its own. Each caller still parses the
+response itself, so nobody shares mutable results.
+"""
+import threading
+
+from disqusapi.utils import reset_after_fork
+
+
+class Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        """
+        Returns the result of the call, raising its error. Returns None
+        if it didn't finish within ``timeout`` seconds.
+        """
+        if not self.event.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Coalescer(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {
+            'calls': 0,
+            'coalesced': 0,
+        }
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        # Calls in flight belong to the parent's threads, so waiting on
+        # them in the child would never end.
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def join(self, key):
+        """
+        Returns ``(call, leader)``: the call in flight for ``key``, and
+        whether it is new, in which case the caller must ``run`` it.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.counters['coalesced'] += 1
+                return call, False
+            call = self.calls[key] = Call()
+            self.counters['calls'] += 1
+            return call, True
+
+    def run(self, key, call, func):
+        """
+        Runs ``func`` for the ``call`` led by the caller, handing its
+        result (or error) to every waiter.
+        """
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self.calls)
+        return stats
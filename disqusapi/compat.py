@@ -10,9 +10,14 @@ if PY3:
         return iter(d.items(**kw))
 
     xrange = range
+    imap = map
+    text_type = str
+    string_types = (str,)
 
     import http.client as http_client  # NOQA
+    import queue  # NOQA
     import urllib.parse as urllib_parse  # NOQA
+    from urllib.parse import parse_qsl, urlparse  # NOQA
 else:
     def iterkeys(d, **kw):
         return iter(d.iterkeys(**kw))
@@ -21,6 +26,11 @@ else:
         return iter(d.iteritems(**kw))
 
     xrange = xrange
+    from itertools import imap  # NOQA
+    text_type = unicode  # NOQA
+    string_types = (str, unicode)  # NOQA
 
     import httplib as http_client  # NOQA
+    import Queue as queue  # NOQA
     import urllib as urllib_parse  # NOQA
+    from urlparse import parse_qsl, urlparse  # NOQA
@@ -0,0 +1,221 @@
+"""
+Crawling a whole forum in parallel.
+
+>>> shards = time_shards('disqus', datetime(2012, 1, 1), datetime.utcnow(), timedelta(days=30))
+>>> crawler = Crawler(api, 'posts.ndjson', workers=8)
+>>> crawler.run(shards)
+{'shards': 40, 'done': 40, 'failed': {}, 'pages': 1283, 'items': 127410, 'duplicates': 12}
+
+The work is split into shards (time windows of ``posts.list``, or one
+``threads.listPosts`` per thread), each paginated by a worker thread (or
+process). Objects are written to ``output`` as one JSON document per
+line, skipping ids already written. After every page the next cursor of
+its shard is saved to a checkpoint file, so running the same crawl again
+after a crash picks up where it stopped.
+"""
+import json
+import os
+import threading
+
+from disqusapi.compat import queue, urllib_parse as urllib
+from disqusapi.paginator import Paginator
+from disqusapi.utils import load_json, save_json
+
+
+class Shard(object):
+    """
+    One paginated call, e.g. ``Shard('threads.listPosts', {'thread': 1})``.
+    """
+    def __init__(self, endpoint, params, key=None):
+        self.endpoint = endpoint
+        self.params = params
+        if key is None:
+            key = '%s?%s' % (endpoint, urllib.urlencode(sorted(params.items())))
+        self.key = key
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.key)
+
+
+def time_shards(forum, start, end, interval, endpoint='posts.list', **params):
+    """
+    Splits the posts of ``forum`` created between the datetimes ``start``
+    and ``end`` into windows of ``interval`` (a ``timedelta``).
+    """
+    params.setdefault('limit', 100)
+    shards = []
+    while start < end:
+        until = min(start + interval, end)
+        shard_params = dict(params, forum=forum, order='asc',
+                            start=start.strftime('%Y-%m-%dT%H:%M:%S'),
+                            end=until.strftime('%Y-%m-%dT%H:%M:%S'))
+        shards.append(Shard(endpoint, shard_params))
+        start = until
+    return shards
+
+
+def thread_shards(api, forum, **params):
+    """
+    One ``threads.listPosts`` shard for each thread of ``forum``.
+    """
+    params.setdefault('limit', 100)
+    return [Shard('threads.listPosts', dict(params, thread=thread['id']))
+            for thread in Paginator(api.forums.listThreads, forum=forum, limit=100)]
+
+
+def crawl_worker(get_api, tasks, results):
+    """
+    Paginates the ``(key, endpoint, params, cursor)`` tasks it is given,
+    putting ``(key, items, next_cursor, error)`` on ``results`` for each
+    page, until it gets None.
+    """
+    api = get_api()
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        key, endpoint, params, cursor = task
+        try:
+            paginator = Paginator(api._resolve(endpoint), records=False, **params)
+            for page in paginator._pages(cursor):
+                if page.cursor and page.cursor['more']:
+                    cursor = page.cursor['id']
+                else:
+                    cursor = None
+                results.put((key, list(page), cursor, None))
+        except Exception as e:
+            # As a string, exceptions don't all survive pickling
+            results.put((key, None, None, '%s: %s' % (e.__class__.__name__, e)))
+
+
+class ClientFactory(object):
+    """
+    Builds a ``DisqusAPI`` in each worker process from the settings of
+    ``api``; only the keys, version, format and timeout carry over.
+    """
+    def __init__(self, api):
+        self.options = {
+            'secret_key': api.secret_key,
+            'public_key': api.public_key,
+            'version': api.version,
+            'format': api.format,
+            'timeout': api.timeout,
+        }
+
+    def __call__(self):
+        from disqusapi import DisqusAPI
+        return DisqusAPI(**self.options)
+
+
+class Crawler(object):
+    """
+    ``checkpoint`` defaults to ``output`` + ``.checkpoint``. With
+    ``processes`` the workers are processes, each with its own client
+    (see ``ClientFactory``), which helps when parsing is the bottleneck.
+    """
+    def __init__(self, api, output, checkpoint=None, workers=4, processes=False, id_field='id'):
+        self.api = api
+        self.output = output
+        self.checkpoint = checkpoint or output + '.checkpoint'
+        self.workers = workers
+        self.processes = processes
+        self.id_field = id_field
+
+    def _recover_output(self):
+        """
+        Returns the ids already written, dropping a partly written last
+        line if the previous run died in the middle of it.
+        """
+        seen = set()
+        if not os.path.exists(self.output):
+            return seen
+        with open(self.output, 'rb+') as fp:
+            offset = 0
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                if not line.endswith(b'\n'):
+                    fp.truncate(offset)
+                    break
+                offset += len(line)
+                seen.add(json.loads(line.decode('utf-8')).get(self.id_field))
+        return seen
+
+    def _start_workers(self, tasks, results):
+        if self.processes:
+            import multiprocessing
+            factory = ClientFactory(self.api)
+            workers = [multiprocessing.Process(target=crawl_worker, args=(factory, tasks, results))
+                       for _ in range(self.workers)]
+        else:
+            api = self.api
+            workers = [threading.Thread(target=crawl_worker, args=(lambda: api, tasks, results))
+                       for _ in range(self.workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        return workers
+
+    def run(self, shards):
+        """
+        Crawls ``shards`` and returns stats; shards which failed are
+        listed in ``failed`` with their error and are retried (from their
+        last cursor) the next time the crawl is run.
+        """
+        state = load_json(self.checkpoint, {})
+        seen = self._recover_output()
+        stats = {
+            'shards': 0,
+            'done': 0,
+            'failed': {},
+            'pages': 0,
+            'items': 0,
+            'duplicates': 0,
+        }
+        if self.processes:
+            import multiprocessing
+            tasks, results = multiprocessing.Queue(), multiprocessing.Queue(self.workers * 2)
+        else:
+            tasks, results = queue.Queue(), queue.Queue(self.workers * 2)
+
+        pending = 0
+        for shard in shards:
+            stats['shards'] += 1
+            progress = state.get(shard.key, {})
+            if progress.get('done'):
+                stats['done'] += 1
+                continue
+            tasks.put((shard.key, shard.endpoint, shard.params, progress.get('cursor')))
+            pending += 1
+        for _ in range(self.workers):
+            tasks.put(None)
+
+        workers = self._start_workers(tasks, results)
+        id_field = self.id_field
+        with open(self.output, 'a') as fp:
+            while pending:
+                key, items, cursor, error = results.get()
+                if error is not None:
+                    stats['failed'][key] = error
+                    pending -= 1
+                    continue
+                for item in items:
+                    id = item.get(id_field)
+                    if id in seen:
+                        stats['duplicates'] += 1
+                        continue
+                    seen.add(id)
+                    fp.write(json.dumps(item) + '\n')
+                    stats['items'] += 1
+                fp.flush()
+                stats['pages'] += 1
+                # Only once the page is on disk
+                state[key] = {'cursor': cursor, 'done': cursor is None}
+                save_json(self.checkpoint, state)
+                if cursor is None:
+                    stats['done'] += 1
+                    pending -= 1
+        for worker in workers:
+            worker.join()
+        return stats
@@ -0,0 +1,69 @@
+"""
+The interface definitions compiled into a dispatch table.
+
+>>> endpoints = compile_interfaces(INTERFACES)
+>>> endpoints['threads.details'].get_path('3.0', 'json')
+'/api/3.0/threads/details.json'
+
+Everything a call needs to know about its endpoint is worked out once,
+so that building a request does no more than look things up.
+"""
+from disqusapi import compat
+
+
+class Endpoint(object):
+    __slots__ = ('name', 'interface', 'method', 'required', 'paths', '_path')
+
+    def __init__(self, name, interface):
+        self.name = name
+        self.interface = interface
+        method = interface.get('method')
+        self.method = method.upper() if method else None
+        self.required = tuple(interface.get('required', ()))
+        self.paths = {}
+        self._path = name.replace('.', '/')
+
+    def __repr__(self):
+        return '<%s: %s %s>' % (self.__class__.__name__, self.method, self.name)
+
+    def get_path(self, version, format):
+        try:
+            return self.paths[version, format]
+        except KeyError:
+            path = self.paths[version, format] = '/api/%s/%s.%s' % (
+                version, self._path, format)
+            return path
+
+    def validate(self, kwargs):
+        """
+        Raises ``ValueError`` if a required argument is missing. Arguments
+        may carry a ``:`` suffix, e.g. ``thread:ident``.
+        """
+        for k in self.required:
+            if k not in kwargs:
+                break
+        else:
+            return
+        names = set(x.split(':')[0] for x in compat.iterkeys(kwargs))
+        for k in self.required:
+            if k not in names:
+                raise ValueError('Missing required argument: %s' % k)
+
+
+def compile_interfaces(interfaces):
+    """
+    Returns a dict of ``Endpoint`` keyed by dotted endpoint name
+    (``threads.details``).
+    """
+    def traverse(block, parts):
+        if 'method' in block:
+            name = '.'.join(parts)
+            endpoints[name] = Endpoint(name, block)
+            return
+        for k, v in compat.iteritems(block):
+            if isinstance(v, dict):
+                traverse(v, parts + [k])
+    endpoints = {}
+    for key, val in compat.iteritems(interfaces):
+        traverse(val, [key])
+    return endpoints
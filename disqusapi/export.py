@@ -0,0 +1,213 @@
+"""
+Writing paginated results to files.
+
+>>> paginator = Paginator(api.forums.listPosts, forum='disqus', related='thread')
+>>> export(paginator, 'posts.csv', fields=['id', 'createdAt', 'author.username', 'thread.title'])
+127410
+
+Objects are written ``batch_size`` at a time, so memory use doesn't
+depend on how many there are. Nested objects are flattened into dotted
+columns (``author.username``) for CSV, Arrow and Parquet; ``fields``
+picks the columns, otherwise they are those of the first batch. NDJSON
+keeps objects as they are unless given ``fields`` or ``flatten=True``.
+Arrow and Parquet need ``pyarrow``.
+"""
+import json
+import os
+
+from disqusapi import compat
+
+
+def flatten(obj, prefix='', sep='.', out=None):
+    """
+    ``{'author': {'id': 1}}`` -> ``{'author.id': 1}``
+    """
+    if out is None:
+        out = {}
+    for key, value in compat.iteritems(obj):
+        if isinstance(value, dict):
+            flatten(value, prefix + key + sep, sep, out)
+        else:
+            out[prefix + key] = value
+    return out
+
+
+def get_field(obj, field, sep='.'):
+    """
+    Looks up a dotted ``field``; missing fields (or a thread given as an
+    id rather than an object) are None.
+    """
+    for part in field.split(sep):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(part)
+    return obj
+
+
+def to_row(obj, fields=None, flat=True):
+    if hasattr(obj, 'to_dict'):
+        # A ``disqusapi.records`` object
+        obj = obj.to_dict()
+    if fields is not None:
+        return dict((field, get_field(obj, field)) for field in fields)
+    if flat:
+        return flatten(obj)
+    return obj
+
+
+def get_columns(rows):
+    columns = []
+    known = set()
+    for row in rows:
+        for key in row:
+            if key not in known:
+                known.add(key)
+                columns.append(key)
+    return columns
+
+
+class NDJSONWriter(object):
+    flatten = False
+
+    def __init__(self, path, fields=None):
+        self.fp = open(path, 'w')
+
+    def write(self, rows):
+        self.fp.write(''.join(json.dumps(row) + '\n' for row in rows))
+
+    def close(self):
+        self.fp.close()
+
+
+class CSVWriter(object):
+    flatten = True
+
+    def __init__(self, path, fields=None):
+        import csv
+        self.csv = csv
+        if compat.PY3:
+            self.fp = open(path, 'w', newline='')
+        else:
+            self.fp = open(path, 'wb')
+        self.columns = fields
+        self.writer = None
+
+    def _cell(self, value):
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+        return value
+
+    def write(self, rows):
+        if self.writer is None:
+            if self.columns is None:
+                self.columns = get_columns(rows)
+            self.writer = self.csv.DictWriter(self.fp, self.columns, extrasaction='ignore')
+            self.writer.writeheader()
+        cell = self._cell
+        self.writer.writerows(
+            dict((k, cell(v)) for k, v in compat.iteritems(row)) for row in rows)
+
+    def close(self):
+        self.fp.close()
+
+
+class ArrowWriter(object):
+    """
+    Writes an Arrow IPC file. The schema is inferred from the rows: the
+    file is only started once every column has had a value, holding up
+    to ``max_pending`` batches until then, and columns still all null by
+    then are typed as strings (later values are converted to strings).
+    """
+    flatten = True
+    max_pending = 10
+
+    def __init__(self, path, fields=None):
+        import pyarrow
+        self.pa = pyarrow
+        self.path = path
+        self.columns = fields
+        self.schema = None
+        self.writer = None
+        self.pending = []
+
+    def _open(self, schema):
+        return self.pa.ipc.new_file(self.path, schema)
+
+    def write(self, rows):
+        pa = self.pa
+        if self.columns is None:
+            self.columns = get_columns(rows)
+        table = pa.Table.from_pydict(
+            dict((c, [row.get(c) for row in rows]) for c in self.columns))
+        if self.writer is not None:
+            self.writer.write_table(table.cast(self.schema))
+            return
+        self.pending.append(table)
+        schema = pa.unify_schemas([t.schema for t in self.pending])
+        if len(self.pending) < self.max_pending and \
+                any(pa.types.is_null(f.type) for f in schema):
+            return
+        self._start(schema)
+
+    def _start(self, schema):
+        pa = self.pa
+        self.schema = pa.schema([
+            pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+            for f in schema])
+        self.writer = self._open(self.schema)
+        for table in self.pending:
+            self.writer.write_table(table.cast(self.schema))
+        self.pending = []
+
+    def close(self):
+        if self.writer is None and self.pending:
+            self._start(self.pa.unify_schemas([t.schema for t in self.pending]))
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ParquetWriter(ArrowWriter):
+    def _open(self, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.path, schema)
+
+
+WRITERS = {
+    'ndjson': NDJSONWriter,
+    'jsonl': NDJSONWriter,
+    'csv': CSVWriter,
+    'arrow': ArrowWriter,
+    'parquet': ParquetWriter,
+}
+
+
+def export(results, path, format=None, fields=None, flatten=None, batch_size=1000):
+    """
+    Writes the objects from ``results`` (a ``Paginator``, or any iterable
+    of them) to ``path`` and returns how many were written. ``format``
+    defaults to the file extension.
+    """
+    if format is None:
+        format = os.path.splitext(path)[1].lstrip('.').lower()
+    try:
+        writer_class = WRITERS[format]
+    except KeyError:
+        raise ValueError('Unknown export format: %r' % format)
+    if flatten is None:
+        flatten = writer_class.flatten
+    writer = writer_class(path, fields)
+    count = 0
+    batch = []
+    try:
+        for obj in results:
+            batch.append(to_row(obj, fields, flatten))
+            if len(batch) >= batch_size:
+                writer.write(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write(batch)
+            count += len(batch)
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,104 @@
+"""
+Hedged requests for idempotent (GET) endpoints.
+
+>>> api = DisqusAPI(secret_key, public_key, hedging=Hedging(percentile=95))
+>>> api.hedging.stats()
+{'hedged': 12, 'wins': 9, 'losses': 3, 'denied': 0, 'delays': {'threads.details': 0.21}}
+
+When a call has been waiting longer than the given percentile of the
+latencies recently seen for its endpoint, a duplicate is sent and
+whichever answers first is used. Hedges are capped by a ``RetryBudget``
+(5% of calls by default) so a slow API doesn't get twice the load.
+"""
+import threading
+from collections import deque
+
+from disqusapi.retry import RetryBudget
+from disqusapi.utils import reset_after_fork
+
+
+class Hedging(object):
+    """
+    ``default_delay`` is used for endpoints with fewer than
+    ``min_samples`` latencies recorded yet, out of the last ``window``.
+    """
+    def __init__(self, percentile=95, default_delay=0.5, min_delay=0.01, window=200,
+                 min_samples=20, budget=None):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget = budget if budget is not None else RetryBudget(ratio=0.05, min_tokens=5)
+        self.latencies = {}
+        self.lock = threading.Lock()
+        self.counters = {
+            'hedged': 0,
+            'wins': 0,
+            'losses': 0,
+            'denied': 0,
+        }
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def _incr(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _delay(self, latencies):
+        if len(latencies) < self.min_samples:
+            return self.default_delay
+        latencies = sorted(latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+        return max(self.min_delay, latencies[index])
+
+    def is_hedgeable(self, request):
+        return request.method == 'GET'
+
+    def observe(self, endpoint, seconds):
+        """
+        Records how long a call to ``endpoint`` took to answer.
+        """
+        with self.lock:
+            try:
+                latencies = self.latencies[endpoint]
+            except KeyError:
+                latencies = self.latencies[endpoint] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def get_delay(self, endpoint):
+        """
+        Seconds to wait for an answer before sending a hedge.
+        """
+        with self.lock:
+            latencies = list(self.latencies.get(endpoint, ()))
+        return self._delay(latencies)
+
+    def on_request(self):
+        self.budget.deposit()
+
+    def allow(self):
+        """
+        Whether a hedge may be sent now.
+        """
+        if self.budget.withdraw():
+            self._incr('hedged')
+            return True
+        self._incr('denied')
+        return False
+
+    def record_winner(self, hedge):
+        """
+        Called once a hedged call has its answer; ``hedge`` is whether
+        the duplicate came back first.
+        """
+        self._incr('wins' if hedge else 'losses')
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            latencies = dict((k, list(v)) for k, v in self.latencies.items())
+        stats['delays'] = dict((k, self._delay(v)) for k, v in latencies.items())
+        return stats
@@ -0,0 +1,40 @@
+"""
+Picking a JSON decoder.
+
+``orjson`` and ``ujson`` parse UTF-8 bytes directly, so with them the
+client skips decoding response bodies to text first.
+"""
+
+# Fastest first
+DECODERS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def _load(name):
+    if name == 'orjson':
+        import orjson
+        return orjson.loads, orjson.JSONDecodeError, True
+    if name == 'ujson':
+        import ujson
+        return ujson.loads, ValueError, True
+    if name == 'simplejson':
+        import simplejson
+        return simplejson.loads, ValueError, False
+    if name == 'json':
+        import json
+        return json.loads, ValueError, False
+    raise ValueError('Unknown JSON decoder: %r' % name)
+
+
+def get_decoder(name=None):
+    """
+    Returns ``(loads, error, accepts_bytes)`` for the decoder ``name``, or
+    for the fastest one installed. ``error`` is what ``loads`` raises on
+    malformed input.
+    """
+    if name is not None:
+        return _load(name)
+    for name in DECODERS:
+        try:
+            return _load(name)
+        except ImportError:
+            continue
@@ -1,3 +1,61 @@
+import socket
+import threading
+
+from disqusapi.compat import queue
+from disqusapi.tracing import timer
+
+# What the API returns per page by default, and at most
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 100
+
+
+class PageSizer(object):
+    """
+    Picks the ``limit`` of each page for ``paginator(adaptive=True)``.
+
+    Pages double in size (up to ``max_limit``) while they come back within
+    ``target_latency`` seconds and the consumer gets through each faster
+    than the next takes to fetch, so fewer round trips are made. A slower
+    page, or a timeout, halves them (down to ``min_limit``).
+    """
+    def __init__(self, limit=DEFAULT_LIMIT, min_limit=10, max_limit=MAX_LIMIT, target_latency=1.0):
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+
+    def observe(self, latency, consumed):
+        """
+        Records how long a page took to fetch and to consume.
+        """
+        if latency > self.target_latency:
+            self.shrink()
+        elif consumed < latency:
+            self.limit = min(self.max_limit, self.limit * 2)
+
+    def shrink(self):
+        """
+        Halves the page size, returning False if it was the smallest.
+        """
+        if self.limit <= self.min_limit:
+            return False
+        self.limit = max(self.min_limit, self.limit // 2)
+        return True
+
+
+def set_page_limit(params, remaining=None, sizer=None):
+    """
+    Sets the ``limit`` of the next page in ``params``.
+    """
+    if sizer is not None:
+        params['limit'] = sizer.limit
+    if remaining is not None:
+        # No need for a full page when fewer results are wanted
+        left = remaining()
+        if left < int(params.get('limit', DEFAULT_LIMIT)):
+            params['limit'] = max(1, left)
+
+
 class Paginator(object):
     """
     Paginate through all entries:
@@ -10,6 +68,28 @@ class Paginator(object):
 
     >>> for result in paginator(limit=500):
     >>>     print result
+
+    Fetch the next page in the background while the current one is
+    being consumed:
+
+    >>> for result in paginator(prefetch=True):
+    >>>     print result
+
+    If a page can't be fetched (even after retries), pick up where
+    iteration stopped instead of starting over:
+
+    >>> for result in paginator(resume=True):
+    >>>     print result
+
+    Let the page size follow how fast pages are fetched and consumed (see
+    ``PageSizer``), rather than use the ``limit`` passed or the API's
+    default:
+
+    >>> for result in paginator(adaptive=True):
+    >>>     print result
+
+    With a ``limit``, the last page asks only for the results still
+    needed.
     """
 
     def __init__(self, *args, **params):
@@ -23,28 +103,140 @@ class Paginator(object):
         else:
             raise InterfaceNotDefined
         self.params = params
+        # Cursor of the first page not yet fully consumed
+        self.cursor = params.get('cursor')
+        # The ``PageSizer`` of the last ``adaptive`` iteration
+        self.sizer = None
 
     def __iter__(self):
         for result in self():
             yield result
 
-    def __call__(self, limit=None):
-        params = self.params.copy()
+    def __call__(self, limit=None, prefetch=False, resume=False, adaptive=False):
+        cursor = self.cursor if resume else self.params.get('cursor')
+        self.cursor = cursor
+        if adaptive is True:
+            adaptive = PageSizer(int(self.params.get('limit', DEFAULT_LIMIT)))
+        self.sizer = adaptive or None
         num = 0
-        more = True
-        while more and (not limit or num < limit):
-            if self.method:
-                results = self.method(self.endpoint, **params)
-            else:
-                results = self.endpoint(**params)
-            for result in results:
+
+        def remaining():
+            return limit - num
+
+        if prefetch:
+            pages = self._prefetched_pages(cursor, remaining if limit else None, self.sizer)
+        else:
+            pages = self._pages(cursor, remaining if limit else None, self.sizer)
+        try:
+            for results in pages:
+                for result in results:
+                    if limit and num >= limit:
+                        break
+                    num += 1
+                    yield result
                 if limit and num >= limit:
                     break
-                num += 1
-                yield result
+                if results.cursor and results.cursor['more']:
+                    self.cursor = results.cursor['id']
+                else:
+                    self.cursor = None
+        finally:
+            pages.close()
+
+    def _fetch(self, params):
+        if self.method:
+            return self.method(self.endpoint, **params)
+        return self.endpoint(**params)
 
+    def _pages(self, cursor=None, remaining=None, sizer=None):
+        """
+        Yields pages from ``cursor`` on. ``remaining`` returns how many
+        results are still wanted, and ``sizer`` is a ``PageSizer``.
+        """
+        params = self.params.copy()
+        if cursor is not None:
+            params['cursor'] = cursor
+        more = True
+        while more:
+            set_page_limit(params, remaining, sizer)
+            if sizer is None:
+                results = self._fetch(params)
+            else:
+                started = timer()
+                try:
+                    results = self._fetch(params)
+                except socket.timeout:
+                    if not sizer.shrink():
+                        raise
+                    continue
+                latency = timer() - started
             if results.cursor:
                 more = results.cursor['more']
                 params['cursor'] = results.cursor['id']
             else:
                 more = False
+            if sizer is None:
+                yield results
+            else:
+                started = timer()
+                yield results
+                sizer.observe(latency, timer() - started)
+
+    def _prefetched_pages(self, cursor=None, remaining=None, sizer=None):
+        """
+        Runs ``_pages`` in a background thread which fetches the next
+        page while the consumer goes through the current one, and stops
+        once it has fetched as many results as ``remaining`` asked for.
+        """
+        pages = queue.Queue()
+        taken = threading.Event()
+        taken.set()
+        done = threading.Event()
+        wanted = remaining() if remaining is not None else None
+        fetched = [0]
+
+        def unfetched():
+            return wanted - fetched[0]
+
+        def wait():
+            # Until the consumer has taken the last page
+            while not taken.wait(0.1):
+                if done.is_set():
+                    return False
+            taken.clear()
+            return not done.is_set()
+
+        def worker():
+            results_pages = self._pages(cursor, unfetched if wanted else None, sizer)
+            try:
+                while wait():
+                    try:
+                        results = next(results_pages)
+                    except StopIteration:
+                        break
+                    fetched[0] += len(results)
+                    pages.put((results, None))
+                    if wanted and fetched[0] >= wanted:
+                        break
+            except Exception as e:
+                pages.put((None, e))
+            else:
+                pages.put((None, None))
+            finally:
+                results_pages.close()
+
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                results, error = pages.get()
+                taken.set()
+                if error is not None:
+                    raise error
+                if results is None:
+                    return
+                yield results
+        finally:
+            # Lets the worker exit if the consumer stops early
+            done.set()
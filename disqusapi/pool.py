@@ -0,0 +1,236 @@
+"""
+Persistent HTTP/1.1 connections shared by a client.
+
+>>> pool = ConnectionPool(maxsize=4)
+>>> response, body = pool.urlopen('disqus.com', 'GET', '/api/3.0/...', '', {})
+"""
+import errno
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from disqusapi.compat import http_client as httplib
+from disqusapi.transport import Transport, read_response, send_request
+
+# Socket errors writing to a kept-alive connection the other end closed
+STALE_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+
+def is_stale(error, sending):
+    """
+    Whether ``error`` means a kept-alive connection had been closed by
+    the other end while idle: it failed while the request was being
+    written, or closed before any response came back. Timeouts, and
+    errors once a response started, never are.
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if sending:
+        return isinstance(error, socket.error) and error.errno in STALE_ERRNOS
+    return isinstance(error, httplib.BadStatusLine)
+
+
+def is_connection_dropped(sock):
+    """
+    Whether the other end closed ``sock`` while it sat idle: an idle
+    connection has nothing to read, so anything there (most likely the
+    end of the stream) means it can't be used.
+    """
+    try:
+        if hasattr(select, 'poll'):
+            poll = select.poll()
+            poll.register(sock, select.POLLIN)
+            return bool(poll.poll(0))
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, select.error, socket.error):
+        # Already closed
+        return True
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class HostPool(object):
+    def __init__(self, maxsize):
+        self.idle = deque()
+        self.slots = threading.BoundedSemaphore(maxsize)
+
+
+class ConnectionPool(Transport):
+    """
+    A bounded, thread-safe pool of keep-alive connections, kept per host.
+
+    At most ``maxsize`` connections per host are checked out at once;
+    callers beyond that wait up to ``block_timeout`` seconds (forever if
+    None). Connections left idle longer than ``idle_timeout`` are closed
+    on the next checkout.
+
+    A pool inherited by a forked process starts over empty there, leaving
+    the parent's connections to the parent.
+    """
+    connection_class = httplib.HTTPSConnection
+
+    def __init__(self, maxsize=10, idle_timeout=60, block_timeout=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.block_timeout = block_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.counters = {
+            'created': 0,
+            'reused': 0,
+            'evicted': 0,
+            'dropped': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'in_use': 0,
+        }
+
+    def _after_fork(self):
+        # The sockets are shared with the parent, so they are dropped
+        # rather than closed; the lock may have been held when forking.
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.counters['in_use'] = 0
+        self.pid = os.getpid()
+
+    def _host_pool(self, host):
+        if self.pid != os.getpid():
+            self._after_fork()
+        with self.lock:
+            try:
+                return self.hosts[host]
+            except KeyError:
+                pool = self.hosts[host] = HostPool(self.maxsize)
+                return pool
+
+    def _incr(self, key, amount=1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def _new_conn(self, host, timeout):
+        self._incr('created')
+        return self.connection_class(host, timeout=timeout)
+
+    def _get_conn(self, host, timeout):
+        """
+        Returns a ``(conn, reused)`` pair, evicting idle connections
+        which have outlived ``idle_timeout`` along the way.
+        """
+        pool = self._host_pool(host)
+        if self.block_timeout is None:
+            acquired = pool.slots.acquire()
+        else:
+            acquired = acquire_with_timeout(pool.slots, self.block_timeout)
+        if not acquired:
+            raise PoolTimeout('No connection to %s available after %ss' % (
+                host, self.block_timeout))
+        self._incr('in_use')
+
+        now = time.time()
+        while True:
+            with self.lock:
+                try:
+                    conn, last_used = pool.idle.pop()
+                except IndexError:
+                    break
+            if self.idle_timeout is not None and now - last_used > self.idle_timeout:
+                conn.close()
+                self._incr('evicted')
+                continue
+            if conn.sock is not None and is_connection_dropped(conn.sock):
+                conn.close()
+                self._incr('dropped')
+                continue
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            self._incr('reused')
+            return conn, True
+        return self._new_conn(host, timeout), False
+
+    def _put_conn(self, host, conn, keep=True):
+        pool = self._host_pool(host)
+        if keep:
+            with self.lock:
+                pool.idle.append((conn, time.time()))
+        else:
+            conn.close()
+            self._incr('discarded')
+        self._incr('in_use', -1)
+        pool.slots.release()
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        """
+        Sends a request over a pooled connection and returns
+        ``(response, body)`` with the body fully read.
+
+        Idle connections the other end has closed are replaced before
+        use. A request which still finds its reused connection closed
+        (see ``is_stale``) is sent again on a fresh one: whatever the
+        method if writing it failed, only a GET once it was written. With
+        a ``trace`` (see ``disqusapi.tracing``) each step is timed.
+        """
+        conn, reused = self._get_conn(host, timeout)
+        try:
+            while True:
+                sending = True
+                try:
+                    send_request(conn, method, path, body, headers, trace)
+                    sending = False
+                    response, data = read_response(conn, trace)
+                except Exception as e:
+                    conn.close()
+                    # Once written, only GETs are sent again: the server may
+                    # have acted on anything else
+                    if not reused or not is_stale(e, sending) or \
+                            (method != 'GET' and not sending):
+                        raise
+                    self._incr('reconnects')
+                    conn, reused = self._new_conn(host, timeout), False
+                    continue
+                break
+        except Exception:
+            self._put_conn(host, conn, keep=False)
+            raise
+        self._put_conn(host, conn, keep=not response.will_close)
+        return response, data
+
+    def clear(self):
+        """
+        Closes every idle connection.
+        """
+        with self.lock:
+            pools = list(self.hosts.values())
+        for pool in pools:
+            while True:
+                with self.lock:
+                    try:
+                        conn, _ = pool.idle.pop()
+                    except IndexError:
+                        break
+                conn.close()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['idle'] = sum(len(p.idle) for p in self.hosts.values())
+        return stats
+
+
+def acquire_with_timeout(lock, timeout):
+    # Python 2 locks don't accept a timeout, so poll instead.
+    try:
+        return lock.acquire(True, timeout)
+    except TypeError:  # pragma: no cover
+        deadline = time.time() + timeout
+        while not lock.acquire(False):
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
@@ -0,0 +1,180 @@
+"""
+Client-side pacing of API calls.
+
+>>> api = DisqusAPI(secret_key, public_key, rate_limiter=RateLimiter())
+>>> api.rate_limiter.stats()
+{'rate': 0.27, 'tokens': 0.4, 'limit': 1000, 'remaining': 973, 'reset': 1414620000, ...}
+
+The limiter is a token bucket whose refill rate is learned from the
+``X-Ratelimit-*`` headers of each response: the calls remaining in the
+current window are spread evenly over the time left in it, rather than
+spent as fast as possible until the API starts refusing them.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from disqusapi.utils import reset_after_fork
+
+# How long the API's rate limit windows last, in seconds
+WINDOW = 3600
+
+
+class RateLimiter(object):
+    """
+    A token bucket shared by every thread using the client.
+
+    ``rate`` (calls per second) caps the pace, and is the only limit
+    until the API has told us about the current window. ``burst`` is
+    how many calls may go out back to back.
+    """
+    def __init__(self, rate=None, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.state = self._initial_state()
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def _initial_state(self):
+        return {
+            'rate': self.rate,
+            'tokens': float(self.burst),
+            'updated': time.time(),
+            'limit': None,
+            'remaining': None,
+            'reset': None,
+            'throttled': 0,
+            'waited': 0.0,
+        }
+
+    @contextmanager
+    def _locked_state(self):
+        with self.lock:
+            yield self.state
+
+    def reserve(self):
+        """
+        Takes a token and returns how many seconds to wait before
+        using it.
+        """
+        with self._locked_state() as state:
+            now = time.time()
+            if state['reset'] is not None and now >= state['reset']:
+                # The window we learned about is over. Calls queued behind
+                # it keep their place through the bucket's debt.
+                state['rate'] = self._next_rate(state)
+                state['remaining'] = state['reset'] = None
+            rate = state['rate']
+            wait = 0.0
+            if state['remaining'] is not None:
+                if state['remaining'] <= 0:
+                    # Nothing left: queue up behind the reset, at the
+                    # pace of the next window
+                    rate = self._next_rate(state)
+                    if rate is None:
+                        wait = state['reset'] - now
+                    elif state['updated'] < state['reset']:
+                        state['updated'] = state['reset']
+                state['remaining'] -= 1
+            if rate:
+                # ``updated`` is in the future while calls are queued
+                # behind a reset
+                elapsed = max(0.0, now - state['updated'])
+                tokens = min(self.burst, state['tokens'] + elapsed * rate) - 1
+                state['tokens'] = tokens
+                state['updated'] = max(now, state['updated'])
+                wait = max(wait, state['updated'] - now + max(0.0, -tokens) / rate)
+            if wait > 0:
+                state['throttled'] += 1
+                state['waited'] += wait
+        return wait
+
+    def _next_rate(self, state):
+        """
+        The pace once the current window is over: ``rate``, or else the
+        window's limit spread over it.
+        """
+        if self.rate:
+            return self.rate
+        if state['limit']:
+            return float(state['limit']) / WINDOW
+        return None
+
+    def acquire(self):
+        """
+        Blocks until a call may be made.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, limit, remaining, reset):
+        """
+        Adjusts the pace to what is left of the current window. ``reset``
+        is the time (epoch seconds) the window ends.
+        """
+        with self._locked_state() as state:
+            now = time.time()
+            state['limit'] = limit
+            state['remaining'] = remaining
+            state['reset'] = reset
+            rate = max(remaining, 0) / max(reset - now, 1.0)
+            if self.rate:
+                rate = min(rate, self.rate)
+            # Refill at the old rate up to now before switching
+            if state['rate'] and now > state['updated']:
+                state['tokens'] = min(
+                    self.burst, state['tokens'] + (now - state['updated']) * state['rate'])
+            state['updated'] = max(now, state['updated'])
+            state['rate'] = rate
+
+    def update_from_response(self, response):
+        try:
+            remaining = int(response.getheader('X-Ratelimit-Remaining'))
+            reset = float(response.getheader('X-Ratelimit-Reset'))
+        except (TypeError, ValueError):
+            return
+        limit = response.getheader('X-Ratelimit-Limit')
+        self.update(int(limit) if limit else None, remaining, reset)
+
+    def stats(self):
+        with self._locked_state() as state:
+            stats = dict(state)
+        del stats['updated']
+        return stats
+
+
+class FileRateLimiter(RateLimiter):
+    """
+    A ``RateLimiter`` whose state lives in a file, so every process on
+    the machine using the same ``path`` shares one budget (POSIX only).
+    """
+    def __init__(self, path, rate=None, burst=10):
+        import fcntl
+        self.fcntl = fcntl
+        self.path = path
+        super(FileRateLimiter, self).__init__(rate, burst)
+
+    @contextmanager
+    def _locked_state(self):
+        with self.lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                self.fcntl.flock(fd, self.fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), 'r+') as fp:
+                    try:
+                        state = json.load(fp)
+                    except ValueError:
+                        # New (or damaged) file
+                        state = self.state
+                    yield state
+                    fp.seek(0)
+                    fp.truncate()
+                    json.dump(state, fp)
+            finally:
+                os.close(fd)
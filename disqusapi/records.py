@@ -0,0 +1,216 @@
+"""
+Compact record types for the objects the API returns.
+
+>>> for post in Paginator(api.forums.listPosts, forum='disqus', related=['thread'],
+>>>                       records=True, fields=['id', 'message', 'author', 'thread']):
+>>>     print post.id, post.author.username, post.thread.title
+
+Records keep their fields in ``__slots__`` instead of a per-object dict.
+Nested objects (a post's ``author`` or ``thread``) are kept as returned
+and only turned into records when first accessed. ``fields`` drops
+everything else as the response is parsed; it also works without
+``records``, giving trimmed down dicts.
+"""
+from disqusapi import compat
+
+RECORD_TYPES = {}
+
+
+class Nested(object):
+    """
+    A field holding another object, converted to a record on first access.
+    """
+    def __init__(self, slot, kind):
+        self.slot = slot
+        self.kind = kind
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if isinstance(value, dict):
+            value = RECORD_TYPES[self.kind](value)
+            setattr(obj, self.slot, value)
+        return value
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+
+class Record(object):
+    __slots__ = ('extra',)
+    fields = ()
+    slots = frozenset()
+    slot_names = ()
+
+    def __init__(self, data, fields=None):
+        extra = None
+        for key, value in compat.iteritems(data):
+            if fields is not None and key not in fields:
+                continue
+            if key in self.slots:
+                setattr(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self.extra = extra
+
+    def __getattr__(self, name):
+        # Only called for unset slots and fields we have no slot for
+        extra = object.__getattribute__(self, 'extra') if name != 'extra' else None
+        if extra and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.get('id'))
+
+    def __reduce__(self):
+        return (self.__class__, (self.to_dict(),))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        # Look at the slots so nested objects aren't converted
+        keys = [f for f, slot in self.slot_names if hasattr(self, slot)]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def to_dict(self):
+        data = {}
+        for field, slot in self.slot_names:
+            try:
+                value = getattr(self, slot)
+            except AttributeError:
+                continue
+            if isinstance(value, Record):
+                value = value.to_dict()
+            data[field] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+def record_type(name, fields, nested=None):
+    """
+    Creates a ``Record`` subclass with a slot for each of ``fields``.
+    ``nested`` maps fields holding objects to the name of their record type.
+    """
+    nested = nested or {}
+    slot_names = tuple((f, '_' + f if f in nested else f) for f in fields)
+    attrs = {
+        '__slots__': tuple(slot for _, slot in slot_names),
+        'fields': tuple(fields),
+        'slots': frozenset(fields),
+        'slot_names': slot_names,
+    }
+    for field, kind in compat.iteritems(nested):
+        attrs[field] = Nested('_' + field, kind)
+    cls = RECORD_TYPES[name] = type(name, (Record,), attrs)
+    return cls
+
+
+Forum = record_type('Forum', [
+    'id', 'name', 'url', 'favicon', 'founder', 'createdAt', 'language', 'description',
+    'guidelines', 'raw_guidelines', 'settings', 'pk', 'channel', 'organizationId',
+    'category', 'daysAlive', 'twitterName', 'avatar', 'signedUrl', 'permissions',
+])
+
+User = record_type('User', [
+    'id', 'username', 'name', 'about', 'url', 'profileUrl', 'emailHash', 'avatar',
+    'isAnonymous', 'isPrimary', 'isPrivate', 'isPowerContributor', 'joinedAt', 'location',
+    'rep', 'reputation', 'reputationLabel', 'numPosts', 'numFollowers', 'numFollowing',
+    'numForumsFollowing', 'numLikesReceived', 'disable3rdPartyTrackers', 'signedUrl',
+])
+
+Thread = record_type('Thread', [
+    'id', 'title', 'clean_title', 'link', 'slug', 'identifiers', 'feed', 'forum', 'author',
+    'category', 'message', 'raw_message', 'createdAt', 'posts', 'likes', 'dislikes',
+    'userScore', 'isClosed', 'isDeleted', 'isSpam', 'highlightedPost', 'canPost',
+    'canModerate', 'userSubscription', 'signedLink', 'validateAllPosts', 'reactions',
+], nested={'forum': 'Forum', 'author': 'User'})
+
+Post = record_type('Post', [
+    'id', 'message', 'raw_message', 'createdAt', 'author', 'thread', 'forum', 'parent',
+    'likes', 'dislikes', 'points', 'numReports', 'isApproved', 'isDeleted', 'isDeletedByAuthor',
+    'isEdited', 'isFlagged', 'isHighlighted', 'isSpam', 'media', 'sb', 'editableUntil',
+    'canVote', 'userScore', 'moderationLabels',
+], nested={'author': 'User', 'thread': 'Thread', 'forum': 'Forum'})
+
+# Last part of an endpoint name -> record type of the objects it returns
+LIST_TYPES = {
+    'listPosts': Post,
+    'listThreads': Thread,
+    'listActiveThreads': Thread,
+    'listHot': Thread,
+    'listPopular': Thread,
+    'listUsers': User,
+    'listFollowers': User,
+    'listFollowing': User,
+    'listMostActiveUsers': User,
+    'listMostLikedUsers': User,
+    'listActiveForums': Forum,
+    'listForums': Forum,
+    'listFollowedForums': Forum,
+}
+
+RESOURCE_TYPES = {
+    'posts': Post,
+    'threads': Thread,
+    'users': User,
+    'forums': Forum,
+}
+
+
+def get_record_type(endpoint):
+    """
+    Returns the record type for the objects ``endpoint`` returns, if known.
+    """
+    resource, _, name = endpoint.rpartition('.')
+    try:
+        return LIST_TYPES[name]
+    except KeyError:
+        pass
+    if name in ('details', 'list', 'create', 'update'):
+        return RESOURCE_TYPES.get(resource)
+    return None
+
+
+def get_converter(endpoint, records=False, fields=None):
+    """
+    Returns a function turning each object returned by ``endpoint`` into
+    a record (or projected dict), or None if objects are kept as is.
+    """
+    if fields is not None:
+        fields = frozenset(fields)
+    if records:
+        cls = get_record_type(endpoint)
+        if cls is not None:
+            return lambda data: cls(data, fields) if isinstance(data, dict) else data
+    if fields is not None:
+        return lambda data: dict(
+            (k, v) for k, v in compat.iteritems(data) if k in fields
+        ) if isinstance(data, dict) else data
+    return None
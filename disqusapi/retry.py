@@ -0,0 +1,105 @@
+"""
+Retrying failed calls.
+
+>>> api = DisqusAPI(secret_key, public_key, retry=Retry(total=3))
+
+Only idempotent (GET) endpoints are retried, after a connection error,
+a timeout or a 5xx response, backing off exponentially with full jitter
+between attempts. A ``RetryBudget`` shared by every call caps retries to
+a fraction of the calls made, so an outage doesn't multiply the load on
+the API by ``total``.
+"""
+import random
+import socket
+import threading
+
+from disqusapi.compat import http_client as httplib
+from disqusapi.utils import reset_after_fork
+
+# Errors raised by the transport that are worth another attempt
+RETRY_ERRORS = (socket.error, socket.timeout, httplib.HTTPException)
+
+
+class RetryBudget(object):
+    """
+    Each call deposits ``ratio`` of a token and each retry withdraws a
+    whole one. ``min_tokens`` allows a few retries while traffic is low.
+    """
+    def __init__(self, ratio=0.1, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self.lock = threading.Lock()
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Retry(object):
+    def __init__(self, total=3, backoff=0.1, max_backoff=10.0,
+                 statuses=(500, 502, 503, 504), budget=None):
+        self.total = total
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.budget = budget if budget is not None else RetryBudget()
+        self.lock = threading.Lock()
+        self.counters = {
+            'retries': 0,
+            'exhausted': 0,
+            'budget_exhausted': 0,
+        }
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def _incr(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def on_request(self):
+        self.budget.deposit()
+
+    def is_retryable(self, request):
+        return request.method == 'GET'
+
+    def allow(self, request, attempt):
+        """
+        Whether ``request``, which failed on its ``attempt`` (from 0),
+        may be sent again.
+        """
+        if not self.is_retryable(request):
+            return False
+        if attempt >= self.total:
+            self._incr('exhausted')
+            return False
+        if not self.budget.withdraw():
+            self._incr('budget_exhausted')
+            return False
+        self._incr('retries')
+        return True
+
+    def get_backoff(self, attempt):
+        """
+        Seconds to wait before retry number ``attempt`` (from 0).
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['budget'] = self.budget.tokens
+        return stats
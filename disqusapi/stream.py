@@ -0,0 +1,160 @@
+"""
+Incremental decoding of list responses.
+
+>>> for post in api.forums.listPosts(forum='disqus', limit=100, stream=True):
+>>>     print post
+
+The body is gunzipped and parsed a chunk at a time, and objects in the
+``response`` array are decoded one by one as they are iterated over,
+so only the compressed body and the current object are held in memory.
+"""
+import codecs
+import re
+import zlib
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from disqusapi.compat import xrange
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_chunks(body, gzipped=False, chunk_size=CHUNK_SIZE):
+    """
+    Yields ``body`` in chunks, decompressing them on the fly.
+    """
+    if gzipped:
+        # See: http://stackoverflow.com/a/2424549
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for start in xrange(0, len(body), chunk_size):
+        chunk = body[start:start + chunk_size]
+        if gzipped:
+            chunk = decompressor.decompress(chunk)
+        yield chunk
+    if gzipped:
+        yield decompressor.flush()
+
+
+class ResponseStream(object):
+    """
+    Parses a ``{"code": ..., "cursor": ..., "response": [...]}`` document
+    from an iterable of byte chunks, handing out the items of the
+    ``response`` array one at a time. Every other top-level key is
+    collected into ``data``.
+    """
+    decoder = json.JSONDecoder()
+
+    def __init__(self, chunks, encoding='utf-8'):
+        from disqusapi import FormattingError
+        self.error = FormattingError
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder(encoding)()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.data = {}
+        self.finished = False
+
+    def _fill(self):
+        """
+        Appends the next chunk to the buffer; False once input runs out.
+        """
+        if self.eof:
+            return False
+        # Drop what has already been parsed
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            self.buf += self.text.decode(b'', True)
+            return False
+        self.buf += self.text.decode(chunk)
+        return True
+
+    def _peek(self):
+        """
+        Skips whitespace and returns the next character (None at the end).
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self.error(self.buf[self.pos:self.pos + 100])
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._fill():
+                    raise self.error(self.buf[self.pos:self.pos + 100])
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def _next_key(self):
+        """
+        Returns the next top-level key, or None once the document ends.
+        """
+        char = self._peek()
+        if char == '}':
+            self.pos += 1
+            return None
+        if char == ',':
+            self.pos += 1
+        key = self._value()
+        self._expect(':')
+        return key
+
+    def start(self):
+        """
+        Reads up to the ``response`` array. Returns False if the response
+        isn't a list, in which case the whole document is in ``data``.
+        """
+        self._expect('{')
+        while True:
+            key = self._next_key()
+            if key is None:
+                self.finished = True
+                return False
+            if key == 'response' and self._peek() == '[':
+                self.pos += 1
+                return True
+            self.data[key] = self._value()
+
+    def items(self):
+        first = True
+        while True:
+            char = self._peek()
+            if char == ']':
+                self.pos += 1
+                break
+            if not first:
+                self._expect(',')
+            first = False
+            yield self._value()
+        # Anything after the array, the cursor for instance
+        while True:
+            key = self._next_key()
+            if key is None:
+                break
+            self.data[key] = self._value()
+        self.finished = True
@@ -1,6 +1,20 @@
+import errno
+import json
 import mock
 import os
 import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+try:
+    import http.server as http_server
+    import socketserver
+except ImportError:
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
 
 import disqusapi
 from disqusapi.compat import xrange
@@ -69,6 +83,2067 @@ class MockResponse(object):
         return self.body
 
 
+class FakeHTTPResponse(object):
+    def __init__(self, body=b'{}', status=200, headers=None, will_close=False):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.will_close = will_close
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class FakeConnection(object):
+    """
+    Stands in for ``HTTPSConnection``; each instance answers with the
+    next item of ``responses`` (raising it if it is an exception).
+    Sending raises the next item of ``send_errors``, if any.
+    """
+    responses = []
+    send_errors = []
+    instances = []
+
+    def __init__(self, host, timeout=None):
+        self.host = host
+        self.timeout = timeout
+        self.sock = None
+        self.closed = False
+        self.requests = []
+        FakeConnection.instances.append(self)
+
+    def connect(self):
+        self.sock = mock.Mock()
+
+    def request(self, method, path, body, headers):
+        self.requests.append((method, path, body, headers))
+        if FakeConnection.send_errors:
+            raise FakeConnection.send_errors.pop(0)
+
+    def getresponse(self):
+        response = FakeConnection.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnectionPool(disqusapi.ConnectionPool):
+    connection_class = FakeConnection
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        FakeConnection.responses = []
+        FakeConnection.send_errors = []
+        FakeConnection.instances = []
+
+    def test_reuses_connection(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse()]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(len(FakeConnection.instances), 1)
+        stats = pool.stats()
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(stats['reused'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_will_close_discards_connection(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [FakeHTTPResponse(will_close=True), FakeHTTPResponse()]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(len(FakeConnection.instances), 2)
+        self.assertTrue(FakeConnection.instances[0].closed)
+
+    def test_reconnects_stale_connection(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [
+            FakeHTTPResponse(),
+            disqusapi.pool.httplib.BadStatusLine(''),
+            FakeHTTPResponse(body=b'fresh'),
+        ]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        response, body = pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(body, b'fresh')
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        self.assertEqual(len(FakeConnection.instances), 2)
+
+    def test_reconnects_on_reset_while_sending(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse(body=b'fresh')]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        FakeConnection.send_errors = [socket.error(errno.EPIPE, 'Broken pipe')]
+        response, body = pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(body, b'fresh')
+        self.assertEqual(pool.stats()['reconnects'], 1)
+
+    def test_timeout_is_not_retried(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [
+            FakeHTTPResponse(),
+            socket.timeout('timed out'),
+            FakeHTTPResponse(),
+        ]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        with self.assertRaises(socket.timeout):
+            pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(pool.stats()['reconnects'], 0)
+        self.assertEqual(len(FakeConnection.instances), 1)
+
+    def test_post_is_not_sent_again(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [
+            FakeHTTPResponse(),
+            disqusapi.pool.httplib.BadStatusLine(''),
+            FakeHTTPResponse(),
+        ]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        with self.assertRaises(disqusapi.pool.httplib.BadStatusLine):
+            pool.urlopen('example.com', 'POST', '/b', 'message=hi', {})
+        self.assertEqual(pool.stats()['reconnects'], 0)
+        self.assertEqual(len(FakeConnection.instances), 1)
+        self.assertEqual(len(FakeConnection.instances[0].requests), 2)
+
+    def test_post_sent_again_when_writing_fails(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse(body=b'fresh')]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        FakeConnection.send_errors = [socket.error(errno.EPIPE, 'Broken pipe')]
+        response, body = pool.urlopen('example.com', 'POST', '/b', 'message=hi', {})
+        self.assertEqual(body, b'fresh')
+        self.assertEqual(pool.stats()['reconnects'], 1)
+
+    def test_dropped_connection_is_replaced(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse(), FakeHTTPResponse()]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        sock, peer = socket.socketpair()
+        try:
+            FakeConnection.instances[0].sock = sock
+            pool.urlopen('example.com', 'POST', '/b', 'message=hi', {})
+            self.assertEqual(len(FakeConnection.instances), 1)
+            peer.close()
+            pool.urlopen('example.com', 'POST', '/c', 'message=hi', {})
+        finally:
+            sock.close()
+            peer.close()
+        self.assertEqual(len(FakeConnection.instances), 2)
+        self.assertTrue(FakeConnection.instances[0].closed)
+        self.assertEqual(pool.stats()['dropped'], 1)
+
+    def test_post_after_server_closed_idle_connection(self):
+        from disqusapi.compat import http_client
+
+        class LocalPool(disqusapi.ConnectionPool):
+            connection_class = http_client.HTTPConnection
+
+        server = start_local_server(IdleClosingHandler)
+        host = '%s:%d' % server.server_address
+        try:
+            pool = LocalPool()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            for _ in range(2):
+                response, body = pool.urlopen(
+                    host, 'POST', '/api/3.0/posts/create.json', 'message=hi', headers)
+                self.assertEqual(response.status, 200)
+                time.sleep(0.3)
+            self.assertEqual(pool.stats()['dropped'], 1)
+            pool.clear()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_fresh_connection_errors_propagate(self):
+        pool = FakeConnectionPool()
+        FakeConnection.responses = [socket.error('refused')]
+        with self.assertRaises(socket.error):
+            pool.urlopen('example.com', 'GET', '/a', '', {})
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_evicts_idle_connections(self):
+        pool = FakeConnectionPool(idle_timeout=0)
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse()]
+        pool.urlopen('example.com', 'GET', '/a', '', {})
+        time.sleep(0.01)
+        pool.urlopen('example.com', 'GET', '/b', '', {})
+        self.assertEqual(pool.stats()['evicted'], 1)
+        self.assertTrue(FakeConnection.instances[0].closed)
+
+    def test_block_timeout(self):
+        pool = FakeConnectionPool(maxsize=1, block_timeout=0.01)
+        pool._get_conn('example.com', None)
+        with self.assertRaises(disqusapi.pool.PoolTimeout):
+            pool._get_conn('example.com', None)
+
+
+IMPORT_SCRIPT = """
+import sys, time
+started = time.time()
+import disqusapi
+elapsed = time.time() - started
+print(elapsed)
+print(disqusapi._interfaces is None)
+print('pkg_resources' in sys.modules)
+"""
+
+
+class ImportTest(TestCase):
+    def test_import_is_lazy(self):
+        import subprocess
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], cwd=root)
+        elapsed, interfaces_pending, pkg_resources = output.decode('utf-8').split()
+        if sys.version_info >= (3, 7):
+            self.assertEqual(interfaces_pending, 'True')
+        self.assertEqual(pkg_resources, 'False')
+        # Generous, only meant to catch a heavy import slipping back in
+        self.assertTrue(float(elapsed) < 1.0)
+
+    def test_interfaces(self):
+        self.assertTrue('threads' in disqusapi.INTERFACES)
+        self.assertTrue(disqusapi.INTERFACES is disqusapi.get_interfaces())
+
+
+class CacheTest(TestCase):
+    def setUp(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = []
+
+    def get_api(self, cache, **kwargs):
+        return disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(), cache=cache, **kwargs)
+
+    def test_caches_get(self):
+        api = self.get_api(disqusapi.MemoryCache())
+        FakeConnection.responses = [FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}')]
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        stats = api.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_param_order_does_not_matter(self):
+        api = self.get_api(disqusapi.MemoryCache())
+        FakeConnection.responses = [FakeHTTPResponse(b'{"code": 0, "response": []}')]
+        api.trends.listThreads(forum='disqus', limit=10)
+        api.trends.listThreads(limit=10, forum='disqus')
+        self.assertEqual(api.cache.stats()['hits'], 1)
+
+    def test_endpoints_without_ttl_are_not_cached(self):
+        api = self.get_api(disqusapi.MemoryCache())
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": []}'),
+            FakeHTTPResponse(b'{"code": 0, "response": []}'),
+        ]
+        api.posts.list(forum='disqus')
+        api.posts.list(forum='disqus')
+        self.assertEqual(api.cache.stats()['size'], 0)
+        self.assertEqual(FakeConnection.responses, [])
+
+    def test_post_invalidates_related(self):
+        api = self.get_api(disqusapi.MemoryCache(), cache_ttl=60)
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}'),
+            FakeHTTPResponse(b'{"code": 0, "response": []}'),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}'),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "2"}}'),
+        ]
+        api.forums.details(forum='disqus')
+        api.threads.listPosts(thread=1)
+        api.threads.details(thread=1)
+        self.assertEqual(api.cache.stats()['size'], 3)
+        api.posts.create(message='hi')
+        self.assertEqual(sorted(e for e, _ in api.cache.entries),
+                         ['forums.details', 'threads.details'])
+
+    def test_lru_eviction(self):
+        cache = disqusapi.MemoryCache(maxsize=2)
+        cache.set('threads.details', 'a', 1, 60)
+        cache.set('threads.details', 'b', 2, 60)
+        cache.get('threads.details', 'a')
+        cache.set('threads.details', 'c', 3, 60)
+        self.assertEqual(cache.get('threads.details', 'b'), None)
+        self.assertEqual(cache.get('threads.details', 'a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expiry(self):
+        cache = disqusapi.MemoryCache()
+        cache.set('threads.details', 'a', 1, -1)
+        self.assertEqual(cache.get('threads.details', 'a'), None)
+
+    def test_file_cache(self):
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        try:
+            cache = disqusapi.FileCache(path)
+            cache.set('threads.details', 'a', ({}, b'body'), 60)
+            self.assertEqual(disqusapi.FileCache(path).get('threads.details', 'a'),
+                             ({}, b'body'))
+            with open(os.path.join(path, 'threads.details-a'), 'rb') as fp:
+                self.assertEqual(json.loads(fp.read().decode('utf-8'))['body'], 'Ym9keQ==')
+            cache.invalidate(lambda endpoint: endpoint.startswith('threads.'))
+            self.assertEqual(cache.get('threads.details', 'a'), None)
+        finally:
+            shutil.rmtree(path)
+
+    def test_file_cache_default_path(self):
+        import shutil
+        import stat
+        import tempfile
+        home = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': home}):
+                cache = disqusapi.FileCache()
+            self.assertEqual(cache.path, os.path.join(home, 'disqusapi'))
+            if os.name == 'posix':
+                self.assertEqual(stat.S_IMODE(os.stat(cache.path).st_mode), 0o700)
+        finally:
+            shutil.rmtree(home)
+
+    def test_file_cache_prunes(self):
+        import shutil
+        import tempfile
+        path = tempfile.mkdtemp()
+        try:
+            cache = disqusapi.FileCache(path, maxsize=2)
+            cache.prune_interval = 5
+            cache.set('threads.details', 'expired', ({}, b''), -1)
+            self.assertEqual(cache.get('threads.details', 'expired'), None)
+            self.assertEqual(os.listdir(path), [])
+            cache.set('threads.details', 'expired', ({}, b''), -1)
+            for n, ttl in enumerate([30, 10, 20]):
+                cache.set('threads.details', str(n), ({}, b''), ttl)
+            # The expired entry, then the one closest to expiring went
+            self.assertEqual(sorted(os.listdir(path)),
+                             ['threads.details-0', 'threads.details-2'])
+            self.assertEqual(cache.stats()['evictions'], 1)
+        finally:
+            shutil.rmtree(path)
+
+
+class RevalidationTest(TestCase):
+    def setUp(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = []
+
+    def get_api(self, **kwargs):
+        return disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(),
+                                   revalidate=disqusapi.RevalidationCache(maxsize=2), **kwargs)
+
+    def sent_headers(self):
+        return [r[3] for c in FakeConnection.instances for r in c.requests]
+
+    def test_not_modified(self):
+        api = self.get_api()
+        FakeConnection.responses = [
+            FakeHTTPResponse(gzip_body({'code': 0, 'response': {'id': '1'}}), headers={
+                'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT',
+                'Content-Encoding': 'gzip'}),
+            FakeHTTPResponse(b'', status=304),
+        ]
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        first, second = self.sent_headers()
+        self.assertFalse('If-None-Match' in first)
+        self.assertEqual(second['If-None-Match'], '"v1"')
+        self.assertEqual(second['If-Modified-Since'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(api.revalidate.stats()['not_modified'], 1)
+        # Headers shared between requests are left alone
+        self.assertFalse('If-None-Match' in api.headers['GET'])
+
+    def test_modified(self):
+        api = self.get_api()
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}', headers={'ETag': '"v1"'}),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "2"}}', headers={'ETag': '"v2"'}),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "3"}}'),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "4"}}'),
+        ]
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(api.threads.details(thread=1), {'id': '2'})
+        # No validators: nothing left to revalidate against
+        self.assertEqual(api.threads.details(thread=1), {'id': '3'})
+        self.assertEqual(api.threads.details(thread=1), {'id': '4'})
+        headers = self.sent_headers()
+        self.assertEqual([h.get('If-None-Match') for h in headers], [None, '"v1"', '"v2"', None])
+        self.assertEqual(api.revalidate.stats()['modified'], 2)
+
+    def test_bounded(self):
+        api = self.get_api()
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {}}', headers={'ETag': '"%d"' % n})
+            for n in range(3)]
+        for thread in range(3):
+            api.threads.details(thread=thread)
+        stats = api.revalidate.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+
+    def test_posts_are_not_conditional(self):
+        api = self.get_api()
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {}}', headers={'ETag': '"v1"'})] * 2
+        api.posts.create(message='hi')
+        api.posts.create(message='hi')
+        self.assertEqual(api.revalidate.stats()['size'], 0)
+
+
+def gzip_body(data):
+    import gzip
+    import io
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+        fp.write(json.dumps(data).encode('utf-8'))
+    return buf.getvalue()
+
+
+class StreamTest(TestCase):
+    def parse(self, data, chunk_size=7, gzipped=False):
+        from disqusapi.stream import ResponseStream, iter_chunks
+        body = gzip_body(data) if gzipped else json.dumps(data).encode('utf-8')
+        return ResponseStream(iter_chunks(body, gzipped, chunk_size))
+
+    def test_items(self):
+        items = [{'id': str(n), 'message': u'caf\xe9 %d' % n, 'n': n * 1000} for n in range(50)]
+        data = {'cursor': {'id': 'x', 'more': True}, 'code': 0, 'response': items}
+        stream = self.parse(data, gzipped=True)
+        self.assertTrue(stream.start())
+        self.assertEqual(stream.data['cursor'], {'id': 'x', 'more': True})
+        self.assertEqual(list(stream.items()), items)
+        self.assertTrue(stream.finished)
+
+    def test_trailing_keys(self):
+        stream = self.parse({'response': [1, 22, 333], 'cursor': {'more': False}}, chunk_size=1)
+        self.assertTrue(stream.start())
+        self.assertEqual(list(stream.items()), [1, 22, 333])
+        self.assertEqual(stream.data['cursor'], {'more': False})
+
+    def test_empty_list(self):
+        stream = self.parse({'code': 0, 'response': []})
+        self.assertTrue(stream.start())
+        self.assertEqual(list(stream.items()), [])
+
+    def test_not_a_list(self):
+        stream = self.parse({'code': 0, 'response': {'id': '1'}})
+        self.assertFalse(stream.start())
+        self.assertEqual(stream.data['response'], {'id': '1'})
+
+    def test_malformed(self):
+        from disqusapi.stream import ResponseStream
+        stream = ResponseStream([b'{"code": 0, "response": [{"id": 1}, {"id"'])
+        self.assertTrue(stream.start())
+        items = stream.items()
+        self.assertEqual(next(items), {'id': 1})
+        with self.assertRaises(disqusapi.FormattingError):
+            next(items)
+
+    def test_streaming_request(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = [FakeHTTPResponse(
+            gzip_body({'response': [{'id': '1'}, {'id': '2'}],
+                       'cursor': {'id': 'c', 'more': False}}),
+            headers={'Content-Encoding': 'gzip'})]
+        api = disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool())
+        result = api.forums.listPosts(forum='disqus', stream=True)
+        self.assertTrue(isinstance(result, disqusapi.StreamingResult))
+        self.assertEqual(result.cursor['id'], 'c')
+        self.assertEqual(list(result), [{'id': '1'}, {'id': '2'}])
+        self.assertTrue('stream' not in FakeConnection.instances[0].requests[0][1])
+
+
+class RecordsTest(TestCase):
+    POST = {
+        'id': '1',
+        'message': 'hi',
+        'author': {'id': '2', 'username': 'bob', 'reputation': 1.5},
+        'thread': '3',
+        'somethingNew': True,
+    }
+
+    def test_record(self):
+        from disqusapi.records import Post, User
+        post = Post(self.POST)
+        self.assertFalse(hasattr(post, '__dict__'))
+        self.assertEqual(post.id, '1')
+        self.assertEqual(post['message'], 'hi')
+        self.assertEqual(post.thread, '3')
+        self.assertEqual(post.somethingNew, True)
+        self.assertTrue(isinstance(post._author, dict))
+        self.assertTrue(isinstance(post.author, User))
+        self.assertEqual(post.author.username, 'bob')
+        self.assertEqual(post.to_dict(), self.POST)
+        self.assertEqual(post.get('parent'), None)
+        with self.assertRaises(AttributeError):
+            post.parent
+
+    def test_projection(self):
+        from disqusapi.records import Post
+        post = Post(self.POST, fields=frozenset(['id', 'author']))
+        self.assertEqual(sorted(post.keys()), ['author', 'id'])
+        self.assertEqual(post.extra, None)
+
+    def test_pickle(self):
+        import pickle
+        from disqusapi.records import Post
+        post = Post(self.POST)
+        self.assertEqual(pickle.loads(pickle.dumps(post)), post)
+
+    def test_request(self):
+        from disqusapi.records import Post, Thread
+        FakeConnection.responses = [
+            FakeHTTPResponse(json.dumps({'code': 0, 'response': [self.POST]}).encode('utf-8')),
+            FakeHTTPResponse(json.dumps({'code': 0, 'response': {'id': '3'}}).encode('utf-8')),
+            FakeHTTPResponse(json.dumps({'code': 0, 'response': [self.POST]}).encode('utf-8')),
+        ]
+        api = disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(), records=True)
+        posts = api.forums.listPosts(forum='disqus', fields=['id', 'message'])
+        self.assertTrue(isinstance(posts[0], Post))
+        self.assertEqual(posts[0].to_dict(), {'id': '1', 'message': 'hi'})
+        self.assertTrue(isinstance(api.threads.details(thread=3), Thread))
+        posts = api.forums.listPosts(forum='disqus', records=False, fields=['id'])
+        self.assertEqual(posts[0], {'id': '1'})
+
+
+class RetryTest(TestCase):
+    def setUp(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = []
+
+    def get_api(self, retry):
+        return disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(), retry=retry)
+
+    def test_retries_connection_errors(self):
+        FakeConnection.responses = [
+            socket.timeout('timed out'),
+            FakeHTTPResponse(b'{"code": 15, "response": "oops"}', status=503),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}'),
+        ]
+        api = self.get_api(disqusapi.Retry(total=2, backoff=0))
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(api.retry.stats()['retries'], 2)
+
+    def test_gives_up(self):
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 15, "response": "oops"}', status=500),
+            FakeHTTPResponse(b'{"code": 15, "response": "oops"}', status=500),
+        ]
+        api = self.get_api(disqusapi.Retry(total=1, backoff=0))
+        with self.assertRaises(disqusapi.APIError):
+            api.threads.details(thread=1)
+        self.assertEqual(api.retry.stats()['exhausted'], 1)
+
+    def test_does_not_retry_post(self):
+        FakeConnection.responses = [socket.timeout('timed out')]
+        api = self.get_api(disqusapi.Retry(backoff=0))
+        with self.assertRaises(socket.timeout):
+            api.posts.create(message='hi')
+
+    def test_does_not_retry_client_errors(self):
+        FakeConnection.responses = [FakeHTTPResponse(b'{"code": 2, "response": "bad"}', status=400)]
+        api = self.get_api(disqusapi.Retry(backoff=0))
+        with self.assertRaises(disqusapi.APIError):
+            api.threads.details(thread=1)
+        self.assertEqual(api.retry.stats()['retries'], 0)
+
+    def test_budget(self):
+        FakeConnection.responses = [socket.timeout('timed out')] * 2
+        retry = disqusapi.Retry(backoff=0, budget=disqusapi.RetryBudget(min_tokens=1))
+        api = self.get_api(retry)
+        with self.assertRaises(socket.timeout):
+            api.threads.details(thread=1)
+        self.assertEqual(retry.stats()['retries'], 1)
+        self.assertEqual(retry.stats()['budget_exhausted'], 1)
+
+    def test_backoff(self):
+        retry = disqusapi.Retry(backoff=1, max_backoff=5)
+        for attempt in range(10):
+            self.assertTrue(0 <= retry.get_backoff(attempt) <= min(5, 2 ** attempt))
+
+    def test_paginator_resume(self):
+        api = disqusapi.DisqusAPI('a', 'b')
+        pages = list(iter_results())
+        with mock.patch('disqusapi.Resource._request') as _request:
+            _request.side_effect = [pages[0], pages[1], socket.timeout('timed out')]
+            paginator = disqusapi.Paginator(api.posts.list, forum='disqus')
+            results = []
+            with self.assertRaises(socket.timeout):
+                for result in paginator:
+                    results.append(result)
+            self.assertEqual(paginator.cursor, 1)
+            _request.side_effect = pages[2:]
+            results.extend(paginator(resume=True))
+            self.assertEqual(_request.call_args_list[3][1]['cursor'], 1)
+        self.assertEqual(results, [n for n in range(11) for _ in range(10)])
+
+
+class SlowPool(object):
+    """
+    Answers ``urlopen`` calls in turn, each after the next of ``delays``.
+    """
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.calls = 0
+
+    def urlopen(self, host, method, path, body, headers, timeout=None):
+        self.calls += 1
+        delay = self.delays.pop(0)
+        time.sleep(delay)
+        body = json.dumps({'code': 0, 'response': {'delay': delay}}).encode('utf-8')
+        return FakeHTTPResponse(body), body
+
+
+class HedgingTest(TestCase):
+    def get_api(self, delays, **kwargs):
+        return disqusapi.DisqusAPI('a', 'b', pool=SlowPool(delays), **kwargs)
+
+    def test_deadline(self):
+        api = self.get_api([1])
+        start = time.time()
+        with self.assertRaises(disqusapi.DeadlineExceeded):
+            api.threads.details(thread=1, deadline=0.05)
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_endpoint_deadline(self):
+        api = self.get_api([1, 0], deadlines={'threads.details': 0.05})
+        with self.assertRaises(disqusapi.DeadlineExceeded):
+            api.threads.details(thread=1)
+        self.assertEqual(api.forums.details(forum='disqus'), {'delay': 0})
+
+    def test_deadline_covers_retries(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = [socket.timeout('timed out')] * 10
+        retry = disqusapi.Retry(total=10, backoff=1, max_backoff=1)
+        api = disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(), retry=retry)
+        with mock.patch('disqusapi.retry.random.uniform', return_value=1):
+            start = time.time()
+            with self.assertRaises(disqusapi.DeadlineExceeded):
+                api.threads.details(thread=1, deadline=0.1)
+        # Gave up instead of sleeping through a backoff past the deadline
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(retry.stats()['retries'], 1)
+
+    def test_hedge_wins(self):
+        hedging = disqusapi.Hedging(default_delay=0.02)
+        api = self.get_api([0.5, 0], hedging=hedging)
+        self.assertEqual(api.threads.details(thread=1), {'delay': 0})
+        stats = hedging.stats()
+        self.assertEqual((stats['hedged'], stats['wins'], stats['losses']), (1, 1, 0))
+
+    def test_hedge_loses(self):
+        hedging = disqusapi.Hedging(default_delay=0.02)
+        api = self.get_api([0.05, 0.5], hedging=hedging)
+        self.assertEqual(api.threads.details(thread=1), {'delay': 0.05})
+        stats = hedging.stats()
+        self.assertEqual((stats['hedged'], stats['wins'], stats['losses']), (1, 0, 1))
+
+    def test_fast_calls_are_not_hedged(self):
+        hedging = disqusapi.Hedging(default_delay=0.5)
+        api = self.get_api([0], hedging=hedging)
+        api.threads.details(thread=1)
+        self.assertEqual(api.pool.calls, 1)
+        self.assertEqual(hedging.stats()['hedged'], 0)
+
+    def test_post_is_not_hedged(self):
+        hedging = disqusapi.Hedging(default_delay=0)
+        api = self.get_api([0.05], hedging=hedging)
+        api.posts.create(message='hi')
+        self.assertEqual(api.pool.calls, 1)
+
+    def test_budget(self):
+        hedging = disqusapi.Hedging(
+            default_delay=0.01, budget=disqusapi.RetryBudget(ratio=0, min_tokens=1))
+        api = self.get_api([0.05] * 4, hedging=hedging)
+        api.threads.details(thread=1)
+        api.threads.details(thread=1)
+        stats = hedging.stats()
+        self.assertEqual((stats['hedged'], stats['denied']), (1, 1))
+
+    def test_delay_from_percentile(self):
+        hedging = disqusapi.Hedging(percentile=90, default_delay=1, min_samples=10)
+        for n in range(1, 101):
+            hedging.observe('threads.details', n / 1000.0)
+        self.assertEqual(hedging.get_delay('threads.details'), 0.091)
+        self.assertEqual(hedging.get_delay('forums.details'), 1)
+
+
+def fake_listing(pages):
+    """
+    A stand-in for ``Resource._request`` serving ``pages`` (lists of ids)
+    of each thread, by cursor; a page may be an exception to raise.
+    """
+    def _request(endpoint=None, **params):
+        cursor = params.get('cursor') or 0
+        page = pages[params['thread']][cursor]
+        if isinstance(page, Exception):
+            raise page
+        more = cursor + 1 < len(pages[params['thread']])
+        return disqusapi.Result([{'id': id} for id in page], {'id': cursor + 1, 'more': more})
+    return _request
+
+
+class CrawlerTest(TestCase):
+    def setUp(self):
+        import tempfile
+        self.path = tempfile.mkdtemp()
+        self.output = os.path.join(self.path, 'posts.ndjson')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def read_ids(self):
+        with open(self.output) as fp:
+            return sorted(json.loads(line)['id'] for line in fp)
+
+    def test_crawl(self):
+        from disqusapi.crawler import Crawler, Shard
+        api = disqusapi.DisqusAPI('a', 'b')
+        pages = {1: [[1, 2], [3]], 2: [[3, 4], [5, 6]], 3: [[]]}
+        shards = [Shard('threads.listPosts', {'thread': t}) for t in pages]
+        with mock.patch('disqusapi.Resource._request', side_effect=fake_listing(pages)):
+            stats = Crawler(api, self.output, workers=2).run(shards)
+        self.assertEqual(self.read_ids(), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(
+            (stats['done'], stats['pages'], stats['items'], stats['duplicates']), (3, 5, 6, 1))
+
+    def test_resume(self):
+        from disqusapi.crawler import Crawler, Shard
+        api = disqusapi.DisqusAPI('a', 'b')
+        pages = {1: [[1, 2], [3]], 2: [[4, 5], socket.timeout('timed out'), [7]]}
+        shards = [Shard('threads.listPosts', {'thread': t}) for t in pages]
+        with mock.patch('disqusapi.Resource._request', side_effect=fake_listing(pages)):
+            stats = Crawler(api, self.output).run(shards)
+        self.assertEqual(list(stats['failed']), [shards[1].key])
+        self.assertEqual(self.read_ids(), [1, 2, 3, 4, 5])
+
+        # A crash in the middle of writing a line
+        with open(self.output, 'a') as fp:
+            fp.write('{"id": 6, "mess')
+        pages[2][1] = [5, 6]
+        with mock.patch('disqusapi.Resource._request', side_effect=fake_listing(pages)) as _request:
+            stats = Crawler(api, self.output).run(shards)
+            # Only the rest of the unfinished shard was fetched
+            self.assertEqual([c[1]['cursor'] for c in _request.call_args_list], [1, 2])
+        self.assertEqual(stats['failed'], {})
+        self.assertEqual(self.read_ids(), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_time_shards(self):
+        from datetime import datetime, timedelta
+        from disqusapi.crawler import time_shards
+        shards = time_shards('disqus', datetime(2014, 1, 1), datetime(2014, 1, 10),
+                             timedelta(days=4))
+        self.assertEqual(
+            [(s.params['start'], s.params['end']) for s in shards],
+            [('2014-01-01T00:00:00', '2014-01-05T00:00:00'),
+             ('2014-01-05T00:00:00', '2014-01-09T00:00:00'),
+             ('2014-01-09T00:00:00', '2014-01-10T00:00:00')])
+        self.assertEqual(shards[0].endpoint, 'posts.list')
+        self.assertEqual(len(set(s.key for s in shards)), 3)
+
+
+class FakeTimeline(object):
+    """
+    A stand-in for ``Resource._request`` listing ``posts`` (sorted by
+    ``createdAt``) two by two, filtered by ``since``.
+    """
+    def __init__(self, posts):
+        self.posts = posts
+        self.calls = []
+
+    def __call__(self, endpoint=None, **params):
+        self.calls.append(params)
+        posts = [p for p in self.posts if p['createdAt'] >= params.get('since', '')]
+        offset = params.get('cursor') or 0
+        more = offset + 2 < len(posts)
+        return disqusapi.Result(posts[offset:offset + 2], {'id': offset + 2, 'more': more})
+
+
+class SyncTest(TestCase):
+    def setUp(self):
+        import tempfile
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def post(self, id, minute):
+        return {'id': id, 'createdAt': '2014-01-01T00:%02d:00' % minute}
+
+    def test_only_new_posts(self):
+        from disqusapi.sync import Sync
+        api = disqusapi.DisqusAPI('a', 'b')
+        timeline = FakeTimeline([self.post(1, 0), self.post(2, 1), self.post(3, 1)])
+        sync = Sync(api, self.path)
+        with mock.patch('disqusapi.Resource._request', side_effect=timeline):
+            self.assertEqual([p['id'] for p in sync('forums.listPosts', forum='disqus')], [1, 2, 3])
+            self.assertEqual([p['id'] for p in sync('forums.listPosts', forum='disqus')], [])
+            timeline.posts += [self.post(4, 1), self.post(5, 2)]
+            self.assertEqual([p['id'] for p in sync('forums.listPosts', forum='disqus')], [4, 5])
+        self.assertEqual(timeline.calls[-1]['since'], '2014-01-01T00:01:00')
+        self.assertEqual(timeline.calls[-1]['order'], 'asc')
+        mark = sync.get_mark('forums.listPosts', forum='disqus')
+        self.assertEqual((mark['mark'], mark['seen'], mark['cursor']),
+                         ('2014-01-01T00:02:00', [5], None))
+
+    def test_max_items_resumes_from_cursor(self):
+        from disqusapi.sync import Sync
+        api = disqusapi.DisqusAPI('a', 'b')
+        timeline = FakeTimeline([self.post(n, n) for n in range(1, 6)])
+        sync = Sync(api, self.path)
+        with mock.patch('disqusapi.Resource._request', side_effect=timeline):
+            posts = sync('forums.listPosts', max_items=3, forum='disqus', limit=2)
+            self.assertEqual([p['id'] for p in posts], [1, 2, 3])
+            self.assertEqual(timeline.calls[0]['limit'], 2)
+            # The page size isn't part of the mark's key
+            self.assertEqual(sync.get_mark('forums.listPosts', forum='disqus')['cursor'], 2)
+            self.assertEqual([p['id'] for p in sync('forums.listPosts', forum='disqus')], [4, 5])
+        self.assertEqual(timeline.calls[-2]['cursor'], 2)
+
+    def test_break_keeps_unconsumed(self):
+        from disqusapi.sync import Sync
+        api = disqusapi.DisqusAPI('a', 'b')
+        timeline = FakeTimeline([self.post(n, n) for n in range(1, 4)])
+        sync = Sync(api, self.path)
+        with mock.patch('disqusapi.Resource._request', side_effect=timeline):
+            for post in sync('forums.listPosts', forum='disqus'):
+                if post['id'] == 2:
+                    # Only 1 counts as consumed
+                    break
+            self.assertEqual([p['id'] for p in sync('forums.listPosts', forum='disqus')], [2, 3])
+            sync.reset('forums.listPosts', forum='disqus')
+            self.assertEqual(len(list(sync('forums.listPosts', forum='disqus'))), 3)
+
+
+class ExportTest(TestCase):
+    posts = [
+        {'id': '1', 'message': 'hi', 'author': {'id': '5', 'username': 'bob'}, 'thread': '9'},
+        {'id': '2', 'message': 'a, "b"', 'author': {'id': '6', 'username': 'ann'},
+         'thread': {'id': '9', 'title': 'T'}, 'media': [1, 2]},
+        {'id': '3', 'message': None, 'author': {'id': '5', 'username': 'bob'}, 'thread': '9'},
+    ]
+
+    def setUp(self):
+        import tempfile
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.path)
+
+    def test_ndjson(self):
+        from disqusapi.export import export
+        path = os.path.join(self.path, 'posts.ndjson')
+        self.assertEqual(export(iter(self.posts), path, batch_size=2), 3)
+        with open(path) as fp:
+            self.assertEqual([json.loads(line) for line in fp], self.posts)
+
+    def test_csv(self):
+        import csv
+        from disqusapi.export import export
+        path = os.path.join(self.path, 'posts.csv')
+        fields = ['id', 'message', 'author.username', 'thread.title']
+        export(self.posts, path, fields=fields, batch_size=1)
+        with open(path) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows, [
+            fields,
+            ['1', 'hi', 'bob', ''],
+            ['2', 'a, "b"', 'ann', 'T'],
+            ['3', '', 'bob', ''],
+        ])
+
+    def test_csv_flattens(self):
+        import csv
+        from disqusapi.export import export
+        path = os.path.join(self.path, 'posts.csv')
+        export(self.posts[1:2], path)
+        with open(path) as fp:
+            row, = csv.DictReader(fp)
+        self.assertEqual(row['author.username'], 'ann')
+        self.assertEqual(row['thread.title'], 'T')
+        self.assertEqual(row['media'], '[1, 2]')
+
+    def test_records(self):
+        from disqusapi.export import export
+        from disqusapi.records import Post
+        path = os.path.join(self.path, 'posts.jsonl')
+        export([Post(p) for p in self.posts], path, fields=['id', 'author.username'])
+        with open(path) as fp:
+            self.assertEqual(json.loads(fp.readline()), {'id': '1', 'author.username': 'bob'})
+
+    def test_unknown_format(self):
+        from disqusapi.export import export
+        with self.assertRaises(ValueError):
+            export(self.posts, os.path.join(self.path, 'posts.xls'))
+
+    def test_parquet(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise unittest.SkipTest('pyarrow is not installed')
+        from disqusapi.export import export
+        path = os.path.join(self.path, 'posts.parquet')
+        export(self.posts, path, fields=['id', 'message', 'author.username'], batch_size=1)
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column('message').to_pylist(), ['hi', 'a, "b"', None])
+
+    def test_parquet_column_null_in_first_batches(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise unittest.SkipTest('pyarrow is not installed')
+        from disqusapi.export import ParquetWriter, export
+        path = os.path.join(self.path, 'posts.parquet')
+        rows = [{'id': '1', 'parent': None}, {'id': '2', 'parent': None},
+                {'id': '3', 'parent': 1}]
+        export(rows, path, batch_size=2)
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column('parent').to_pylist(), [None, None, 1])
+        # Typed as strings once too many batches went by without a value
+        with mock.patch.object(ParquetWriter, 'max_pending', 1):
+            export(rows, path, batch_size=2)
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column('parent').to_pylist(), [None, None, '1'])
+
+
+class RateLimiterTest(TestCase):
+    def test_token_bucket(self):
+        limiter = disqusapi.RateLimiter(rate=10, burst=1)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertTrue(0.05 < limiter.reserve() <= 0.1)
+        self.assertTrue(0.15 < limiter.reserve() <= 0.2)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+    def test_unlimited_until_learned(self):
+        limiter = disqusapi.RateLimiter()
+        for _ in range(100):
+            self.assertEqual(limiter.reserve(), 0)
+
+    def test_learns_from_headers(self):
+        limiter = disqusapi.RateLimiter(burst=1)
+        limiter.update_from_response(FakeHTTPResponse(headers={
+            'X-Ratelimit-Limit': '1000',
+            'X-Ratelimit-Remaining': '100',
+            'X-Ratelimit-Reset': str(time.time() + 1000),
+        }))
+        stats = limiter.stats()
+        self.assertEqual(stats['limit'], 1000)
+        self.assertEqual(stats['remaining'], 100)
+        self.assertAlmostEqual(stats['rate'], 0.1, places=3)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertTrue(9 < limiter.reserve() <= 10)
+
+    def test_exhausted_window(self):
+        limiter = disqusapi.RateLimiter()
+        limiter.update(1000, 0, time.time() + 30)
+        self.assertTrue(29 < limiter.reserve() <= 30)
+
+    def test_spaced_after_reset(self):
+        limiter = disqusapi.RateLimiter(burst=1)
+        now = time.time()
+        with mock.patch('disqusapi.ratelimit.time.time', return_value=now):
+            # 3600 calls an hour: one a second once the window resets
+            limiter.update(3600, 0, now + 30)
+            waits = [limiter.reserve() for _ in range(3)]
+        self.assertEqual([round(w, 3) for w in waits], [30, 31, 32])
+        with mock.patch('disqusapi.ratelimit.time.time', return_value=now + 30.5):
+            self.assertAlmostEqual(limiter.reserve(), 2.5, places=3)
+            self.assertEqual(limiter.stats()['rate'], 1.0)
+
+    def test_ignores_missing_headers(self):
+        limiter = disqusapi.RateLimiter()
+        limiter.update_from_response(FakeHTTPResponse())
+        self.assertEqual(limiter.stats()['rate'], None)
+
+    @unittest.skipIf(sys.platform.startswith('win'), 'requires fcntl')
+    def test_file_limiter_is_shared(self):
+        import tempfile
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            first = disqusapi.FileRateLimiter(path, rate=10, burst=1)
+            second = disqusapi.FileRateLimiter(path, rate=10, burst=1)
+            self.assertEqual(first.reserve(), 0)
+            self.assertTrue(0.05 < second.reserve() <= 0.1)
+        finally:
+            os.remove(path)
+
+    def test_request_is_paced(self):
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {}}', headers={
+                'X-Ratelimit-Remaining': '0',
+                'X-Ratelimit-Reset': str(time.time() + 60),
+            }),
+            FakeHTTPResponse(b'{"code": 0, "response": {}}'),
+        ]
+        api = disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(),
+                                  rate_limiter=disqusapi.RateLimiter())
+        with mock.patch('disqusapi.ratelimit.time.sleep') as sleep:
+            api.threads.details(thread=1)
+            self.assertFalse(sleep.called)
+            api.threads.details(thread=1)
+        self.assertTrue(59 < sleep.call_args[0][0] <= 60)
+
+
+class LocalAPIHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Answers every request with its own path echoed back as JSON.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if 'sleep=' in self.path:
+            time.sleep(float(self.path.split('sleep=')[1].split('&')[0]))
+        etag = None
+        if 'etag=' in self.path:
+            etag = '"%s"' % self.path.split('etag=')[1].split('&')[0]
+            if self.headers.get('If-None-Match') == etag:
+                # No Content-Length, like most servers
+                self.send_response(304)
+                self.end_headers()
+                return
+        body = json.dumps({'code': 0, 'response': {'path': self.path}}).encode('utf-8')
+        self.send_response(200)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class IdleClosingHandler(LocalAPIHandler):
+    """
+    Closes connections left idle for 0.1s.
+    """
+    timeout = 0.1
+
+
+class LocalServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+    daemon_threads = True
+
+
+class LocalH2Handler(socketserver.BaseRequestHandler):
+    """
+    ``LocalAPIHandler`` over cleartext HTTP/2, counting connections.
+    """
+    def handle(self):
+        import h2.config
+        import h2.connection
+        import h2.events
+        self.server.connections += 1
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        conn.initiate_connection()
+        self.request.sendall(conn.data_to_send())
+        while True:
+            data = self.request.recv(65535)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    path = dict(event.headers)[':path']
+                    body = json.dumps({'code': 0, 'response': {'path': path}}).encode('utf-8')
+                    conn.send_headers(event.stream_id, [
+                        (':status', '200'),
+                        ('content-type', 'application/json'),
+                        ('content-length', str(len(body))),
+                    ])
+                    conn.send_data(event.stream_id, body, end_stream=True)
+            self.request.sendall(conn.data_to_send())
+
+
+class LocalH2Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    connections = 0
+
+
+def start_local_server(handler=LocalAPIHandler):
+    server = LocalServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run(coro_or_factory):
+    """
+    Runs a coroutine to completion on a fresh loop; pass a factory for
+    awaitables (like ``asyncio.gather``) that must be built on that loop.
+    """
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        if callable(coro_or_factory):
+            coro_or_factory = coro_or_factory()
+        return loop.run_until_complete(coro_or_factory)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def drain(async_iterable):
+    """
+    Collects everything an async iterator yields into a list.
+    """
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    iterator = async_iterable.__aiter__()
+    items = []
+    try:
+        while True:
+            try:
+                items.append(loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:  # NOQA
+                return items
+    finally:
+        loop.run_until_complete(iterator.aclose())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def async_pages(calls):
+    """
+    An async endpoint returning the pages of ``iter_results`` by cursor.
+    """
+    import asyncio
+    pages = list(iter_results())
+
+    def endpoint(**params):
+        calls.append(params.get('cursor'))
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(pages[params.get('cursor', -1) + 1])
+        return future
+    return endpoint
+
+
+def completed(result=None, error=None):
+    """
+    An awaitable done with ``result``, or raising ``error``.
+    """
+    import asyncio
+    future = asyncio.get_event_loop().create_future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def sized_pages(total, limits, slow_above=None):
+    """
+    An endpoint listing ``range(total)``, ``limit`` at a time, recording
+    the limits asked for. Pages larger than ``slow_above`` time out.
+    """
+    def endpoint(**params):
+        limit = int(params.get('limit', 25))
+        limits.append(limit)
+        if slow_above is not None and limit > slow_above:
+            raise socket.timeout('timed out')
+        start = int(params.get('cursor', 0))
+        end = min(total, start + limit)
+        return disqusapi.Result(list(range(start, end)), {'id': end, 'more': end < total})
+    return endpoint
+
+
+class PageSizeTest(TestCase):
+    def test_last_page_sized_to_limit(self):
+        limits = []
+        paginator = disqusapi.Paginator(sized_pages(1000, limits), forum='disqus')
+        self.assertEqual(list(paginator(limit=60)), list(range(60)))
+        self.assertEqual(limits, [25, 25, 10])
+        limits[:] = []
+        list(disqusapi.Paginator(sized_pages(1000, limits), limit=100)(limit=30))
+        self.assertEqual(limits, [30])
+
+    def test_prefetch_stops_at_limit(self):
+        limits = []
+        paginator = disqusapi.Paginator(sized_pages(1000, limits), limit=10)
+        self.assertEqual(list(paginator(limit=10, prefetch=True)), list(range(10)))
+        self.assertEqual(limits, [10])
+        limits[:] = []
+        self.assertEqual(len(list(paginator(limit=60, prefetch=True))), 60)
+        self.assertEqual(limits, [10] * 6)
+
+    def test_prefetch_keeps_one_page_ahead(self):
+        limits = []
+        paginator = disqusapi.Paginator(sized_pages(1000, limits), limit=10)
+        results = paginator(prefetch=True)
+        next(results)
+        time.sleep(0.3)
+        self.assertEqual(limits, [10, 10])
+        results.close()
+
+    def test_sizer(self):
+        from disqusapi.paginator import PageSizer
+        sizer = PageSizer()
+        # Consumed faster than fetched
+        sizer.observe(0.2, 0.01)
+        self.assertEqual(sizer.limit, 50)
+        sizer.observe(0.2, 0.01)
+        sizer.observe(0.2, 0.01)
+        self.assertEqual(sizer.limit, 100)
+        # Too slow
+        sizer.observe(2.0, 0.01)
+        self.assertEqual(sizer.limit, 50)
+        # Slow consumer
+        sizer.observe(0.2, 1.0)
+        self.assertEqual(sizer.limit, 50)
+        self.assertTrue(sizer.shrink())
+        self.assertTrue(sizer.shrink())
+        self.assertEqual(sizer.limit, 12)
+        self.assertTrue(sizer.shrink())
+        self.assertFalse(sizer.shrink())
+        self.assertEqual(sizer.limit, 10)
+
+    def test_grows_for_fast_consumers(self):
+        limits = []
+        pages = sized_pages(1000, limits)
+
+        def endpoint(**params):
+            time.sleep(0.01)
+            return pages(**params)
+
+        paginator = disqusapi.Paginator(endpoint, forum='disqus')
+        self.assertEqual(list(paginator(adaptive=True)), list(range(1000)))
+        self.assertEqual(limits[:4], [25, 50, 100, 100])
+        self.assertEqual(len(limits), 12)
+
+    def test_shrinks_on_timeouts(self):
+        from disqusapi.paginator import PageSizer
+        limits = []
+        paginator = disqusapi.Paginator(sized_pages(100, limits, slow_above=20))
+        results = list(paginator(adaptive=PageSizer(limit=100, min_limit=10)))
+        self.assertEqual(results, list(range(100)))
+        self.assertEqual(limits[:4], [100, 50, 25, 12])
+        # Down to ``min_limit``, timeouts are raised
+        with self.assertRaises(socket.timeout):
+            list(disqusapi.Paginator(sized_pages(100, [], slow_above=5))(adaptive=True))
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+    def test_async(self):
+        import asyncio
+        from disqusapi.aio import AsyncPaginator
+        from disqusapi.paginator import PageSizer
+        limits = []
+        pages = sized_pages(100, limits, slow_above=20)
+
+        def endpoint(**params):
+            future = asyncio.get_event_loop().create_future()
+            try:
+                future.set_result(pages(**params))
+            except socket.timeout as e:
+                future.set_exception(e)
+            return future
+
+        paginator = AsyncPaginator(endpoint)
+        results = drain(paginator(limit=70, adaptive=PageSizer(limit=40)))
+        self.assertEqual(results, list(range(70)))
+        self.assertEqual(limits[:2], [40, 20])
+        self.assertTrue(paginator.sizer.limit <= 40)
+
+
+@unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+class AsyncPaginatorTest(TestCase):
+    def test_paginates(self):
+        from disqusapi.aio import AsyncPaginator
+        calls = []
+        results = drain(AsyncPaginator(async_pages(calls), forum='disqus'))
+        self.assertEqual(len(results), 110)
+        self.assertEqual(calls, [None] + list(range(10)))
+
+    def test_limit_with_prefetch(self):
+        from disqusapi.aio import AsyncPaginator
+        calls = []
+        paginator = AsyncPaginator(async_pages(calls), forum='disqus')
+        results = drain(paginator(limit=25, prefetch=True))
+        self.assertEqual(results, [0] * 10 + [1] * 10 + [2] * 5)
+        # Nothing is fetched past the limit
+        self.assertEqual(calls, [None, 0, 1])
+
+
+@unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+class AsyncDisqusAPITest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_local_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get_api(self, **kwargs):
+        from disqusapi import aio
+        port = self.server.server_address[1]
+
+        class LocalConnection(aio.AsyncConnection):
+            def __init__(self, host):
+                super(LocalConnection, self).__init__('127.0.0.1', port, ssl=False)
+
+        class LocalPool(aio.AsyncConnectionPool):
+            connection_class = LocalConnection
+
+        return aio.AsyncDisqusAPI('a', 'b', pool=LocalPool(maxsize=4), **kwargs)
+
+    def test_details(self):
+        api = self.get_api()
+        response = run(api.threads.details(thread=1))
+        self.assertTrue(response['path'].startswith('/api/3.0/threads/details.json?'))
+        self.assertIn('thread=1', response['path'])
+
+    def test_revalidate(self):
+        revalidate = disqusapi.RevalidationCache()
+        # One client per loop, sharing the stored copies. The 304 has no
+        # Content-Length, so reading its body would hang until the deadline.
+        first, second = [
+            run(self.get_api(revalidate=revalidate).threads.details(
+                thread=1, etag='v1', deadline=5))
+            for _ in range(2)]
+        self.assertEqual(first, second)
+        self.assertEqual(revalidate.stats()['not_modified'], 1)
+
+    def test_fan_out_reuses_connections(self):
+        import asyncio
+        api = self.get_api(concurrency=4)
+
+        def fan_out():
+            return asyncio.gather(*[api.threads.details(thread=n) for n in range(20)])
+
+        responses = run(fan_out)
+        self.assertEqual(len(responses), 20)
+        for n, response in enumerate(responses):
+            self.assertIn('thread=%d' % n, response['path'])
+        stats = api.pool.stats()
+        self.assertTrue(stats['created'] <= 4)
+        self.assertEqual(stats['created'] + stats['reused'], 20)
+
+    def test_map(self):
+        api = self.get_api(concurrency=2)
+        responses = run(api.map('threads.details', [{'thread': n} for n in range(5)] + [{}]))
+        for n, response in enumerate(responses[:5]):
+            self.assertIn('thread=%d' % n, response['path'])
+        self.assertTrue(isinstance(responses[5], ValueError))
+
+    def test_http2_timeout(self):
+        try:
+            import httpx  # NOQA
+        except ImportError:
+            raise unittest.SkipTest('httpx is not installed')
+        from disqusapi.aio import AsyncHTTP2Transport
+
+        class LocalTransport(AsyncHTTP2Transport):
+            scheme = 'http'
+
+        host = '%s:%d' % self.server.server_address
+        with self.assertRaises(socket.timeout):
+            run(LocalTransport().urlopen(host, 'GET', '/?sleep=1', '', {}, timeout=0.05))
+
+    def test_dropped_connection_is_replaced(self):
+        import asyncio
+        api = self.get_api()
+        # One loop for both calls, which share a connection
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(api.threads.details(thread=1))
+            for idle in api.pool.idle.values():
+                for conn, _ in idle:
+                    # As if the server closed it
+                    conn.reader.feed_eof()
+            response = loop.run_until_complete(api.posts.create(message='hi'))
+        finally:
+            api.pool.clear()
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertIn('posts/create', response['path'])
+        self.assertEqual(api.pool.stats()['dropped'], 1)
+        self.assertEqual(api.pool.stats()['reconnects'], 0)
+
+    def test_partial_body_is_not_retried(self):
+        import asyncio
+        from disqusapi import aio
+
+        class FlakyConnection(aio.AsyncConnection):
+            responses = [
+                aio.AsyncResponse(200, 'OK', {}, False),
+                asyncio.IncompleteReadError(b'{"co', 100),
+            ]
+
+            def send(self, method, path, body, headers, trace=None):
+                self.writer = mock.Mock()
+                return completed(None)
+
+            def is_dropped(self):
+                return False
+
+            def _read_response(self, trace=None):
+                response = self.responses.pop(0)
+                if isinstance(response, Exception):
+                    return completed(error=response)
+                return completed((response, b'{}'))
+
+        class FlakyPool(aio.AsyncConnectionPool):
+            connection_class = FlakyConnection
+
+        pool = FlakyPool()
+        run(pool.urlopen('example.com', 'GET', '/a', '', {}))
+        with self.assertRaises(asyncio.IncompleteReadError):
+            run(pool.urlopen('example.com', 'GET', '/b', '', {}))
+        self.assertEqual(pool.stats()['reconnects'], 0)
+
+    def test_missing_required_argument(self):
+        api = self.get_api()
+        with self.assertRaises(ValueError):
+            run(api.threads.details())
+
+    def test_deadline(self):
+        api = self.get_api(hedging=disqusapi.Hedging(default_delay=0.02))
+        with self.assertRaises(disqusapi.DeadlineExceeded):
+            run(api.threads.details(thread=1, sleep=1, deadline=0.1))
+        self.assertEqual(api.hedging.stats()['hedged'], 1)
+        response = run(api.threads.details(thread=1, deadline=1))
+        self.assertIn('thread=1', response['path'])
+
+
+class TracingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_local_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get_api(self, **kwargs):
+        from disqusapi.compat import http_client
+        port = self.server.server_address[1]
+
+        class LocalConnection(http_client.HTTPConnection):
+            def __init__(self, host, timeout=None):
+                http_client.HTTPConnection.__init__(self, '127.0.0.1', port, timeout=timeout)
+
+        class LocalPool(disqusapi.ConnectionPool):
+            connection_class = LocalConnection
+
+        return disqusapi.DisqusAPI('a', 'b', pool=LocalPool(), tracer=disqusapi.Aggregator(),
+                                   **kwargs)
+
+    def test_phases(self):
+        # A decoder taking bytes would skip the decode phase
+        api = self.get_api(json_decoder='json')
+        api.threads.details(thread=1)
+        api.threads.details(thread=2)
+        stats = api.tracer.stats()['threads.details']
+        self.assertEqual((stats['count'], stats['errors']), (2, 0))
+        self.assertEqual(stats['total']['count'], 2)
+        self.assertEqual(
+            sorted(stats['phases']),
+            ['connect', 'decode', 'parse', 'read', 'send', 'wait'])
+        # The second call reused the connection
+        self.assertEqual(stats['phases']['connect']['count'], 1)
+        self.assertEqual(stats['phases']['wait']['count'], 2)
+        self.assertTrue(stats['sizes']['response']['max'] > 0)
+
+    def test_errors(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = [FakeHTTPResponse(b'{"code": 2, "response": "bad"}', status=400)]
+        traces = []
+
+        class Recorder(disqusapi.Tracer):
+            def finish(self, trace):
+                traces.append(trace)
+
+        api = disqusapi.DisqusAPI('a', 'b', pool=FakeConnectionPool(), tracer=Recorder())
+        with self.assertRaises(disqusapi.APIError):
+            api.threads.details(thread=1)
+        trace, = traces
+        self.assertEqual((trace.endpoint, trace.status, trace.attempts),
+                         ('threads.details', 400, 1))
+        self.assertTrue(isinstance(trace.error, disqusapi.APIError))
+
+    def test_cached(self):
+        api = self.get_api(cache=disqusapi.MemoryCache())
+        api.threads.details(thread=1)
+        api.threads.details(thread=1)
+        stats = api.tracer.stats()['threads.details']
+        self.assertEqual((stats['count'], stats['cached']), (2, 1))
+
+    def test_disabled(self):
+        api = disqusapi.DisqusAPI('a', 'b')
+        self.assertEqual(api.threads.details._build_request(None, {'thread': 1}).trace, None)
+
+    def test_histogram(self):
+        from disqusapi.tracing import Histogram
+        histogram = Histogram()
+        for value in [0.3] * 90 + [30] * 9 + [20000]:
+            histogram.add(value)
+        self.assertEqual(histogram.percentile(50), 0.5)
+        self.assertEqual(histogram.percentile(95), 50)
+        self.assertEqual(histogram.percentile(100), float('inf'))
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+    def test_async(self):
+        from disqusapi import aio
+        port = self.server.server_address[1]
+
+        class LocalConnection(aio.AsyncConnection):
+            def __init__(self, host):
+                super(LocalConnection, self).__init__('127.0.0.1', port, ssl=False)
+
+        class LocalPool(aio.AsyncConnectionPool):
+            connection_class = LocalConnection
+
+        api = aio.AsyncDisqusAPI('a', 'b', pool=LocalPool(), tracer=disqusapi.Aggregator(),
+                                 json_decoder='json')
+        run(api.threads.details(thread=1))
+        stats = api.tracer.stats()['threads.details']
+        self.assertEqual(
+            sorted(stats['phases']),
+            ['connect', 'decode', 'parse', 'read', 'send', 'wait'])
+
+
+class FakeTransport(disqusapi.Transport):
+    def __init__(self, body):
+        self.body = body
+        self.requests = []
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        self.requests.append((host, method, path))
+        return FakeHTTPResponse(self.body), self.body
+
+
+class BlockingTransport(FakeTransport):
+    """
+    Answers once ``release`` is set.
+    """
+    def __init__(self, body, error=None):
+        super(BlockingTransport, self).__init__(body)
+        self.error = error
+        self.release = threading.Event()
+
+    def urlopen(self, *args, **kwargs):
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return super(BlockingTransport, self).urlopen(*args, **kwargs)
+
+
+class CoalesceTest(TestCase):
+    def call_concurrently(self, api, calls, **params):
+        results = [None] * calls
+
+        def call(n):
+            try:
+                results[n] = api.threads.details(**params)
+            except Exception as e:
+                results[n] = e
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(calls)]
+        for thread in threads:
+            thread.start()
+        for _ in range(500):
+            if api.coalesce.stats()['coalesced'] == calls - 1:
+                break
+            time.sleep(0.01)
+        api.transport.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        transport = BlockingTransport(b'{"code": 0, "response": {"id": "1"}}')
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport, coalesce=True)
+        results = self.call_concurrently(api, 5, thread=1, related='forum')
+        self.assertEqual(results, [{'id': '1'}] * 5)
+        # Parsed separately
+        self.assertEqual(len(set(id(r) for r in results)), 5)
+        self.assertEqual(len(transport.requests), 1)
+        self.assertEqual(api.coalesce.stats(), {'calls': 1, 'coalesced': 4, 'in_flight': 0})
+
+    def test_errors(self):
+        transport = BlockingTransport(b'{"code": 0, "response": {}}', error=socket.error('down'))
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport, coalesce=True)
+        results = self.call_concurrently(api, 3, thread=1)
+        self.assertTrue(all(isinstance(r, socket.error) for r in results))
+        # Nothing is kept once a call is over
+        transport.error = None
+        self.assertEqual(api.threads.details(thread=1), {})
+        self.assertEqual(api.coalesce.stats()['calls'], 2)
+
+    def test_waiter_deadline(self):
+        transport = BlockingTransport(b'{"code": 0, "response": {}}')
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport, coalesce=True)
+        leader = threading.Thread(target=api.threads.details, kwargs={'thread': 1})
+        leader.start()
+        while not api.coalesce.stats()['in_flight']:
+            time.sleep(0.001)
+        with self.assertRaises(disqusapi.DeadlineExceeded):
+            api.threads.details(thread=1, deadline=0.05)
+        transport.release.set()
+        leader.join()
+
+    def test_leader_deadline_is_not_shared(self):
+        from disqusapi.compat import http_client
+        server = start_local_server()
+        port = server.server_address[1]
+
+        class LocalConnection(http_client.HTTPConnection):
+            def __init__(self, host, timeout=None):
+                http_client.HTTPConnection.__init__(self, '127.0.0.1', port, timeout=timeout)
+
+        class LocalPool(disqusapi.ConnectionPool):
+            connection_class = LocalConnection
+
+        api = disqusapi.DisqusAPI('a', 'b', pool=LocalPool(), coalesce=True)
+        results = {}
+
+        def call(name, **kwargs):
+            try:
+                results[name] = api.threads.details(thread=1, sleep=0.5, **kwargs)
+            except Exception as e:
+                results[name] = e
+
+        leader = threading.Thread(target=call, args=('leader',), kwargs={'deadline': 0.2})
+        leader.start()
+        try:
+            while not api.coalesce.stats()['in_flight']:
+                time.sleep(0.001)
+            call('waiter')
+            leader.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(isinstance(results['leader'], disqusapi.DeadlineExceeded))
+        # Sent again for the waiter, which has no deadline
+        self.assertIn('thread=1', results['waiter']['path'])
+        self.assertEqual(api.coalesce.stats()['calls'], 2)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs os.register_at_fork')
+    def test_after_fork(self):
+        transport = BlockingTransport(b'{"code": 0, "response": {}}')
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport, coalesce=True)
+        leader = threading.Thread(target=api.threads.details, kwargs={'thread': 1})
+        leader.start()
+        while not api.coalesce.stats()['in_flight']:
+            time.sleep(0.001)
+        pid = os.fork()
+        if not pid:
+            # The parent's call is forgotten rather than waited for
+            code = 1
+            try:
+                transport.release.set()
+                if api.coalesce.stats()['in_flight'] == 0 and \
+                        api.threads.details(thread=1) == {}:
+                    code = 0
+            finally:
+                os._exit(code)
+        try:
+            for _ in range(500):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    break
+                time.sleep(0.01)
+            else:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                self.fail('The forked process hung')
+            self.assertEqual(status, 0)
+        finally:
+            transport.release.set()
+            leader.join()
+
+    def test_posts_are_not_coalesced(self):
+        transport = FakeTransport(b'{"code": 0, "response": {}}')
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport, coalesce=True)
+        api.posts.create(message='hi')
+        self.assertEqual(api.coalesce.stats()['calls'], 0)
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+    def test_async(self):
+        import asyncio
+        from disqusapi import aio
+        server = start_local_server()
+        port = server.server_address[1]
+
+        class LocalConnection(aio.AsyncConnection):
+            def __init__(self, host):
+                super(LocalConnection, self).__init__('127.0.0.1', port, ssl=False)
+
+        class LocalPool(aio.AsyncConnectionPool):
+            connection_class = LocalConnection
+
+        api = aio.AsyncDisqusAPI('a', 'b', pool=LocalPool(), coalesce=True)
+        try:
+            results = run(lambda: asyncio.gather(*[
+                api.threads.details(thread=1, sleep=0.05) for _ in range(5)]))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(set(r['path'] for r in results)), 1)
+        self.assertEqual(api.coalesce.stats(), {'calls': 1, 'coalesced': 4, 'in_flight': 0})
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+    def test_async_leader_deadline_is_not_shared(self):
+        import asyncio
+        from disqusapi import aio
+        server = start_local_server()
+        port = server.server_address[1]
+
+        class LocalConnection(aio.AsyncConnection):
+            def __init__(self, host):
+                super(LocalConnection, self).__init__('127.0.0.1', port, ssl=False)
+
+        class LocalPool(aio.AsyncConnectionPool):
+            connection_class = LocalConnection
+
+        api = aio.AsyncDisqusAPI('a', 'b', pool=LocalPool(), coalesce=True)
+        try:
+            leader, waiter = run(lambda: asyncio.gather(
+                api.threads.details(thread=1, sleep=0.5, deadline=0.2),
+                api.threads.details(thread=1, sleep=0.5),
+                return_exceptions=True))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(isinstance(leader, disqusapi.DeadlineExceeded))
+        self.assertIn('thread=1', waiter['path'])
+        self.assertEqual(api.coalesce.stats()['calls'], 2)
+
+
+class EchoTransport(disqusapi.Transport):
+    """
+    Answers with the path asked for, gzipped.
+    """
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        data = gzip_body({'code': 0, 'response': {'path': path, 'body': body}})
+        return FakeHTTPResponse(data, headers={
+            'Content-Encoding': 'gzip', 'X-Ratelimit-Remaining': '99'}), data
+
+
+class CassetteTest(TestCase):
+    def setUp(self):
+        import tempfile
+        fd, self.path = tempfile.mkstemp(suffix='.cassette')
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.idx'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record(self, calls=1):
+        from disqusapi.cassette import RecordingTransport
+        transport = RecordingTransport(self.path, EchoTransport())
+        api = disqusapi.DisqusAPI('secret', 'public', transport=transport)
+        results = [api.threads.details(thread=n, related=['forum', 'author']) for n in range(calls)]
+        results.append(api.posts.create(thread=1, message='hi'))
+        transport.close()
+        return results
+
+    def test_replay(self):
+        from disqusapi.cassette import CassetteMiss, ReplayTransport
+        recorded = self.record(calls=100)
+        with open(self.path, 'rb') as fp:
+            self.assertFalse(b'secret' in fp.read())
+        transport = ReplayTransport(self.path)
+        # Other keys, other parameter order
+        api = disqusapi.DisqusAPI('other', 'keys', transport=transport)
+        replayed = [api.threads.details(related=['forum', 'author'], thread=n) for n in range(100)]
+        replayed.append(api.posts.create(message='hi', thread=1))
+        self.assertEqual(replayed, recorded)
+        with self.assertRaises(CassetteMiss):
+            api.threads.details(thread=1000)
+        self.assertEqual(transport.stats(), {'hits': 101, 'misses': 1})
+        response, _ = transport.urlopen('disqus.com', 'POST', '/api/3.0/posts/create.json',
+                                        'thread=1&message=hi', {})
+        self.assertEqual((response.status, response.getheader('X-Ratelimit-Remaining')),
+                         (200, '99'))
+        transport.close()
+
+    def test_latency(self):
+        from disqusapi.cassette import ReplayTransport
+        self.record()
+        with open(self.path, 'r+b') as fp:
+            # Pretend the first call took 200ms
+            data = bytearray(fp.read())
+            data[10:18] = struct.pack('>d', 0.2)
+            fp.seek(0)
+            fp.write(data)
+        os.remove(self.path + '.idx')
+        api = disqusapi.DisqusAPI('a', 'b', transport=ReplayTransport(
+            self.path, latency='recorded', speed=4))
+        started = time.time()
+        api.threads.details(thread=0, related=['forum', 'author'])
+        self.assertTrue(0.04 <= time.time() - started < 0.5)
+        transport = ReplayTransport(self.path, latency='sampled', seed=1)
+        self.assertTrue(set(transport.latencies) >= set([0.2]))
+        with self.assertRaises(ValueError):
+            ReplayTransport(self.path, latency='fast')
+
+    def test_truncated(self):
+        from disqusapi.cassette import ReplayTransport
+        self.record(calls=2)
+        with open(self.path, 'ab') as fp:
+            fp.write(b'\x00\x00\x01')
+        os.remove(self.path + '.idx')
+        transport = ReplayTransport(self.path, latency='sampled')
+        # The partly written record is left out
+        self.assertEqual(len(transport.latencies), 3)
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport)
+        response = api.threads.details(thread=1, related=['forum', 'author'])
+        self.assertIn('thread=1', response['path'])
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio client requires Python 3.6+')
+    def test_async(self):
+        from disqusapi import aio
+        recorded = self.record()
+        api = aio.AsyncDisqusAPI('a', 'b', transport=aio.AsyncReplayTransport(self.path))
+        self.assertEqual(run(api.threads.details(thread=0, related=['forum', 'author'])),
+                         recorded[0])
+
+
+class TransportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_local_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.host = disqusapi.HOST
+
+    def tearDown(self):
+        disqusapi.HOST = self.host
+
+    def test_custom_transport(self):
+        transport = FakeTransport(b'{"code": 0, "response": {"id": "1"}}')
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport)
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(transport.requests[0][:2], ('disqus.com', 'GET'))
+        # ``pool`` is the older name
+        self.assertTrue(api.pool is transport)
+
+    def test_names(self):
+        from disqusapi.transport import HTTPLibTransport
+        self.assertTrue(isinstance(disqusapi.DisqusAPI('a', 'b').transport,
+                                   disqusapi.ConnectionPool))
+        self.assertTrue(isinstance(disqusapi.DisqusAPI('a', 'b', transport='httplib').transport,
+                                   HTTPLibTransport))
+        with self.assertRaises(ValueError):
+            disqusapi.DisqusAPI('a', 'b', transport='carrier-pigeon')
+
+    def test_httplib(self):
+        from disqusapi.compat import http_client
+        from disqusapi.transport import HTTPLibTransport
+
+        class LocalTransport(HTTPLibTransport):
+            connection_class = http_client.HTTPConnection
+
+        disqusapi.HOST = '%s:%d' % self.server.server_address
+        api = disqusapi.DisqusAPI('a', 'b', transport=LocalTransport())
+        self.assertIn('thread=1', api.threads.details(thread=1)['path'])
+
+    def test_httpx(self):
+        try:
+            import httpx  # NOQA
+        except ImportError:
+            raise unittest.SkipTest('httpx is not installed')
+        from disqusapi.transport import HTTP2Transport
+
+        class LocalTransport(HTTP2Transport):
+            # Without TLS this falls back to HTTP/1.1
+            scheme = 'http'
+
+        disqusapi.HOST = '%s:%d' % self.server.server_address
+        api = disqusapi.DisqusAPI('a', 'b', transport=LocalTransport(),
+                                  tracer=disqusapi.Aggregator(), json_decoder='json')
+        self.assertIn('thread=1', api.threads.details(thread=1)['path'])
+        self.assertEqual(api.transport.stats(), {'HTTP/1.1': 1})
+        self.assertEqual(
+            sorted(api.tracer.stats()['threads.details']['phases']),
+            ['decode', 'parse', 'read', 'wait'])
+
+    def test_httpx_errors(self):
+        try:
+            import httpx  # NOQA
+        except ImportError:
+            raise unittest.SkipTest('httpx is not installed')
+        from disqusapi.transport import HTTP2Transport
+
+        class LocalTransport(HTTP2Transport):
+            scheme = 'http'
+
+        transport = LocalTransport()
+        host = '%s:%d' % self.server.server_address
+        with self.assertRaises(socket.timeout):
+            transport.urlopen(host, 'GET', '/?sleep=1', '', {}, timeout=0.05)
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        host = '%s:%d' % closed.getsockname()
+        closed.close()
+        with self.assertRaises(socket.error):
+            transport.urlopen(host, 'GET', '/', '', {})
+
+    def test_http2_multiplexes(self):
+        try:
+            import h2  # NOQA
+            import httpx
+        except ImportError:
+            raise unittest.SkipTest('httpx[http2] is not installed')
+        from disqusapi.transport import HTTP2Transport
+
+        class LocalTransport(HTTP2Transport):
+            scheme = 'http'
+
+        server = LocalH2Server(('127.0.0.1', 0), LocalH2Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            disqusapi.HOST = '%s:%d' % server.server_address
+            # HTTP/2 without TLS needs prior knowledge
+            transport = LocalTransport(httpx.Client(http1=False, http2=True))
+            api = disqusapi.DisqusAPI('a', 'b', transport=transport)
+            results = api.map('threads.details', [{'thread': n} for n in range(8)],
+                              concurrency=8)
+            for n, result in enumerate(results):
+                self.assertIn('thread=%d' % n, result['path'])
+            self.assertEqual(transport.stats(), {'HTTP/2': 8})
+            self.assertEqual(server.connections, 1)
+            transport.clear()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class JSONDecoderTest(TestCase):
+    body = u'{"code": 0, "response": {"message": "caf\xe9"}}'.encode('utf-8')
+
+    def test_default(self):
+        from disqusapi.jsonlib import DECODERS, get_decoder
+        loads = disqusapi.DisqusAPI.formats['json'][0]
+        for name in DECODERS:
+            try:
+                self.assertTrue(loads is get_decoder(name)[0])
+                break
+            except ImportError:
+                continue
+
+    def test_bytes(self):
+        bodies = []
+
+        def loads(body):
+            bodies.append(body)
+            return json.loads(body.decode('utf-8'))
+
+        api = disqusapi.DisqusAPI('a', 'b', transport=FakeTransport(self.body),
+                                  json_decoder=(loads, ValueError, True))
+        self.assertEqual(api.threads.details(thread=1), {'message': u'caf\xe9'})
+        self.assertEqual(bodies, [self.body])
+        # Other charsets are still decoded first
+        transport = FakeTransport(u'{"code": 0, "response": "caf\xe9"}'.encode('latin-1'))
+        transport.urlopen = lambda *args, **kwargs: (FakeHTTPResponse(
+            transport.body, headers={'Content-Type': 'application/json; charset=latin-1'}),
+            transport.body)
+        api = disqusapi.DisqusAPI('a', 'b', transport=transport,
+                                  json_decoder=(json.loads, ValueError, True))
+        self.assertEqual(api.threads.details(thread=1), u'caf\xe9')
+
+    def test_text(self):
+        api = disqusapi.DisqusAPI('a', 'b', transport=FakeTransport(self.body), json_decoder='json')
+        self.assertFalse('json' in api.bytes_formats)
+        self.assertEqual(api.threads.details(thread=1), {'message': u'caf\xe9'})
+        # Only that instance is affected
+        self.assertFalse(disqusapi.DisqusAPI.formats is api.formats)
+
+    def test_formatting_error(self):
+        for decoder in ('json', (json.loads, ValueError, True)):
+            api = disqusapi.DisqusAPI('a', 'b', transport=FakeTransport(b'<html>'),
+                                      json_decoder=decoder)
+            with self.assertRaises(disqusapi.FormattingError) as e:
+                api.threads.details(thread=1)
+            self.assertIn('<html>', str(e.exception))
+
+    def test_orjson(self):
+        try:
+            import orjson  # NOQA
+        except ImportError:
+            raise unittest.SkipTest('orjson is not installed')
+        api = disqusapi.DisqusAPI('a', 'b', transport=FakeTransport(self.body),
+                                  json_decoder='orjson')
+        self.assertTrue('json' in api.bytes_formats)
+        self.assertEqual(api.threads.details(thread=1), {'message': u'caf\xe9'})
+        with self.assertRaises(ValueError):
+            disqusapi.DisqusAPI('a', 'b', json_decoder='yaml')
+
+
+class SignerTest(TestCase):
+    url = 'https://disqus.com/api/3.0/threads/details.json'
+
+    def test_matches_functions(self):
+        from disqusapi import utils
+        signer = utils.Signer(u'caf\xe9', 'public')
+        for url, params in [(self.url + '?thread=1', [('thread', 1)]),
+                            (self.url, [('thread', 1), ('forum', 'disqus')]),
+                            (self.url, [])]:
+            norm = utils.get_normalized_request_string('GET', url, 'nonce', params)
+            self.assertEqual(
+                signer.get_normalized_request_string('GET', url, 'nonce', params), norm)
+            self.assertEqual(signer.sign('GET', url, params, nonce='nonce'),
+                             ('nonce', utils.get_body_hash(params),
+                              utils.get_mac_signature(u'caf\xe9', norm)))
+        # Parsed once per URL
+        self.assertEqual(list(signer.prefixes), [self.url])
+
+    def test_sign_many(self):
+        from disqusapi.utils import Signer
+        signer = Signer('secret')
+        signatures = signer.sign_many([('GET', self.url + '?thread=%d' % n, []) for n in range(3)])
+        self.assertEqual(len(set(mac for _, _, mac in signatures)), 3)
+        # Nonces differ between calls
+        self.assertEqual(len(set(nonce for nonce, _, _ in signatures)), 3)
+
+    def test_header(self):
+        transport = FakeTransport(b'{"code": 0, "response": {}}')
+        headers = []
+        urlopen = transport.urlopen
+
+        def record(host, method, path, body, headers_, **kwargs):
+            headers.append(headers_)
+            return urlopen(host, method, path, body, headers_, **kwargs)
+
+        transport.urlopen = record
+        api = disqusapi.DisqusAPI('secret', 'public', transport=transport, signer=True)
+        api.threads.details(thread=1)
+        api.posts.create(message='hi')
+        for header in headers:
+            self.assertTrue(header['Authorization'].startswith('MAC id="public", nonce="'))
+        self.assertFalse('Authorization' in api.headers['GET'])
+
+
 class DisqusAPITest(TestCase):
     API_SECRET = 'b' * 64
     API_PUBLIC = 'c' * 64
@@ -139,6 +2214,63 @@ class DisqusAPITest(TestCase):
                     next(iterator)
         self.assertEquals(n, 99)
 
+    def test_paginator_prefetch(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        with mock.patch('disqusapi.Resource._request') as _request:
+            _request.side_effect = list(iter_results())
+            paginator = disqusapi.Paginator(api.posts.list, forum='disqus')
+            results = list(paginator(prefetch=True))
+        self.assertEqual(len(results), 110)
+        self.assertEqual(results[-1], 10)
+        self.assertEqual(_request.call_count, 11)
+
+    def test_paginator_prefetch_error(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        with mock.patch('disqusapi.Resource._request') as _request:
+            _request.side_effect = [next(iter_results()), disqusapi.APIError(2, 'oops')]
+            paginator = disqusapi.Paginator(api.posts.list, forum='disqus')
+            results = []
+            with self.assertRaises(disqusapi.APIError):
+                for result in paginator(prefetch=True):
+                    results.append(result)
+        self.assertEqual(len(results), 10)
+
+    def test_map(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+
+        def _request(endpoint=None, **params):
+            if params['thread'] == 3:
+                raise disqusapi.APIError(2, 'Invalid argument')
+            return {'id': str(params['thread'])}
+
+        with mock.patch('disqusapi.Resource._request', side_effect=_request):
+            results = api.map('threads.details', [{'thread': n} for n in range(6)],
+                              concurrency=3)
+        self.assertEqual([r['id'] for r in results if isinstance(r, dict)],
+                         ['0', '1', '2', '4', '5'])
+        self.assertTrue(isinstance(results[3], disqusapi.APIError))
+
+    def test_map_merge(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+
+        def _request(endpoint=None, **params):
+            return disqusapi.Result([{'id': str(t)} for t in params['thread'] if t != 4])
+
+        with mock.patch('disqusapi.Resource._request', side_effect=_request) as request:
+            results = api.map('threads.list', [{'thread': n, 'forum': 'disqus'} for n in range(5)],
+                              merge='thread', merge_size=3)
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args_list[0][1],
+                         {'forum': 'disqus', 'thread': [0, 1, 2], 'limit': 3})
+        self.assertEqual(results, [{'id': '0'}, {'id': '1'}, {'id': '2'}, {'id': '3'}, None])
+
+    def test_map_merge_single_object(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        with mock.patch('disqusapi.Resource._request', return_value={'id': '1'}):
+            results = api.map('users.details', [{'user': n} for n in range(2)], merge='user')
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
     def test_endpoint(self):
         api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
         with mock.patch('disqusapi.Resource._request') as _request:
@@ -163,10 +2295,101 @@ class DisqusAPITest(TestCase):
         with self.assertRaises(disqusapi.InvalidHTTPMethod):
             api.get('posts.list', method='lol', forum='disqus')
 
+    def test_request_uses_pool(self):
+        FakeConnection.instances = []
+        FakeConnection.responses = [
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "1"}}'),
+            FakeHTTPResponse(b'{"code": 0, "response": {"id": "2"}}'),
+        ]
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC, pool=FakeConnectionPool())
+        self.assertEqual(api.threads.details(thread=1), {'id': '1'})
+        self.assertEqual(api.threads.details(thread=2), {'id': '2'})
+        self.assertEqual(len(FakeConnection.instances), 1)
+        self.assertEqual(api.pool.stats()['reused'], 1)
+
     def test_update_interface(self):
         api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
         api.update_interface(extra_interface)
 
+    def test_update_interface_is_not_shared(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        other = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        api.update_interface({'reserved': {'word': {'method': 'GET'}}})
+        self.assertTrue('reserved' in api.interfaces)
+        self.assertFalse('reserved' in other.interfaces)
+        self.assertFalse('reserved' in disqusapi.get_interfaces())
+
+    def test_with_options(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC, cache=disqusapi.MemoryCache())
+        threads = api.threads
+        derived = api.with_options(timeout=5, version='3.1', secret_key='x')
+        self.assertEqual((derived.timeout, derived.version, derived.secret_key), (5, '3.1', 'x'))
+        self.assertEqual((api.version, api.secret_key), ('3.0', self.API_SECRET))
+        self.assertTrue(derived.transport is api.transport)
+        self.assertTrue(derived.cache is api.cache)
+        self.assertTrue(derived.endpoints is api.endpoints)
+        self.assertTrue(derived.api is derived)
+        self.assertFalse(derived.threads is threads)
+        self.assertTrue(api.threads is threads)
+        request = derived.threads.details._build_request(None, {'thread': 1})
+        self.assertTrue(request.path.startswith('/api/3.1/'))
+        self.assertIn('api_secret=x', request.path)
+        with self.assertRaises(TypeError):
+            api.with_options(interfaces={})
+
+    def test_with_options_signer(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC, signer=True)
+        derived = api.with_options(public_key='other')
+        self.assertEqual(derived.signer.public_key, 'other')
+        self.assertEqual(api.signer.public_key, self.API_PUBLIC)
+        self.assertTrue(api.with_options(version='3.1').signer is api.signer)
+
+    def test_pool_after_fork(self):
+        pool = FakeConnectionPool()
+        FakeConnection.instances = []
+        FakeConnection.responses = [FakeHTTPResponse(), FakeHTTPResponse()]
+        pool.urlopen('disqus.com', 'GET', '/', '', {})
+        self.assertEqual(pool.stats()['idle'], 1)
+        with mock.patch('os.getpid', return_value=pool.pid + 1):
+            pool.urlopen('disqus.com', 'GET', '/', '', {})
+        # The inherited connection was left alone, not reused
+        self.assertEqual(len(FakeConnection.instances), 2)
+        self.assertFalse(FakeConnection.instances[0].closed)
+
+    def test_update_interface_drops_cached_resources(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC, interfaces={})
+        self.assertEqual(api.reserved.word.endpoint, None)
+        api.update_interface({'reserved': {'word': {'method': 'GET', 'required': ['text']}}})
+        self.assertEqual(api.reserved.word.endpoint.method, 'GET')
+        self.assertEqual(api.reserved.word.endpoint.required, ('text',))
+
+    def test_resources_are_cached(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        self.assertTrue(api.threads is api.threads)
+        self.assertTrue(api.threads.details is api.threads.details)
+        self.assertEqual(api.threads.details.endpoint.name, 'threads.details')
+
+    def test_required_arguments(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        with self.assertRaises(ValueError):
+            api.threads.details(forum='disqus')
+        with self.assertRaises(ValueError):
+            api.get('threads.details', forum='disqus')
+        request = api.threads.details._build_request(None, {'thread:ident': 'x'})
+        self.assertEqual(request.endpoint, 'threads.details')
+        self.assertEqual(request.method, 'GET')
+
+    def test_build_request(self):
+        api = disqusapi.DisqusAPI(self.API_SECRET, self.API_PUBLIC)
+        request = api.posts.create._build_request(None, {'message': 'hi'})
+        self.assertEqual(request.path, '/api/3.0/posts/create.json')
+        self.assertEqual(request.body, 'message=hi&api_secret=%s&api_key=%s' % (
+            self.API_SECRET, self.API_PUBLIC))
+        self.assertEqual(request.headers['Content-Type'], 'application/x-www-form-urlencoded')
+        request = api.threads.list._build_request(None, {'thread': [1, 2], 'api_secret': 'x'})
+        self.assertEqual(request.path, '/api/3.0/threads/list.json?thread=1&thread=2'
+                         '&api_secret=x&api_key=%s' % self.API_PUBLIC)
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
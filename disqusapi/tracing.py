@@ -0,0 +1,215 @@
+"""
+Timing what each call spends its time on.
+
+>>> api = DisqusAPI(secret_key, public_key, tracer=Aggregator())
+>>> api.threads.details(thread=1)
+>>> api.tracer.stats()['threads.details']['phases']['wait']
+{'count': 1, 'mean': 84.2, 'p50': 100.0, 'p95': 100.0, 'p99': 100.0}
+
+A tracer's ``start`` is handed every ``Request`` and returns a ``Trace``,
+which the client fills in as the call goes through these phases (in
+seconds, summed over attempts):
+
+* ``throttle``: waiting on the rate limiter
+* ``connect``: opening a connection, and ``tls`` its handshake (the
+  asyncio client counts both as ``connect``)
+* ``send``: writing the request
+* ``wait``: waiting for the response to start (time to first byte)
+* ``read``: reading the response body
+* ``backoff``: sleeping between retries
+* ``decompress``, ``decode`` and ``parse``: gunzipping, decoding and
+  parsing the body (not timed for streamed responses)
+
+and these sizes (in bytes): ``request``, ``response`` (as received) and
+``decoded``. Subclass ``Tracer`` and override ``finish`` to hook in;
+without a tracer the client does no timing at all.
+"""
+import threading
+import time
+
+from disqusapi.utils import reset_after_fork
+
+# The most precise clock available (``time.perf_counter`` is Python 3.3+)
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Trace(object):
+    __slots__ = ('tracer', 'endpoint', 'method', 'started', 'duration', 'phases', 'sizes',
+                 'attempts', 'cached', 'status', 'error')
+
+    def __init__(self, tracer, request):
+        self.tracer = tracer
+        self.endpoint = request.endpoint
+        self.method = request.method
+        self.started = time.time()
+        self.duration = None
+        self.phases = {}
+        self.sizes = {'request': len(request.path) + len(request.body)}
+        self.attempts = 0
+        self.cached = False
+        self.status = None
+        self.error = None
+
+    def __repr__(self):
+        return '<%s: %s %s>' % (self.__class__.__name__, self.method, self.endpoint)
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def __enter__(self):
+        self.duration = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = timer() - self.duration
+        self.error = exc_value
+        self.tracer.finish(self)
+
+
+class Tracer(object):
+    """
+    Does nothing with finished traces; subclasses override ``finish``.
+    """
+    trace_class = Trace
+
+    def start(self, request):
+        return self.trace_class(self, request)
+
+    def finish(self, trace):
+        pass
+
+
+class Histogram(object):
+    """
+    Counts values (in milliseconds) into fixed, roughly logarithmic
+    buckets; percentiles are reported as the upper bound of the bucket
+    they fall in.
+    """
+    bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+              float('inf'))
+
+    def __init__(self):
+        self.buckets = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        for n, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[n] += 1
+                break
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percentile):
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for n, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.bounds[n]
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class Aggregator(Tracer):
+    """
+    Keeps per-endpoint histograms of the total time, each phase (in
+    milliseconds) and the sizes seen.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        self.lock = threading.Lock()
+
+    def finish(self, trace):
+        with self.lock:
+            try:
+                endpoint = self.endpoints[trace.endpoint]
+            except KeyError:
+                endpoint = self.endpoints[trace.endpoint] = {
+                    'count': 0,
+                    'errors': 0,
+                    'cached': 0,
+                    'total': Histogram(),
+                    'phases': {},
+                    'sizes': {},
+                }
+            endpoint['count'] += 1
+            if trace.error is not None:
+                endpoint['errors'] += 1
+            if trace.cached:
+                endpoint['cached'] += 1
+            endpoint['total'].add(trace.duration * 1000)
+            for phase, seconds in trace.phases.items():
+                try:
+                    histogram = endpoint['phases'][phase]
+                except KeyError:
+                    histogram = endpoint['phases'][phase] = Histogram()
+                histogram.add(seconds * 1000)
+            for name, size in trace.sizes.items():
+                sizes = endpoint['sizes'].setdefault(name, {'count': 0, 'total': 0, 'max': 0})
+                sizes['count'] += 1
+                sizes['total'] += size
+                sizes['max'] = max(sizes['max'], size)
+
+    def stats(self):
+        with self.lock:
+            return dict((name, {
+                'count': endpoint['count'],
+                'errors': endpoint['errors'],
+                'cached': endpoint['cached'],
+                'total': endpoint['total'].stats(),
+                'phases': dict((k, v.stats()) for k, v in endpoint['phases'].items()),
+                'sizes': dict((k, dict(v)) for k, v in endpoint['sizes'].items()),
+            }) for name, endpoint in self.endpoints.items())
+
+    def clear(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Reports each call as an OpenTelemetry span named after its endpoint,
+    with phases (``disqus.phase.<name>``, in seconds) and sizes
+    (``disqus.size.<name>``) as attributes. Requires ``opentelemetry-api``.
+    """
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self.status_code = trace.StatusCode
+        self.status_class = trace.Status
+        self.tracer = tracer or trace.get_tracer('disqusapi')
+
+    def finish(self, trace):
+        attributes = {
+            'http.method': trace.method,
+            'disqus.endpoint': trace.endpoint,
+            'disqus.attempts': trace.attempts,
+            'disqus.cached': trace.cached,
+        }
+        if trace.status is not None:
+            attributes['http.status_code'] = trace.status
+        for phase, seconds in trace.phases.items():
+            attributes['disqus.phase.%s' % phase] = seconds
+        for name, size in trace.sizes.items():
+            attributes['disqus.size.%s' % name] = size
+        started = int(trace.started * 1e9)
+        span = self.tracer.start_span(
+            trace.endpoint, start_time=started, attributes=attributes)
+        if trace.error is not None:
+            span.record_exception(trace.error)
+            span.set_status(self.status_class(self.status_code.ERROR, str(trace.error)))
+        span.end(end_time=started + int(trace.duration * 1e9))
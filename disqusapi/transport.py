@@ -0,0 +1,210 @@
+"""
+How requests get to the API.
+
+>>> api = DisqusAPI(secret_key, public_key, transport='http2')
+
+A transport has a single method doing an exchange, which is all the
+client needs, so tests (or anything else) can provide their own:
+
+>>> class FakeTransport(Transport):
+...     def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+...         return FakeResponse(200, {'Content-Type': 'application/json'}), b'{...}'
+
+The response returned needs a ``status``, a ``getheader(name, default)``
+and a ``will_close``; the body is the raw bytes, still gzipped if the
+``Content-Encoding`` says so.
+
+Built in are ``'pool'`` (``disqusapi.pool.ConnectionPool``, HTTP/1.1
+keep-alive, the default), ``'httplib'`` (a new connection per call) and
+``'http2'`` (all calls multiplexed over one HTTP/2 connection, using
+``httpx`` with the ``h2`` extra).
+"""
+import contextlib
+import socket
+
+from disqusapi import compat
+from disqusapi.compat import http_client as httplib
+from disqusapi.tracing import timer
+
+
+class Transport(object):
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        """
+        Sends a request and returns ``(response, body)``; ``trace`` is a
+        ``disqusapi.tracing.Trace`` to fill in, if not None.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Closes idle connections.
+        """
+
+    def stats(self):
+        return {}
+
+
+def exchange(conn, method, path, body, headers, trace=None):
+    """
+    Sends a request over an ``httplib`` connection and reads the whole
+    response, timing each step into ``trace``.
+    """
+    send_request(conn, method, path, body, headers, trace)
+    return read_response(conn, trace)
+
+
+def send_request(conn, method, path, body, headers, trace=None):
+    """
+    The first half of ``exchange``: connects if needed and writes the
+    request.
+    """
+    if trace is None:
+        conn.request(method, path, body, headers)
+        return
+    if conn.sock is None:
+        started = timer()
+        context = getattr(conn, '_context', None)
+        if isinstance(conn, httplib.HTTPSConnection) and context is not None and \
+                not conn._tunnel_host:
+            # What ``HTTPSConnection.connect`` does, split in two
+            httplib.HTTPConnection.connect(conn)
+            trace.add('connect', timer() - started)
+            started = timer()
+            conn.sock = context.wrap_socket(conn.sock, server_hostname=conn.host)
+            trace.add('tls', timer() - started)
+        else:
+            conn.connect()
+            trace.add('connect', timer() - started)
+    started = timer()
+    conn.request(method, path, body, headers)
+    trace.add('send', timer() - started)
+
+
+def read_response(conn, trace=None):
+    """
+    The second half of ``exchange``: returns ``(response, body)``.
+    """
+    if trace is None:
+        response = conn.getresponse()
+        return response, response.read()
+    started = timer()
+    response = conn.getresponse()
+    trace.add('wait', timer() - started)
+    started = timer()
+    data = response.read()
+    trace.add('read', timer() - started)
+    return response, data
+
+
+class HTTPLibTransport(Transport):
+    """
+    Opens a new connection for every call, as the client used to.
+    """
+    connection_class = httplib.HTTPSConnection
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        conn = self.connection_class(host, timeout=timeout)
+        try:
+            return exchange(conn, method, path, body, headers, trace)
+        finally:
+            conn.close()
+
+
+class HTTPXResponse(object):
+    """
+    Gives an ``httpx`` response the interface of an ``httplib`` one.
+    """
+    will_close = False
+
+    def __init__(self, response):
+        self.response = response
+        self.status = response.status_code
+        self.reason = response.reason_phrase
+        self.version = response.http_version
+
+    def getheader(self, name, default=None):
+        return self.response.headers.get(name, default)
+
+
+class HTTP2Transport(Transport):
+    """
+    Sends every call over one HTTP/2 connection per host, however many
+    threads make them. Needs ``httpx`` and ``h2`` (``pip install
+    httpx[http2]``); pass ``client`` to configure the ``httpx.Client``.
+    """
+    scheme = 'https'
+
+    def __init__(self, client=None):
+        import httpx
+        if client is None:
+            client = httpx.Client(http2=True)
+        self.httpx = httpx
+        self.client = client
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def _errors(self):
+        """
+        Raises ``httpx`` errors as the ``socket`` ones the other
+        transports raise, which ``Retry`` and friends know about.
+        """
+        try:
+            yield
+        except self.httpx.TimeoutException as e:
+            raise socket.timeout(str(e))
+        except self.httpx.TransportError as e:
+            raise socket.error(str(e))
+
+    def _request(self, host, method, path, body, headers, timeout):
+        if isinstance(body, compat.text_type):
+            body = body.encode('utf-8')
+        return self.client.build_request(
+            method, '%s://%s%s' % (self.scheme, host, path), content=body or None,
+            headers=headers, timeout=timeout)
+
+    def _count(self, response):
+        version = response.http_version
+        self.counters[version] = self.counters.get(version, 0) + 1
+
+    def urlopen(self, host, method, path, body, headers, timeout=None, trace=None):
+        if trace is not None:
+            started = timer()
+        with self._errors():
+            # Streamed so the body isn't decompressed for us
+            response = self.client.send(
+                self._request(host, method, path, body, headers, timeout), stream=True)
+            try:
+                if trace is not None:
+                    trace.add('wait', timer() - started)
+                    started = timer()
+                data = b''.join(response.iter_raw())
+                if trace is not None:
+                    trace.add('read', timer() - started)
+            finally:
+                response.close()
+        self._count(response)
+        return HTTPXResponse(response), data
+
+    def clear(self):
+        self.client.close()
+
+    def stats(self):
+        # Calls by HTTP version, e.g. {'HTTP/2': 120}
+        return dict(self.counters)
+
+
+def get_transport(transport):
+    """
+    Returns the transport named by ``transport``, or ``transport`` itself
+    if it isn't a name.
+    """
+    if transport is None or transport == 'pool':
+        from disqusapi.pool import ConnectionPool
+        return ConnectionPool()
+    if transport == 'httplib':
+        return HTTPLibTransport()
+    if transport == 'http2':
+        return HTTP2Transport()
+    if isinstance(transport, compat.string_types):
+        raise ValueError('Unknown transport: %r' % transport)
+    return transport
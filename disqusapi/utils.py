@@ -1,8 +1,11 @@
 import binascii
 import hashlib
 import hmac
+import os
+import time
+import weakref
 from disqusapi import compat
-from disqusapi.compat import urllib_parse as urlparse
+from disqusapi.compat import urllib_parse, urlparse
 
 
 def build_interfaces_by_method(interfaces):
@@ -53,7 +56,7 @@ def get_normalized_params(params):
     Given a list of (k, v) parameters, returns
     a sorted, encoded normalized param
     """
-    return urlparse.urlencode(sorted(params))
+    return urllib_parse.urlencode(sorted(params))
 
 
 def get_normalized_request_string(method, url, nonce, params, ext='', body_hash=None):
@@ -62,7 +65,7 @@ def get_normalized_request_string(method, url, nonce, params, ext='', body_hash=
 
     http://tools.ietf.org/html/draft-ietf-oauth-v2-http-mac-00#section-3.3.1
     """
-    urlparts = urlparse.urlparse(url)
+    urlparts = urlparse(url)
     if urlparts.query:
         norm_url = '%s?%s' % (urlparts.path, urlparts.query)
     elif params:
@@ -87,6 +90,12 @@ def get_normalized_request_string(method, url, nonce, params, ext='', body_hash=
     return '\n'.join(map(str, output))
 
 
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return compat.text_type(value).encode('utf-8')
+
+
 def get_body_hash(params):
     """
     Returns BASE64 ( HASH (text) ) as described in OAuth2 MAC spec.
@@ -95,12 +104,218 @@ def get_body_hash(params):
     """
     norm_params = get_normalized_params(params)
 
-    return binascii.b2a_base64(hashlib.sha1(norm_params).digest())[:-1]
+    return binascii.b2a_base64(hashlib.sha1(to_bytes(norm_params)).digest())[:-1].decode('ascii')
 
 
 def get_mac_signature(api_secret, norm_request_string):
     """
     Returns HMAC-SHA1 (api secret, normalized request string)
     """
-    hashed = hmac.new(str(api_secret), norm_request_string, hashlib.sha1)
-    return binascii.b2a_base64(hashed.digest())[:-1]
+    hashed = hmac.new(to_bytes(api_secret), to_bytes(norm_request_string), hashlib.sha1)
+    return binascii.b2a_base64(hashed.digest())[:-1].decode('ascii')
+
+
+class Signer(object):
+    """
+    Signs requests like ``get_mac_signature(api_secret,
+    get_normalized_request_string(...))``, but keyed once: each signature
+    starts from a copy of the HMAC state, and the parsed prefix of every
+    URL (path, host and port) is kept.
+
+    >>> signer = Signer(secret_key, public_key)
+    >>> signer.get_header('GET', 'https://disqus.com/api/3.0/threads/details.json?thread=1', [])
+    'MAC id="...", nonce="1700000000:3f2a...", bodyhash="...", mac="..."'
+    """
+    def __init__(self, api_secret, public_key=None):
+        self.public_key = public_key
+        self.hmac = hmac.new(to_bytes(api_secret), digestmod=hashlib.sha1)
+        self.prefixes = {}
+
+    def get_prefix(self, url):
+        """
+        Returns ``(path, query, host, port)`` for ``url``.
+        """
+        base, sep, query = url.partition('?')
+        try:
+            path, host, port = self.prefixes[base]
+        except KeyError:
+            urlparts = urlparse(base)
+            port = urlparts.port
+            if not port:
+                assert urlparts.scheme in ('http', 'https')
+                port = 80 if urlparts.scheme == 'http' else 443
+            path, host = urlparts.path, urlparts.hostname
+            self.prefixes[base] = path, host, port
+        return path, query, host, port
+
+    def _normalize(self, method, url, nonce, params, ext='', body_hash=None):
+        path, query, host, port = self.get_prefix(url)
+        norm_params = None
+        if query:
+            norm_url = '%s?%s' % (path, query)
+        elif params:
+            norm_params = get_normalized_params(params)
+            norm_url = '%s?%s' % (path, norm_params)
+        else:
+            norm_url = path
+        if not body_hash:
+            if norm_params is None:
+                norm_params = get_normalized_params(params)
+            body_hash = binascii.b2a_base64(
+                hashlib.sha1(to_bytes(norm_params)).digest())[:-1].decode('ascii')
+        norm = '%s\n%s\n%s\n%s\n%s\n%s\n%s\n' % (
+            nonce, method.upper(), norm_url, host, port, body_hash, ext)
+        return norm, body_hash
+
+    def get_normalized_request_string(self, method, url, nonce, params, ext='', body_hash=None):
+        return self._normalize(method, url, nonce, params, ext, body_hash)[0]
+
+    def get_signature(self, norm_request_string):
+        hashed = self.hmac.copy()
+        hashed.update(to_bytes(norm_request_string))
+        return binascii.b2a_base64(hashed.digest())[:-1].decode('ascii')
+
+    def get_nonce(self):
+        return '%d:%s' % (time.time(), binascii.hexlify(os.urandom(8)).decode('ascii'))
+
+    def sign(self, method, url, params, nonce=None, ext=''):
+        """
+        Returns ``(nonce, body_hash, mac)`` for a request.
+        """
+        if nonce is None:
+            nonce = self.get_nonce()
+        norm, body_hash = self._normalize(method, url, nonce, params, ext)
+        return nonce, body_hash, self.get_signature(norm)
+
+    def sign_many(self, requests):
+        """
+        Signs ``(method, url, params)`` tuples, returning a list of what
+        ``sign`` would for each.
+        """
+        sign = self.sign
+        return [sign(method, url, params) for method, url, params in requests]
+
+    def get_header(self, method, url, params, nonce=None, ext=''):
+        """
+        Returns the value of an ``Authorization: MAC`` header.
+        """
+        nonce, body_hash, mac = self.sign(method, url, params, nonce, ext)
+        header = 'MAC id="%s", nonce="%s", bodyhash="%s", ' % (self.public_key, nonce, body_hash)
+        if ext:
+            header += 'ext="%s", ' % ext
+        return header + 'mac="%s"' % mac
+
+
+def merge_params(params_list, key, size=100):
+    """
+    Combines calls which only differ by the value of ``key`` into calls
+    passing up to ``size`` values of ``key`` at once, for endpoints which
+    accept it multiple times. For instance, with ``key='thread'``:
+
+    [{'forum': 'disqus', 'thread': 1}, {'forum': 'disqus', 'thread': 2}]
+
+    is translated to:
+
+    [({'forum': 'disqus', 'thread': [1, 2], 'limit': 2}, [0, 1])]
+
+    where the second item lists the positions of the merged calls. If
+    ``key`` is None every call is kept as is.
+    """
+    groups = {}
+    calls = []
+    merged_calls = []
+    for index, params in enumerate(params_list):
+        if key is None or key not in params or isinstance(params[key], (list, tuple)):
+            calls.append((params, [index]))
+            continue
+        rest = sorted((k, v) for k, v in compat.iteritems(params) if k != key)
+        group = repr(rest)
+        if group not in groups or len(groups[group][1]) >= size:
+            merged = dict(rest)
+            merged[key] = []
+            groups[group] = (merged, [])
+            calls.append(groups[group])
+            merged_calls.append(merged)
+        merged, indexes = groups[group]
+        merged[key].append(params[key])
+        indexes.append(index)
+    for merged in merged_calls:
+        merged.setdefault('limit', len(merged[key]))
+    return calls
+
+
+def split_merged(results, values):
+    """
+    Matches the objects returned by a merged call back to the ``values``
+    that were asked for, by id. Missing objects come back as None.
+    """
+    by_id = dict((str(r.get('id')), r) for r in results)
+    return [by_id.get(str(v)) for v in values]
+
+
+def spread_results(calls, outcomes, key, count):
+    """
+    The reverse of ``merge_params``: returns the outcome of each of the
+    ``count`` original calls, in order. A merged call which didn't return
+    a list can't be split, so its calls get a ``ValueError``.
+    """
+    from disqusapi import Result
+    results = [None] * count
+    for (params, indexes), outcome in zip(calls, outcomes):
+        if isinstance(outcome, Exception) or not isinstance(params.get(key), list):
+            for index in indexes:
+                results[index] = outcome
+        elif not isinstance(outcome, (list, Result)):
+            error = ValueError('Merging %r needs an endpoint returning a list' % key)
+            for index in indexes:
+                results[index] = error
+        else:
+            for index, obj in zip(indexes, split_merged(outcome, params[key])):
+                results[index] = obj
+    return results
+
+
+def save_json(path, data):
+    """
+    Writes ``data`` to ``path`` as JSON, atomically: readers (and a
+    crash) see either the old file or the new one.
+    """
+    import json
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as fp:
+        json.dump(data, fp)
+    os.rename(tmp, path)
+
+
+def load_json(path, default=None):
+    """
+    Reads ``path`` as JSON, or returns ``default`` if it is missing or
+    damaged.
+    """
+    import json
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+_fork_resets = weakref.WeakSet()
+
+
+def reset_after_fork(obj):
+    """
+    Has ``obj._after_fork()`` called in processes forked from this one
+    (Python 3.7+), where its lock may be held by a thread that wasn't
+    forked along.
+    """
+    _fork_resets.add(obj)
+
+
+def _after_fork():
+    for obj in list(_fork_resets):
+        obj._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
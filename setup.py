@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import os
+import re
+
 from setuptools import setup, find_packages
 from setuptools.command.test import test as TestCommand
 
@@ -16,9 +19,13 @@ class PyTest(TestCommand):
         sys.exit(pytest.main(self.test_args))
 
 
+with open(os.path.join(os.path.dirname(__file__), 'disqusapi', '__init__.py')) as fp:
+    version = re.search(r"^__version__ = '([^']+)'", fp.read(), re.M).group(1)
+
+
 setup(
     name='disqus-python',
-    version='0.4.2',
+    version=version,
     author='DISQUS',
     author_email='opensource@disqus.com',
     url='https://github.com/disqus/disqus-python',
@@ -27,6 +34,11 @@ setup(
     zip_safe=False,
     license='Apache License 2.0',
     install_requires=[],
+    extras_require={
+        'http2': ['httpx[http2]'],
+        'parquet': ['pyarrow'],
+        'orjson': ['orjson'],
+    },
     setup_requires=[],
     tests_require=[
         'pytest',